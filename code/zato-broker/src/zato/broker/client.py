@@ -28,7 +28,7 @@ import redis
 from zato.common import BROKER, ZATO_NONE
 from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
 from zato.common.kvdb import LuaContainer
-from zato.common.util import new_cid, spawn_greenlet
+from zato.common.util import asbool, new_cid, spawn_greenlet
 
 logger = logging.getLogger(__name__)
 has_debug = logger.isEnabledFor(logging.DEBUG)
@@ -39,14 +39,57 @@ FILE_DESCR_CLOSED_IN_ANOTHER_GREENLET = "Error while reading from socket: (9, 'F
 # We use textual messages because some error may have codes whereas different won't.
 EXPECTED_CONNECTION_ERRORS = [REMOTE_END_CLOSED_SOCKET, FILE_DESCR_CLOSED_IN_ANOTHER_GREENLET]
 
-NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
+NEEDS_TMP_KEY_TYPES = (
     MESSAGE_TYPE.TO_PARALLEL_ANY,
-)]
+)
+
+NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in NEEDS_TMP_KEY_TYPES]
 
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
-def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
+# How long to block waiting for new work queue messages before checking whether to keep running, in seconds
+WORK_QUEUE_POP_TIMEOUT = 1
+
+# ################################################################################################################################
+
+def get_work_queue_key(msg_type):
+    return b'zato:broker{}:queue'.format(KEYS[msg_type])
+
+# ################################################################################################################################
+
+class WorkQueue(object):
+    """ A Redis list that messages are pushed onto by publishers and popped off by consumers, each message being delivered
+    to exactly one consumer. Each message is stored along with the time it expires at, after which it will be dropped
+    by whichever consumer pops it.
+    """
+    def __init__(self, conn, key):
+        self.conn = conn
+        self.key = key
+
+    def push(self, msgs, expiration=BROKER.DEFAULT_EXPIRATION, _time=time.time):
+        """ Pushes serialized messages onto the queue, all of them in one round-trip to Redis.
+        """
+        expires = repr(_time() + expiration)
+        self.conn.lpush(self.key, *(b'{};{}'.format(expires, msg) for msg in msgs))
+
+    def pop(self, timeout=WORK_QUEUE_POP_TIMEOUT, _time=time.time):
+        """ Blocks for up to timeout seconds waiting for a message. Returns the deserialized message or None if there was
+        none or if it has already expired.
+        """
+        item = self.conn.brpop(self.key, timeout)
+
+        if item:
+            expires, msg = item[1].split(b';', 1)
+
+            if float(expires) < _time():
+                logger.info('Dropping expired broker message from `%s` (expires:%s)', self.key, expires)
+            else:
+                return loads(msg)
+
+# ################################################################################################################################
+
+def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, use_work_queue=None):
 
     # Imported here so it's guaranteed to be monkey-patched using gevent.monkey.patch_all by whoever called us
     from thread import start_new_thread
@@ -133,14 +176,20 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+        If use_work_queue is True, messages of type 3) are instead pushed onto a Redis list and each one is popped off
+        by exactly one of the clients. Clients that handle such messages always consume from both the list and the topic
+        so publishers can be switched over to the work queue independently of one another.
         """
-        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
+        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs, use_work_queue):
             self.kvdb = kvdb
             self.decrypt_func = kvdb.decrypt_func
             self.name = '{}-{}'.format(client_type, new_cid())
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
             self.ready = False
+            self.use_work_queue = asbool(kvdb.config.get('use_work_queue', False)) if use_work_queue is None else use_work_queue
+            self.keep_consuming = True
 
         def run(self):
             logger.debug('Starting broker client, host:`%s`, port:`%s`, name:`%s`, topics:`%s`',
@@ -152,6 +201,10 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             start_new_thread(self.pub_client.run, ())
             start_new_thread(self.sub_client.run, ())
 
+            for msg_type in NEEDS_TMP_KEY_TYPES:
+                if TOPICS[msg_type] in self.topic_callbacks:
+                    start_new_thread(self.consume_work_queue, (msg_type,))
+
             for client in(self.pub_client, self.sub_client):
                 while client.keep_running == ZATO_NONE:
                     time.sleep(0.01)
@@ -163,22 +216,66 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             self.pub_client.publish(topic, dumps(msg))
 
         def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
-            msg['msg_type'] = msg_type
+            self.invoke_async_many([msg], msg_type, expiration)
+
+        def invoke_async_many(self, msgs, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
+            """ Like invoke_async but sends all of msgs to Redis in a single round-trip.
+            """
+            serialized = []
+
+            for msg in msgs:
+                msg['msg_type'] = msg_type
+
+                try:
+                    serialized.append(str(dumps(msg)))
+                except Exception:
+                    error_msg = 'JSON serialization failed for msg:`%r`, e:`%s`'
+                    logger.error(error_msg, msg, format_exc())
+                    raise
+
+            if not serialized:
+                return
+
+            if self.use_work_queue and msg_type in NEEDS_TMP_KEY_TYPES:
+                WorkQueue(self.kvdb.conn, get_work_queue_key(msg_type)).push(serialized, expiration)
 
-            try:
-                msg = dumps(msg)
-            except Exception:
-                error_msg = 'JSON serialization failed for msg:`%r`, e:`%s`'
-                logger.error(error_msg, msg, format_exc())
-                raise
             else:
                 topic = TOPICS[msg_type]
-                key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
 
-                self.kvdb.conn.set(key, str(msg))
-                self.kvdb.conn.expire(key, expiration)  # In seconds
+                with self.kvdb.conn.pipeline(transaction=False) as pipeline:
+                    for msg in serialized:
+                        key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
+                        pipeline.set(key, msg, ex=expiration)  # In seconds
+                        pipeline.publish(topic, broker_msg)
+                    pipeline.execute()
+
+        def consume_work_queue(self, msg_type):
+            """ Pops messages of a given type off the work queue, each message is handed over to a callback in a new greenlet.
+            """
+            # We are in a new thread so we need a new connection because BRPOP blocks it
+            kvdb = self.kvdb.copy()
+            kvdb.init()
+
+            work_queue = WorkQueue(kvdb.conn, get_work_queue_key(msg_type))
+            callback = self.topic_callbacks[TOPICS[msg_type]]
+
+            while self.keep_consuming:
+                try:
+                    payload = work_queue.pop()
+                    if payload:
+                        payload = Bunch(payload)
+                        if has_debug:
+                            logger.debug('Got broker work queue message payload `%s`', payload)
+
+                        spawn_greenlet(callback, payload)
+
+                except redis.ConnectionError, e:
+                    logger.warn('Caught Redis exception in work queue `%s`, e:`%s`', work_queue.key, e.message)
+                    sleep(1)
+                except Exception:
+                    logger.warn('Could not handle message from work queue `%s`, e:`%s`', work_queue.key, format_exc())
 
-                self.pub_client.publish(topic, broker_msg)
+            kvdb.close()
 
         def on_message(self, msg):
             if has_debug:
@@ -215,11 +312,12 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                         logger.debug('No payload in msg: `%s`', msg)
 
         def close(self):
+            self.keep_consuming = False
             for client in(self.pub_client, self.sub_client):
                 client.keep_running = False
                 client.kvdb.close()
 
-    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
+    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, use_work_queue)
     start_new_thread(client.run, ())
 
     return client
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import deque
+from json import dumps, loads
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import patch
+
+# Zato
+from zato.broker.client import BrokerClient, get_work_queue_key, WorkQueue
+from zato.common.broker_message import MESSAGE_TYPE, TOPICS
+
+# ################################################################################################################################
+
+class FakeRedis(object):
+    """ A stand-in for a Redis connection, implementing only the list commands that work queues need.
+    """
+    def __init__(self):
+        self.lists = {}
+        self.round_trips = 0
+
+    def lpush(self, key, *values):
+        self.round_trips += 1
+        self.lists.setdefault(key, deque()).extendleft(values)
+
+    def brpop(self, key, timeout):
+        self.round_trips += 1
+        items = self.lists.get(key)
+        if items:
+            return key, items.pop()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+# ################################################################################################################################
+
+class FakePipeline(object):
+    """ Buffers commands until execute is called, at which point they are all sent to the connection in one round-trip.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.commands.append(('set', key, value, ex))
+
+    def publish(self, topic, msg):
+        self.commands.append(('publish', topic, msg))
+
+    def execute(self):
+        self.conn.round_trips += 1
+        self.conn.executed = self.commands
+
+# ################################################################################################################################
+
+class FakeKVDB(object):
+    """ A stand-in for zato.common.kvdb.KVDB wrapping a fake connection.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.config = Bunch()
+        self.decrypt_func = None
+
+    def copy(self):
+        return self
+
+    def init(self):
+        pass
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class WorkQueueTestCase(TestCase):
+
+    def test_key(self):
+        self.assertEquals(get_work_queue_key(MESSAGE_TYPE.TO_PARALLEL_ANY), b'zato:broker:to-parallel:any:queue')
+
+    def test_push_pop(self):
+        conn = FakeRedis()
+        key = get_work_queue_key(MESSAGE_TYPE.TO_PARALLEL_ANY)
+
+        # Each consumer has its own work queue object but they all share the same list
+        publisher = WorkQueue(conn, key)
+        consumers = [WorkQueue(conn, key) for _ in range(3)]
+
+        publisher.push([dumps({'idx': idx}) for idx in range(10)])
+        self.assertEquals(conn.round_trips, 1)
+
+        received = []
+        for idx in range(10):
+            received.append(consumers[idx % 3].pop()['idx'])
+
+        # Each message was received by exactly one consumer, in the order it was published in
+        self.assertListEqual(received, list(range(10)))
+        self.assertIsNone(consumers[0].pop())
+
+    def test_expired(self):
+        conn = FakeRedis()
+        work_queue = WorkQueue(conn, 'my.key')
+
+        work_queue.push([dumps({'a': 1})], 10, _time=lambda: 1000)
+        work_queue.push([dumps({'a': 2})], 10, _time=lambda: 2000)
+
+        self.assertIsNone(work_queue.pop(_time=lambda: 1500))
+        self.assertDictEqual(work_queue.pop(_time=lambda: 1500), {'a': 2})
+
+# ################################################################################################################################
+
+class BrokerClientTestCase(TestCase):
+
+    def get_client(self, conn, use_work_queue, topic_callbacks=None):
+
+        # The client is not started so that no background threads connecting to Redis are created
+        with patch('thread.start_new_thread'), patch('zato.broker.client.LuaContainer'):
+            return BrokerClient(FakeKVDB(conn), 'test', topic_callbacks or {}, [], use_work_queue)
+
+    def test_invoke_async_many_topic(self):
+        conn = FakeRedis()
+        client = self.get_client(conn, False)
+
+        client.invoke_async_many([{'idx': idx} for idx in range(3)])
+        self.assertEquals(conn.round_trips, 1)
+
+        # Each message is stored under a key of its own and the key is published to the topic
+        topic = TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]
+        sets = conn.executed[::2]
+        publishes = conn.executed[1::2]
+
+        self.assertListEqual([loads(item[2])['idx'] for item in sets], [0, 1, 2])
+        self.assertListEqual([item[0] for item in sets], ['set'] * 3)
+        self.assertListEqual([item[:2] for item in publishes], [('publish', topic)] * 3)
+        self.assertListEqual([item[2] for item in publishes], [item[1] for item in sets])
+        self.assertEquals(len(set(item[1] for item in sets)), 3)
+
+        # Nothing to send means no round-trips at all
+        client.invoke_async_many([])
+        self.assertEquals(conn.round_trips, 1)
+
+    def test_invoke_async_many_work_queue(self):
+        conn = FakeRedis()
+        client = self.get_client(conn, True)
+
+        client.invoke_async_many([{'idx': idx} for idx in range(3)])
+        self.assertEquals(conn.round_trips, 1)
+
+        work_queue = WorkQueue(conn, get_work_queue_key(MESSAGE_TYPE.TO_PARALLEL_ANY))
+        received = [work_queue.pop() for _ in range(3)]
+
+        self.assertListEqual([msg['idx'] for msg in received], [0, 1, 2])
+        self.assertListEqual([msg['msg_type'] for msg in received], [MESSAGE_TYPE.TO_PARALLEL_ANY] * 3)
+
+        # Messages of types that do not need a temporary key are always published
+        client.publish = lambda *args, **kwargs: None
+        client.invoke_async_many([{'idx': 3}], MESSAGE_TYPE.TO_PARALLEL_ALL)
+        self.assertEquals(conn.round_trips, 5)
+        self.assertEquals(len(conn.executed), 2)
+
+    def test_consume_work_queue(self):
+        conn = FakeRedis()
+        received = []
+
+        def callback(payload):
+            received.append(payload)
+
+            # The first callback fails but this does not stop the consumer ..
+            if len(received) == 1:
+                raise Exception('Callback error')
+
+            # .. which stops once all of the messages are handled.
+            if len(received) == 3:
+                client.keep_consuming = False
+
+        topic = TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]
+        client = self.get_client(conn, True, {topic: callback})
+        client.invoke_async_many([{'idx': idx} for idx in range(3)])
+
+        client.consume_work_queue(MESSAGE_TYPE.TO_PARALLEL_ANY)
+
+        self.assertListEqual([payload.idx for payload in received], [0, 1, 2])
+        self.assertTrue(all(isinstance(payload, Bunch) for payload in received))
+
+# ################################################################################################################################
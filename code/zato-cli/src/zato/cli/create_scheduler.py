@@ -58,6 +58,11 @@ redis_sentinels=
 redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
+use_work_queue=False # Whether messages to any one server process go through a Redis list
+
+[scheduler]
+use_timer_loop=False # Whether all jobs are executed from a single greenlet rather than each from a greenlet of its own
+missed_run_policy=skip # With use_timer_loop, what to do with runs that were missed: skip, catch-up-once or catch-up-all
 
 [secret_keys]
 key1={secret_key1}
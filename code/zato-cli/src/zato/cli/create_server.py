@@ -129,16 +129,19 @@ aws_host=
 use_soap_envelope=True
 fifo_response_buffer_size=0.2 # In MB
 jwt_secret=zato+secret://zato.server_conf.misc.jwt_secret
+jwt_renew_interval=30 # In seconds, how often a JWT in use is checked and has its TTL renewed, 0 = on each request
 enforce_service_invokes=False
 return_tracebacks=True
 default_error_message="An error has occurred"
 startup_callable=
+url_match_cache_size=10000 # How many results of matching URL paths against HTTP channels to keep, 0 = disabled
 
 [ibm_mq]
 ipc_tcp_start_port=34567
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+flush_interval=5 # In seconds, how often each worker writes statistics of services to KVDB
 
 [kvdb]
 host={{kvdb_host}}
@@ -154,6 +157,7 @@ redis_sentinels=
 redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
+use_work_queue=False # Whether messages to any one server process go through a Redis list
 
 [startup_services_first_worker]
 zato.helpers.input-logger=Sample payload for a startup service (first worker)
@@ -222,6 +226,12 @@ log_if_wsx_deliv_server_not_found=False
 data_prefix_len=2048
 data_prefix_short_len=64
 sk_server_table_columns=6, 15, 8, 6, 17, 80
+gd_pub_batch_wait_time=0 # In milliseconds, how long to collect GD publications to a topic to commit them together, 0 = disabled
+gd_pub_batch_max_size=500 # How many GD publications to a topic to commit together at most, a full batch is not waited for
+housekeeping_interval=10 # In seconds, how often to clean up topics and refresh their depths
+housekeeping_batch_size=1000 # How many expired messages to delete in one transaction at most
+delivery_confirm_interval=500 # In milliseconds, how often to confirm delivered GD messages in SQL, 0 = after each delivery
+delivery_confirm_max_size=5000 # How many delivery confirmations to collect at most before confirming them sooner
 
 [pubsub_meta_topic]
 enabled=True
@@ -457,6 +457,10 @@ class CACHE:
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 1000 # In characters for string/unicode, bytes otherwise
+        MAX_SIZE_BYTES = 0 # In bytes, how much RAM all entries of a cache may take up at most, 0 = no limit
+        DELETE_EXPIRED_INTERVAL = 5 # In seconds, how often to delete expired keys
+        SYNC_BATCH_MAX_SIZE = 1000 # How many state changes at most to publish to other workers in one batch
+        SYNC_BATCH_MAX_WAIT = 50 # In milliseconds, how long at most a state change may wait to be published in a batch
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -469,10 +473,11 @@ class CACHE:
     class SYNC_METHOD:
         NO_SYNC = NameId('No synchronization', 'no-sync')
         IN_BACKGROUND = NameId('In background', 'in-background')
+        IN_BACKGROUND_BATCHED = NameId('In background, batched', 'in-background-batched')
 
         class __metaclass__(type):
             def __iter__(self):
-                return iter((self.NO_SYNC, self.IN_BACKGROUND))
+                return iter((self.NO_SYNC, self.IN_BACKGROUND, self.IN_BACKGROUND_BATCHED))
 
 class KVDB(Attrs):
     SEPARATOR = ':::'
@@ -548,6 +553,12 @@ class SCHEDULER:
         DELETE = 'delete'
         INACTIVATE = 'inactivate'
 
+    # What to do with runs of a job that could not be executed on time
+    class MISSED_RUN_POLICY(Attrs):
+        SKIP = 'skip'
+        CATCH_UP_ONCE = 'catch-up-once'
+        CATCH_UP_ALL = 'catch-up-all'
+
 class CHANNEL(Attrs):
     AMQP = 'amqp'
     DELIVERY = 'delivery'
@@ -630,6 +641,8 @@ class BROKER:
 
 class MISC:
     DEFAULT_HTTP_TIMEOUT=10
+    DEFAULT_URL_MATCH_CACHE_SIZE = 10000
+    DEFAULT_JWT_RENEW_INTERVAL = 30
     OAUTH_SIG_METHODS = ['HMAC-SHA1', 'PLAINTEXT']
     PIDFILE = 'pidfile'
     SEPARATOR = ':::'
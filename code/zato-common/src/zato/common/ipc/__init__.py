@@ -52,6 +52,18 @@ class Request(object):
 
 # ################################################################################################################################
 
+class Response(object):
+    """ A reply to a Request, sent back to the process that published it.
+    """
+    def __init__(self, in_reply_to, data):
+        self.in_reply_to = in_reply_to
+        self.data = data
+
+    def __repr__(self):
+        return make_repr(self)
+
+# ################################################################################################################################
+
 class IPCBase(object):
     """ Base class for core IPC objects.
     """
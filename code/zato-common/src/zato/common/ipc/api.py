@@ -9,19 +9,14 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import errno
 import logging
-import os
-import stat
-import tempfile
-from cStringIO import StringIO
-from datetime import datetime, timedelta
-from fcntl import fcntl
+from time import time
 from traceback import format_exc
-from uuid import uuid4
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn
+from gevent.event import AsyncResult
+from gevent.timeout import Timeout
 
 # pyrapidjson
 from rapidjson import loads
@@ -29,8 +24,9 @@ from rapidjson import loads
 # Zato
 from zato.common import IPC
 from zato.common.ipc.publisher import Publisher
+from zato.common.ipc.reply import ReplyReceiver, ReplySender
 from zato.common.ipc.subscriber import Subscriber
-from zato.common.util import fs_safe_name, spawn_greenlet
+from zato.common.util import fs_safe_name, new_cid, spawn_greenlet
 
 # ################################################################################################################################
 
@@ -38,14 +34,6 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
-fifo_create_mode = stat.S_IRUSR | stat.S_IWUSR
-fifo_ignore_err = errno.EAGAIN, errno.EWOULDBLOCK
-
-# On Linux, this is F_LINUX_SPECIFIC_BASE (1024) + 7
-_F_SETPIPE_SZ = 1031
-
-# ################################################################################################################################
-
 class IPCAPI(object):
     """ API through which IPC is performed.
     """
@@ -54,7 +42,10 @@ class IPCAPI(object):
         self.on_message_callback = on_message_callback
         self.pid = pid
         self.pid_publishers = {} # Target PID -> Publisher object connected to that target PID's subscriber socket
+        self.reply_senders = {}  # Reply-to tag -> ReplySender object connected to the socket responses are to be sent to
+        self.pending = {}        # Request ID -> AsyncResult that a response to that request will be set in
         self.subscriber = None
+        self.reply_receiver = None
 
 # ################################################################################################################################
 
@@ -62,10 +53,22 @@ class IPCAPI(object):
     def get_endpoint_name(cluster_name, server_name, target_pid):
         return fs_safe_name('{}-{}-{}'.format(cluster_name, server_name, target_pid))
 
+# ################################################################################################################################
+
+    @staticmethod
+    def get_reply_to_tag(name):
+        return '{}-reply'.format(name)
+
 # ################################################################################################################################
 
     def run(self):
-        self.subscriber = Subscriber(self.on_message_callback, self.name, self.pid)
+
+        # Responses to our own requests from all the other processes are received through a single socket ..
+        self.reply_receiver = ReplyReceiver(self.on_response, self.get_reply_to_tag(self.name), self.pid)
+        spawn_greenlet(self.reply_receiver.serve_forever)
+
+        # .. and requests from other processes are handled each in its own greenlet so as not to block one another.
+        self.subscriber = Subscriber(self.on_request, self.name, self.pid)
         spawn_greenlet(self.subscriber.serve_forever)
 
 # ################################################################################################################################
@@ -73,8 +76,38 @@ class IPCAPI(object):
     def close(self):
         if self.subscriber:
             self.subscriber.close()
+        if self.reply_receiver:
+            self.reply_receiver.close()
         for publisher in self.pid_publishers.values():
             publisher.close()
+        for reply_sender in self.reply_senders.values():
+            reply_sender.close()
+
+# ################################################################################################################################
+
+    def on_request(self, msg):
+        spawn(self.on_message_callback, msg)
+
+# ################################################################################################################################
+
+    def on_response(self, response):
+        pending = self.pending.get(response.in_reply_to)
+
+        # There will be no pending request if we have already stopped waiting for it, e.g. because of a timeout
+        if pending:
+            pending.set(response.data)
+        else:
+            logger.info('Ignoring IPC response to an unknown or timed out request `%s`', response.in_reply_to)
+
+# ################################################################################################################################
+
+    def send_reply(self, reply_to_tag, in_reply_to, data):
+        """ Sends a response to a request that was published with reply_to_tag by another process.
+        """
+        reply_sender = self.reply_senders.get(reply_to_tag)
+        if not reply_sender:
+            reply_sender = self.reply_senders[reply_to_tag] = ReplySender(reply_to_tag, self.pid)
+        reply_sender.send(in_reply_to, data)
 
 # ################################################################################################################################
 
@@ -102,87 +135,94 @@ class IPCAPI(object):
 
 # ################################################################################################################################
 
-    def _get_response(self, fifo, buffer_size, read_size=21, fifo_ignore_err=fifo_ignore_err, empty=('', None)):
-
-        try:
-            buff = StringIO()
-            data = object() # Use a sentinel because '' or None are expected from os.read
+    def _parse_response(self, response):
+        """ Turns a raw response from another process into an (is_success, response) tuple.
+        """
+        status = response[:IPC.STATUS.LENGTH]
+        response = response[IPC.STATUS.LENGTH+1:] # Add 1 to account for the separator
+        is_success = status == IPC.STATUS.SUCCESS
 
-            # The most common use-case for IPC are publish/subscribe messages and the most
-            # common response is this: 'zs;{"r": {"r": null}}'
-            # which is 21 bytes.
+        if is_success:
+            response = loads(response) if response else ''
 
-            while data not in empty:
-                data = os.read(fifo, read_size)
-                buff.write(data)
+        return is_success, response
 
-            response = buff.getvalue()
+# ################################################################################################################################
 
-            status = response[:IPC.STATUS.LENGTH]
-            response = response[IPC.STATUS.LENGTH+1:] # Add 1 to account for the separator
-            is_success = status == IPC.STATUS.SUCCESS
+    def _publish(self, service, payload, cluster_name, server_name, target_pid, is_async):
+        """ Publishes a request to invoke a service in target_pid. Returns ID of the request, which self.pending maps
+        to an AsyncResult that a response will be set in, unless is_async is True, in which case no response is expected.
+        Callers must remove the request from self.pending once they are done with it.
+        """
+        publisher = self._get_pid_publisher(cluster_name, server_name, target_pid)
 
-            if is_success:
-                response = loads(response) if response else ''
+        # Async = we do not need to wait for any response
+        if is_async:
+            publisher.publish(payload, service, target_pid)
+            return
 
-            buff.close()
+        request_id = 'ipc.{}'.format(new_cid())
+        self.pending[request_id] = AsyncResult()
 
-            return is_success, response
+        publisher.publish(payload, service, target_pid, reply_to_tag=self.get_reply_to_tag(self.name), request_id=request_id)
 
-        except OSError, e:
-            if e.errno not in fifo_ignore_err:
-                raise
+        return request_id
 
 # ################################################################################################################################
 
-    def invoke_by_pid(self, service, payload, cluster_name, server_name, target_pid,
-        fifo_response_buffer_size, timeout=90, is_async=False):
+    def invoke_by_pid(self, service, payload, cluster_name, server_name, target_pid, timeout=90, is_async=False):
         """ Invokes a service through IPC, synchronously or in background. If target_pid is an exact PID then this one worker
         process will be invoked if it exists at all.
         """
-        # Create a FIFO pipe to receive replies to come through
-        fifo_path = os.path.join(tempfile.tempdir, 'zato-ipc-fifo-{}'.format(uuid4().hex))
-        os.mkfifo(fifo_path, fifo_create_mode)
+        request_id = None
 
         try:
-            publisher = self._get_pid_publisher(cluster_name, server_name, target_pid)
-            publisher.publish(payload, service, target_pid, reply_to_fifo=fifo_path)
+            request_id = self._publish(service, payload, cluster_name, server_name, target_pid, is_async)
 
-            # Async = we do not need to wait for any response
             if is_async:
                 return
 
-            response = None
+            return self._parse_response(self.pending[request_id].get(timeout=timeout))
+
+        except Timeout:
+            logger.warn('IPC response timeout (%ss), service:`%s`, target_pid:`%s`', timeout, service, target_pid)
+            return False, None
 
-            try:
+        except Exception, e:
+            logger.warn(format_exc(e))
 
-                # Open the pipe for reading ..
-                fifo_fd = os.open(fifo_path, os.O_RDONLY|os.O_NONBLOCK)
-                fcntl(fifo_fd, _F_SETPIPE_SZ, 1000000)
+        finally:
+            if request_id:
+                self.pending.pop(request_id, None)
 
-                # .. and wait for response ..
-                now = datetime.utcnow()
-                until = now + timedelta(seconds=timeout)
+# ################################################################################################################################
 
-                while now < until:
-                    sleep(0.05)
-                    is_success, response = self._get_response(fifo_fd, fifo_response_buffer_size)
-                    if response:
-                        break
-                    else:
-                        now = datetime.utcnow()
+    def invoke_all_pids(self, service, payload, cluster_name, server_name, target_pids, timeout=90, _time=time):
+        """ Invokes a service in all of target_pids concurrently and waits up to timeout seconds in total for their responses.
+        Returns a dictionary of PIDs to (is_success, response) tuples, or to None for PIDs that did not reply in time.
+        """
+        request_ids = {}
+        out = {}
 
-            except Exception:
-                logger.warn('Exception in IPC FIFO, e:`%s`', format_exc())
+        try:
+            # Publish all the requests first ..
+            for pid in target_pids:
+                request_ids[pid] = self._publish(service, payload, cluster_name, server_name, pid, False)
 
-            finally:
-                os.close(fifo_fd)
+            # .. and only then wait for any responses, each of them can use up whatever is left of the overall timeout.
+            until = _time() + timeout
 
-            return is_success, response
+            for pid, request_id in request_ids.items():
+                try:
+                    out[pid] = self._parse_response(self.pending[request_id].get(timeout=max(until - _time(), 0)))
+                except Timeout:
+                    logger.warn('IPC response timeout (%ss), service:`%s`, target_pid:`%s`', timeout, service, pid)
+                    out[pid] = None
+
+            return out
 
-        except Exception, e:
-            logger.warn(format_exc(e))
         finally:
-            os.remove(fifo_path)
+            for request_id in request_ids.values():
+                self.pending.pop(request_id, None)
 
 # ################################################################################################################################
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from errno import ENOTSOCK
+from traceback import format_exc
+
+# ZeroMQ
+import zmq.green as zmq
+
+# Zato
+from zato.common.ipc import IPCEndpoint, Response
+
+# This is needed so that unpickling of responses works
+Response = Response
+
+# ################################################################################################################################
+
+class ReplySender(IPCEndpoint):
+    """ Sends responses to IPC requests back to the process that published them. Each process keeps one such object
+    for each of the other processes it replies to.
+    """
+    socket_method = 'connect'
+    socket_type = 'push'
+
+    def send(self, in_reply_to, data, _flags=zmq.NOBLOCK):
+        self.socket.send_pyobj(Response(in_reply_to, data), _flags)
+
+# ################################################################################################################################
+
+class ReplyReceiver(IPCEndpoint):
+    """ Receives responses to IPC requests that current process published, from all the other processes it invokes.
+    """
+    socket_method = 'bind'
+    socket_type = 'pull'
+
+    def __init__(self, on_response_callback, *args, **kwargs):
+        self.on_response_callback = on_response_callback
+        super(ReplyReceiver, self).__init__(*args, **kwargs)
+
+    def serve_forever(self):
+        while self.keep_running:
+            try:
+                self.on_response_callback(self.socket.recv_pyobj())
+            except zmq.ZMQError as e:
+                if e.errno == ENOTSOCK:
+                    self.logger.debug('Stopping IPC reply socket `%s` (ENOTSOCK)', self.name)
+                    self.keep_running = False
+            except Exception:
+                self.logger.warn('Error in IPC reply receiver, e:`%s`', format_exc())
+
+# ################################################################################################################################
@@ -50,6 +50,9 @@ from zato.common.util.sql import elems_with_opaque
 
 logger = logging.getLogger(__name__)
 
+# How many rows at most to insert or delete in one statement during bulk operations
+bulk_insert_chunk_size = 50
+
 # ################################################################################################################################
 
 # Based on https://bitbucket.org/zzzeek/sqlalchemy/wiki/UsageRecipes/WriteableTuple
@@ -669,6 +672,103 @@ class ODBManager(SessionWrapper):
             logger.error('Could not add service, name:`%s`, e:`%s`', name, format_exc().decode('utf-8'))
             self._session.rollback()
 
+# ################################################################################################################################
+
+    def add_services(self, items, timings=None, _chunk_size=bulk_insert_chunk_size, _time=time):
+        """ Adds information about many of the server's services into the ODB in a single transaction. Each element
+        of items is a Bunch with name, impl_name, is_internal, deployment_time, details and source_info keys.
+        Services not in the ODB yet are inserted, all of them are then added as deployed on this server. Returns a dictionary
+        of service names to (service_id, is_active, slow_threshold) tuples or None if the services could not be added,
+        in which case the caller should add them one by one. If timings is given, it is populated with the number of seconds
+        each phase of the process took.
+        """
+        timings = {} if timings is None else timings
+
+        cluster_id = self.cluster.id
+        server_id = self.server.id
+
+        service_table = Service.__table__
+        ds_table = DeployedService.__table__
+
+        with closing(self.session()) as session:
+            try:
+                supports_multivalues = session.bind.dialect.supports_multivalues_insert
+
+                def _insert(table, rows):
+                    for idx in range(0, len(rows), _chunk_size):
+                        chunk = rows[idx:idx+_chunk_size]
+                        if supports_multivalues:
+                            session.execute(table.insert().values(chunk))
+                        else:
+                            session.execute(table.insert(), chunk)
+
+                def _get_existing():
+                    existing = {}
+                    for item in session.query(Service.id, Service.name, Service.is_active, Service.slow_threshold).\
+                        filter(Service.cluster_id==cluster_id):
+                        existing[item.name] = (item.id, item.is_active, item.slow_threshold)
+                    return existing
+
+                # Find out which services are already in the ODB ..
+                start = _time()
+                existing = _get_existing()
+                timings['odb_query'] = _time() - start
+
+                # .. add any missing ones ..
+                start = _time()
+                missing = {}
+                for item in items:
+                    if item.name not in existing and item.name not in missing:
+                        missing[item.name] = {
+                            'name': item.name,
+                            'is_active': True,
+                            'impl_name': item.impl_name,
+                            'is_internal': item.is_internal,
+                            'cluster_id': cluster_id,
+                        }
+
+                if missing:
+                    _insert(service_table, missing.values())
+                    existing = _get_existing()
+
+                timings['odb_insert_service'] = _time() - start
+
+                # .. replace deployment information about all of them ..
+                start = _time()
+                ds_rows = {}
+                for item in items:
+                    service_id = existing[item.name][0]
+                    ds_rows[service_id] = {
+                        'deployment_time': item.deployment_time,
+                        'details': item.details,
+                        'server_id': server_id,
+                        'service_id': service_id,
+                        'source': item.source_info.source,
+                        'source_path': item.source_info.path,
+                        'source_hash': item.source_info.hash,
+                        'source_hash_method': item.source_info.hash_method,
+                    }
+
+                service_ids = list(ds_rows)
+                for idx in range(0, len(service_ids), _chunk_size):
+                    session.execute(ds_table.delete().\
+                        where(ds_table.c.server_id==server_id).\
+                        where(ds_table.c.service_id.in_(service_ids[idx:idx+_chunk_size])))
+
+                _insert(ds_table, ds_rows.values())
+                timings['odb_insert_deployed_service'] = _time() - start
+
+                # .. and make it all visible to other servers.
+                start = _time()
+                session.commit()
+                timings['odb_commit'] = _time() - start
+
+                return existing
+
+            except Exception:
+                logger.warn('Could not add services in bulk, e:`%s`', format_exc().decode('utf-8'))
+                session.rollback()
+
 # ################################################################################################################################
 
     def drop_deployed_services(self, server_id):
@@ -39,6 +39,9 @@ def delete_msg_delivered(session, cluster_id, topic_id):
         filter(PubSubMessage.pub_msg_id==PubSubEndpointEnqueuedMessage.pub_msg_id)
 
     return session.query(PubSubMessage).\
+        filter(PubSubMessage.cluster_id==cluster_id).\
+        filter(PubSubMessage.topic_id==topic_id).\
+        filter(PubSubMessage.is_in_sub_queue==sa_true()).\
         filter(PubSubMessage.pub_msg_id.notin_(enqueued_subquery)).\
         delete(synchronize_session=False)
 
@@ -55,6 +58,26 @@ def delete_msg_expired(session, cluster_id, topic_id, now):
 
 # ################################################################################################################################
 
+def delete_msg_expired_batch(session, cluster_id, topic_id, now, batch_size):
+    """ Deletes up to batch_size expired messages from a topic and returns the number of messages deleted.
+    Message IDs are selected first because not all databases support LIMIT in subqueries of DELETE statements.
+    """
+    id_list = session.query(PubSubMessage.id).\
+        filter(PubSubMessage.topic_id==topic_id).\
+        filter(PubSubMessage.cluster_id==cluster_id).\
+        filter(PubSubMessage.expiration_time<=now).\
+        limit(batch_size).\
+        all()
+
+    if not id_list:
+        return 0
+
+    return session.query(PubSubMessage).\
+        filter(PubSubMessage.id.in_([elem.id for elem in id_list])).\
+        delete(synchronize_session=False)
+
+# ################################################################################################################################
+
 def _delete_enq_msg_by_status(session, cluster_id, topic_id, status):
     """ Deletes all messages already delivered or the ones that have been explicitly marked for deletion from delivery queues.
     """
@@ -132,6 +132,24 @@ def confirm_pubsub_msg_delivered(session, cluster_id, sub_key, delivered_pub_msg
 
 # ################################################################################################################################
 
+def confirm_pubsub_msg_delivered_by_queue_id(session, cluster_id, endp_msg_queue_id_list, now, _delivered=_delivered,
+    _max_in_size=1000):
+    """ Sets delivery status of enqueued messages, possibly for many sub_keys at once, by their IDs in subscriber queues.
+    Runs one UPDATE for each _max_in_size IDs because some databases limit the number of elements in an IN clause.
+    """
+    for idx in xrange(0, len(endp_msg_queue_id_list), _max_in_size):
+        session.execute(
+            update(PubSubEndpointEnqueuedMessage).\
+            values({
+                'delivery_status': _delivered,
+                'delivery_time': now
+                }).\
+            where(PubSubEndpointEnqueuedMessage.id.in_(endp_msg_queue_id_list[idx:idx+_max_in_size])).\
+            where(PubSubEndpointEnqueuedMessage.cluster_id==cluster_id)
+        )
+
+# ################################################################################################################################
+
 def get_delivery_server_for_sub_key(session, cluster_id, sub_key, is_wsx):
     """ Returns information about which server handles delivery tasks for input sub_key, the latter must exist in DB.
     Assumes that sub_key belongs to a non-WSX endpoint and then checks WebSockets in case the former query founds
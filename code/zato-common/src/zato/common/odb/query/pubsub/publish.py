@@ -35,13 +35,27 @@ _initialized=PUBSUB.DELIVERY_STATUS.INITIALIZED
 def _sql_publish_with_retry(session, cid, cluster_id, topic_id, subscriptions_by_topic, gd_msg_list, now):
     """ A low-level implementation of sql_publish_with_retry.
     """
+    return _sql_publish_batch_with_retry(session, cid, cluster_id, topic_id, [(subscriptions_by_topic, gd_msg_list, now)])
+
+# ################################################################################################################################
+
+def _sql_publish_batch_with_retry(session, cid, cluster_id, topic_id, pub_list):
+    """ A low-level implementation of sql_publish_batch_with_retry.
+    """
+    gd_msg_list = []
+    queue_msgs = []
+
+    for subscriptions_by_topic, msg_list, now in pub_list:
+        gd_msg_list.extend(msg_list)
+        queue_msgs.extend(get_queue_messages(cluster_id, subscriptions_by_topic, msg_list, topic_id, now))
+
     # Publish messages - INSERT rows, each representing an individual message
     if insert_topic_messages(session, cid, gd_msg_list):
 
         # Move messages to each subscriber's queue
-        if subscriptions_by_topic:
+        if queue_msgs:
             try:
-                insert_queue_messages(session, cluster_id, subscriptions_by_topic, gd_msg_list, topic_id, now, cid)
+                sql_op_with_deadlock_retry(cid, 'insert_queue_messages', _insert_queue_messages, session, queue_msgs)
 
                 # No integrity error / no deadlock = all good
                 return True
@@ -72,6 +86,18 @@ def sql_publish_with_retry(*args):
 
 # ################################################################################################################################
 
+def sql_publish_batch_with_retry(*args):
+    """ Like sql_publish_with_retry but for a list of publications to the same topic, each one given as a tuple of
+    (subscriptions_by_topic, gd_msg_list, now). Messages from all the publications are inserted with a single multi-row
+    INSERT for the topic and another one for subscriber queues.
+    """
+    is_ok = False
+
+    while not is_ok:
+        is_ok = _sql_publish_batch_with_retry(*args)
+
+# ################################################################################################################################
+
 def _insert_topic_messages(session, msg_list):
     """ A low-level implementation for insert_topic_messages.
     """
@@ -100,9 +126,8 @@ def _insert_queue_messages(session, queue_msgs):
 
 # ################################################################################################################################
 
-def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list, topic_id, now, cid, _initialized=_initialized):
-    """ Moves messages to each subscriber's queue, i.e. runs an INSERT that adds relevant references to the topic message.
-    Also, updates each message's is_in_sub_queue flag to indicate that it is no longer available for other subscribers.
+def get_queue_messages(cluster_id, subscriptions_by_topic, msg_list, topic_id, now):
+    """ Returns rows to insert into subscriber queues, one for each message and subscriber.
     """
     queue_msgs = []
 
@@ -120,6 +145,16 @@ def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list,
                 'sub_pattern_matched': msg['sub_pattern_matched'][sub.sub_key],
             })
 
+    return queue_msgs
+
+# ################################################################################################################################
+
+def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list, topic_id, now, cid, _initialized=_initialized):
+    """ Moves messages to each subscriber's queue, i.e. runs an INSERT that adds relevant references to the topic message.
+    Also, updates each message's is_in_sub_queue flag to indicate that it is no longer available for other subscribers.
+    """
+    queue_msgs = get_queue_messages(cluster_id, subscriptions_by_topic, msg_list, topic_id, now)
+
     # Move the message to endpoint queues
     return sql_op_with_deadlock_retry(cid, 'insert_queue_messages', _insert_queue_messages, session, queue_msgs)
 
@@ -8,6 +8,9 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+# SQLAlchemy
+from sqlalchemy import func
+
 # Zato
 from zato.common.odb.model import PubSubMessage, PubSubTopic, PubSubSubscription
 from zato.common.odb.query import count
@@ -41,3 +44,15 @@ def get_gd_depth_topic(session, cluster_id, topic_id):
     return count(session, q)
 
 # ################################################################################################################################
+
+def get_gd_depth_all_topics(session, cluster_id):
+    """ Returns a list of (topic_id, depth) tuples for all topics of a cluster that have any messages
+    not moved to subscriber queues yet.
+    """
+    return session.query(MsgTable.c.topic_id, func.count(MsgTable.c.id)).\
+        filter(MsgTable.c.cluster_id==cluster_id).\
+        filter(~MsgTable.c.is_in_sub_queue).\
+        group_by(MsgTable.c.topic_id).\
+        all()
+
+# ################################################################################################################################
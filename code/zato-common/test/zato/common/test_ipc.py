@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import dumps
+from time import time
+from unittest import TestCase
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common import IPC
+from zato.common.ipc.api import IPCAPI
+from zato.common.test import rand_string
+
+# ################################################################################################################################
+
+class IPCAPITestCase(TestCase):
+
+    def setUp(self):
+        self.cluster_name = 'test-cluster-{}'.format(rand_string())
+        self.server_name = 'test-server'
+        self.apis = {}
+
+        for pid in (1, 2, 3):
+            self.apis[pid] = self.get_api(pid)
+
+    def tearDown(self):
+        for api in self.apis.values():
+            api.close()
+
+    def get_api(self, pid):
+        api = IPCAPI(IPCAPI.get_endpoint_name(self.cluster_name, self.server_name, pid), None, pid)
+
+        def on_message_callback(msg):
+
+            # PID 3 never replies in time
+            if pid == 3:
+                sleep(5)
+
+            status = IPC.STATUS.FAILURE if msg.service == 'fail' else IPC.STATUS.SUCCESS
+            data = '{};{}'.format(status, dumps({'pid': pid, 'payload': msg.payload}))
+
+            api.send_reply(msg.reply_to_tag, msg.request_id, data)
+
+        api.on_message_callback = on_message_callback
+        api.run()
+
+        return api
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid(self):
+        api = self.apis[1]
+
+        for payload in ('abc', 'def'):
+            is_success, response = api.invoke_by_pid('my.service', payload, self.cluster_name, self.server_name, 2, 2)
+            self.assertTrue(is_success)
+            self.assertDictEqual(response, {'pid': 2, 'payload': payload})
+
+        # A process can invoke itself too
+        is_success, response = api.invoke_by_pid('my.service', 'abc', self.cluster_name, self.server_name, 1, 2)
+        self.assertTrue(is_success)
+        self.assertEquals(response['pid'], 1)
+
+        is_success, response = api.invoke_by_pid('fail', 'abc', self.cluster_name, self.server_name, 2, 2)
+        self.assertFalse(is_success)
+
+        # No requests are left pending
+        self.assertDictEqual(api.pending, {})
+
+    def test_invoke_all_pids(self):
+        api = self.apis[1]
+
+        start = time()
+        out = api.invoke_all_pids('my.service', 'abc', self.cluster_name, self.server_name, [1, 2, 3], 0.5)
+
+        # PID 3 did not respond but the overall timeout was still respected
+        self.assertLess(time() - start, 2)
+        self.assertIsNone(out[3])
+
+        for pid in (1, 2):
+            is_success, response = out[pid]
+            self.assertTrue(is_success)
+            self.assertDictEqual(response, {'pid': pid, 'payload': 'abc'})
+
+        self.assertDictEqual(api.pending, {})
+
+# ################################################################################################################################
@@ -32,7 +32,8 @@ from mock import patch
 # Zato
 from zato.common import SCHEDULER
 from zato.common.test import is_like_cid, rand_bool, rand_date_utc, rand_int, rand_string
-from zato.scheduler.backend import Interval, Job, Scheduler
+from zato.scheduler.api import Scheduler as APIScheduler
+from zato.scheduler.backend import Interval, Job, Scheduler, TimerScheduler
 
 seed()
 
@@ -819,3 +820,255 @@ class SchedulerTestCase(TestCase):
 
         for idx, item in enumerate(data['runs']):
             self.assertEquals(data['ctx'][idx], item)
+
+class TimerSchedulerTestCase(TestCase):
+
+    def get_scheduler(self, missed_run_policy=None):
+        config = get_scheduler_config()
+        config.missed_run_policy = missed_run_policy
+        scheduler = TimerScheduler(config, None)
+        scheduler.executed = []
+        scheduler._execute = scheduler.executed.append
+
+        return scheduler
+
+    def test_missed_run_policy_invalid(self):
+        self.assertRaises(ValueError, self.get_scheduler, rand_string())
+
+    def test_get_due_run_times(self):
+        scheduler = self.get_scheduler()
+        run_time = datetime.utcnow()
+
+        job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10), run_time, clone_start_time=True)
+
+        # Next run times are always computed from the previous ones, not from the current time
+        due, next_run_time = scheduler._get_due_run_times(job, run_time, run_time + timedelta(seconds=25.5))
+        self.assertListEqual(due, [run_time, run_time + timedelta(seconds=10), run_time + timedelta(seconds=20)])
+        self.assertEquals(next_run_time, run_time + timedelta(seconds=30))
+
+        due, next_run_time = scheduler._get_due_run_times(job, run_time, run_time)
+        self.assertListEqual(due, [run_time])
+        self.assertEquals(next_run_time, run_time + timedelta(seconds=10))
+
+        run_time = datetime(2018, 1, 1, 12, 0, 0)
+        job = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.CRON_STYLE, CronTab('*/5 * * * *'), run_time,
+            clone_start_time=True, cron_definition='*/5 * * * *')
+
+        due, next_run_time = scheduler._get_due_run_times(job, run_time, run_time + timedelta(minutes=12))
+        self.assertListEqual(due, [run_time, run_time + timedelta(minutes=5), run_time + timedelta(minutes=10)])
+        self.assertEquals(next_run_time, run_time + timedelta(minutes=15))
+
+    def test_run_job_missed_run_policy(self):
+        expected = {
+            SCHEDULER.MISSED_RUN_POLICY.SKIP: 0,
+            SCHEDULER.MISSED_RUN_POLICY.CATCH_UP_ONCE: 1,
+            SCHEDULER.MISSED_RUN_POLICY.CATCH_UP_ALL: 3,
+        }
+
+        for policy in expected:
+            for delay, runs in ((0.5, 1), (25.5, expected[policy])):
+                scheduler = self.get_scheduler(policy)
+                run_time = datetime.utcnow()
+
+                job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10), run_time,
+                    clone_start_time=True)
+                scheduler._create(job, False)
+                scheduler._run_job(job, run_time, run_time + timedelta(seconds=delay))
+
+                self.assertEquals(len(scheduler.executed), runs, '{} {}'.format(policy, delay))
+
+                # Either way, the next run is scheduled at the job's regular interval
+                next_run_time = run_time + timedelta(seconds=10 if delay < 10 else 30)
+                self.assertEquals(scheduler.heap[0][0], next_run_time)
+
+    def test_run_job_one_time_late(self):
+
+        for policy in (SCHEDULER.MISSED_RUN_POLICY.SKIP, SCHEDULER.MISSED_RUN_POLICY.CATCH_UP_ONCE,
+            SCHEDULER.MISSED_RUN_POLICY.CATCH_UP_ALL):
+            scheduler = self.get_scheduler(policy)
+            run_time = datetime.utcnow()
+
+            job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.ONE_TIME, Interval(), run_time, clone_start_time=True)
+            scheduler._create(job, False)
+
+            # A one-time job runs once no matter how late it is and the policy in use, after which it is unscheduled
+            scheduler._run_job(job, run_time, run_time + timedelta(hours=1))
+
+            self.assertListEqual(scheduler.executed, [job], policy)
+            self.assertListEqual(scheduler.heap, [], policy)
+            self.assertNotIn('a', scheduler.jobs, policy)
+            self.assertFalse(scheduler._is_scheduled(job), policy)
+
+    def test_create_interval_zero(self):
+        scheduler = self.get_scheduler()
+        start_time = datetime.utcnow()
+
+        # Interval-based jobs whose intervals are not greater than zero are never run ..
+        for name, interval in (('a', Interval()), ('b', Interval(in_seconds=-1))):
+            scheduler.create(Job(rand_int(), name, SCHEDULER.JOB_TYPE.INTERVAL_BASED, interval, start_time,
+                clone_start_time=True))
+
+        self.assertListEqual(scheduler.heap, [])
+
+        # .. unlike one-time jobs, which do not have intervals at all.
+        scheduler.create(Job(rand_int(), 'c', SCHEDULER.JOB_TYPE.ONE_TIME, Interval(), start_time, clone_start_time=True))
+        self.assertEquals(len(scheduler.heap), 1)
+
+        scheduler.max_wait_time = 0.01
+        scheduler.iter_cb = lambda: setattr(scheduler, 'keep_running', False)
+        scheduler.main_loop()
+
+        self.assertEquals(len(scheduler.executed), 1)
+        self.assertEquals(scheduler.executed[0].name, 'c')
+
+    def test_create_edit_delete(self):
+        scheduler = self.get_scheduler()
+        start_time = datetime.utcnow() + timedelta(hours=1)
+
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10), start_time, clone_start_time=True)
+        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10), start_time, clone_start_time=True)
+
+        scheduler.create(job1)
+        scheduler.create(job2)
+        self.assertEquals(len(scheduler.heap), 2)
+
+        # Deleted jobs stay in the heap but are ignored from now on
+        scheduler.unschedule(job1)
+        self.assertEquals(len(scheduler.heap), 2)
+        self.assertEquals(scheduler.stale_heap_entries, 1)
+        self.assertFalse(scheduler._is_scheduled(job1))
+        self.assertTrue(scheduler._is_scheduled(job2))
+
+        # An edit replaces the previous version of a job with a new one
+        job3 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=20), start_time, clone_start_time=True)
+        scheduler.edit(job3)
+
+        self.assertEquals(len(scheduler.heap), 3)
+        self.assertFalse(scheduler._is_scheduled(job2))
+        self.assertEquals(scheduler.jobs['b'].interval.in_seconds, 20)
+
+        scheduler._rebuild_heap()
+        self.assertEquals(len(scheduler.heap), 1)
+        self.assertIs(scheduler.heap[0][2], scheduler.jobs['b'])
+
+    def test_stale_heap_entries_repeated_edit_delete(self):
+        scheduler = self.get_scheduler()
+        start_time = datetime.utcnow()
+
+        def get_job(name='a', is_active=True):
+            return Job(rand_int(), name, SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10), start_time,
+                clone_start_time=True, is_active=is_active)
+
+        # Each edit leaves behind exactly one stale entry ..
+        scheduler.create(get_job())
+        for _ in range(5):
+            scheduler.edit(get_job())
+
+        self.assertEquals(len(scheduler.heap), 6)
+        self.assertEquals(scheduler.stale_heap_entries, 5)
+
+        # .. and so does a deletion, but deleting the job again changes nothing.
+        scheduler.unschedule(get_job())
+        scheduler.unschedule(get_job())
+        self.assertEquals(scheduler.stale_heap_entries, 6)
+
+        # Inactive jobs have no entries in the heap so there is nothing to be counted when they are edited or deleted
+        scheduler.create(get_job('b', False))
+        scheduler.edit(get_job('b', False))
+        scheduler.unschedule(get_job('b'))
+        self.assertEquals(len(scheduler.heap), 6)
+        self.assertEquals(scheduler.stale_heap_entries, 6)
+
+        # Popping stale entries uncounts them, whereas live ones are run and pushed back
+        scheduler.create(get_job('c'))
+        scheduler.max_wait_time = 0.01
+        scheduler.iter_cb = lambda: setattr(scheduler, 'keep_running', False)
+        scheduler.main_loop()
+
+        self.assertEquals(len(scheduler.heap), 1)
+        self.assertEquals(scheduler.stale_heap_entries, 0)
+        self.assertEquals(len(scheduler.executed), 1)
+
+        # No stale entries are left after the heap is rebuilt
+        for _ in range(3):
+            scheduler.edit(get_job('c'))
+
+        self.assertEquals(scheduler.stale_heap_entries, 3)
+        scheduler._rebuild_heap()
+
+        self.assertEquals(len(scheduler.heap), 1)
+        self.assertEquals(scheduler.stale_heap_entries, 0)
+
+        scheduler.unschedule(get_job('c'))
+        self.assertEquals(scheduler.stale_heap_entries, 1)
+
+    def test_run(self):
+
+        data = {'runs':[]}
+
+        def on_job_executed_cb(ctx):
+            data['runs'].append(ctx)
+
+        test_wait_time = 0.5
+        job_max_repeats = 3
+
+        config = get_scheduler_config()
+        config.on_job_executed_cb = on_job_executed_cb
+
+        scheduler = TimerScheduler(config, None)
+        scheduler.init_jobs = lambda: None
+        scheduler.max_wait_time = 0.1
+        scheduler.iter_cb = iter_cb
+        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
+
+        job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
+
+        scheduler.create(job, spawn=False)
+        scheduler.run()
+        sleep(0.1)
+
+        self.assertListEqual([ctx['current_run'] for ctx in data['runs']], [1, 2, 3])
+        self.assertTrue(job.max_repeats_reached)
+        self.assertFalse(job.is_active)
+
+# ################################################################################################################################
+
+class APISchedulerTestCase(TestCase):
+
+    def test_on_job_executed_batch(self):
+
+        class BrokerClient(object):
+            def __init__(self):
+                self.batches = []
+
+            def invoke_async_many(self, msgs):
+                self.batches.append(msgs)
+
+        # Only attributes that on_job_executed needs are set, without connecting to the broker
+        scheduler = APIScheduler.__new__(APIScheduler)
+        scheduler.broker_client = BrokerClient()
+        scheduler.job_msgs = []
+
+        def get_ctx(idx):
+            return {'id':idx, 'name':'job.{}'.format(idx), 'cid':'cid.{}'.format(idx),
+                'type':SCHEDULER.JOB_TYPE.INTERVAL_BASED, 'cb_kwargs':{'service':'my.service', 'extra':idx}}
+
+        # All jobs executed before the scheduler yields to other greenlets are sent to the broker together ..
+        for idx in range(5):
+            scheduler.on_job_executed(get_ctx(idx))
+
+        self.assertListEqual(scheduler.broker_client.batches, [])
+        sleep(0)
+
+        self.assertEquals(len(scheduler.broker_client.batches), 1)
+        self.assertListEqual([msg['payload'] for msg in scheduler.broker_client.batches[0]], list(range(5)))
+        self.assertListEqual(scheduler.job_msgs, [])
+
+        # .. and the next ones start a new batch.
+        scheduler.on_job_executed(get_ctx(5))
+        sleep(0)
+
+        self.assertEquals(len(scheduler.broker_client.batches), 2)
+        self.assertListEqual([msg['cid'] for msg in scheduler.broker_client.batches[1]], ['cid.5'])
+
+# ################################################################################################################################
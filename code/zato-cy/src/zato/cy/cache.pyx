@@ -10,16 +10,21 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 import inspect
 from datetime import datetime
 from decimal import Decimal
-from sys import getsizeof, maxint
+from heapq import heapify, heappop, heappush
+from itertools import islice
+from random import randint
+from sys import getsizeof, maxint, maxunicode
+from types import BuiltinFunctionType, ClassType, FunctionType, MethodType, ModuleType, NoneType
 
 # Cython
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
-    PyDict_Values
+    PyDict_Size, PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
-from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
-from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
-from cpython.sequence cimport PySequence_ITEM
+from cpython.list cimport PyList_GET_SIZE
+from cpython.object cimport PyObject
+from cpython.set cimport PySet_GET_SIZE
 from libc.stdint cimport uint64_t
+from libc.stdlib cimport calloc, free
 from posix.time cimport timeval, timezone, gettimeofday
 
 # regex
@@ -28,6 +33,9 @@ from regex import compile as re_compile
 # six
 from six import binary_type, integer_types, string_types, text_type
 
+# sortedcontainers
+from sortedcontainers import SortedList
+
 # Zato
 from zato.common import CACHE as _COMMON_CACHE
 
@@ -45,6 +53,7 @@ key_types = len_values + integer_types
 class CACHE:
     DEFAULT_SIZE = _COMMON_CACHE.DEFAULT.MAX_SIZE
     MAX_ITEM_SIZE = _COMMON_CACHE.DEFAULT.MAX_ITEM_SIZE
+    MAX_SIZE_BYTES = _COMMON_CACHE.DEFAULT.MAX_SIZE_BYTES
 
 # ################################################################################################################################
 
@@ -81,12 +90,25 @@ cdef class Entry:
         # When will the key expire - computed when the entry is created or updated
         public double expires_at
 
+        # Under what expiration time this entry is currently stored in the expiry index, 0.0 = it is not stored there
+        double indexed_expires_at
+
         # How many times was this key returned
         public uint64_t hits
 
         # This entry's position in index
         public long position
 
+        # Neighbours in the LRU list - prev is closer to the head (most recently used one), next is closer to the tail
+        Entry prev
+        Entry next
+
+        # Logical time at which this entry was last moved to the head of the LRU list, used to compute its position
+        long stamp
+
+        # An estimate of how many bytes this entry takes up, including its key and value
+        public long size_bytes
+
     cpdef dict to_dict(self):
         return {
             'key': self.key,
@@ -99,60 +121,300 @@ cdef class Entry:
             'expires_at': self.expires_at,
             'hits': self.hits,
             'position': self.position,
+            'size_bytes': self.size_bytes,
         }
 
 # ################################################################################################################################
 
+entry_size = getsizeof(Entry())
+
+# ################################################################################################################################
+
+# Objects that are shared by everything that refers to them, e.g. a module or a class, rather than owned by any single value,
+# which is why get_deep_size neither counts nor follows them.
+deep_size_skip_types = (ModuleType, type, ClassType, FunctionType, BuiltinFunctionType, MethodType)
+deep_size_scalars = len_values + integer_types + (float, bool, NoneType)
+
+# How many levels of nested objects and how many objects in total get_deep_size visits at most
+deep_size_max_depth = 20
+deep_size_max_objects = 10000
+
+# ################################################################################################################################
+
+cpdef long get_deep_size(object value, _getsizeof=getsizeof, _len_values=len_values, _sequences=(list, tuple, set, frozenset),
+    _scalars=deep_size_scalars, _skip_types=deep_size_skip_types, long _max_depth=deep_size_max_depth,
+    long _max_objects=deep_size_max_objects) except? -1:
+    """ Returns an estimate of how many bytes a given object takes up in RAM, including all the objects it contains,
+    each of them counted only once. Objects other than built-in containers are followed through their __dict__, if any.
+    Modules, classes, functions and methods are not included and the walk stops after _max_depth levels of nesting
+    or _max_objects objects, whichever comes first, so the result is a lower bound for very large or deep values.
+    """
+    cdef long out
+    cdef long depth
+    cdef Py_ssize_t budget
+    cdef set seen
+    cdef list to_visit
+    cdef list to_visit_next
+    cdef object value_id
+
+    # Fast path for the most common case of values stored as strings, e.g. already serialized to JSON
+    if isinstance(value, _len_values):
+        return _getsizeof(value)
+
+    out = 0
+    depth = 0
+    seen = set()
+    to_visit = [value]
+
+    # Visit objects one level of nesting at a time so as to know when the maximum depth is reached
+    while to_visit and depth < _max_depth:
+        to_visit_next = []
+        depth += 1
+
+        for value in to_visit:
+            value_id = id(value)
+
+            if value_id in seen:
+                continue
+
+            if PySet_GET_SIZE(seen) >= _max_objects:
+                return out
+
+            # Scalars contain no other objects
+            if isinstance(value, _scalars):
+                pass
+
+            # Containers are followed, though there is no point in queueing up more objects than can be still visited
+            elif isinstance(value, dict):
+                budget = max(0, _max_objects - PyList_GET_SIZE(to_visit_next))
+                to_visit_next.extend(islice(value.iterkeys(), budget))
+
+                budget = max(0, _max_objects - PyList_GET_SIZE(to_visit_next))
+                to_visit_next.extend(islice(value.itervalues(), budget))
+
+            elif isinstance(value, _sequences):
+                budget = max(0, _max_objects - PyList_GET_SIZE(to_visit_next))
+                to_visit_next.extend(islice(value, budget))
+
+            # Shared objects are neither counted nor followed - checked only here because this is a relatively slow test
+            elif isinstance(value, _skip_types):
+                continue
+
+            elif hasattr(value, '__dict__'):
+                to_visit_next.append(value.__dict__)
+
+            seen.add(value_id)
+            out += _getsizeof(value)
+
+        to_visit = to_visit_next
+
+    return out
+
+# ################################################################################################################################
+
+cdef class KeyIndex(object):
+    """ A sorted index of string-like keys that returns all keys with a given prefix in O(log n + k) time.
+    Text and bytes keys are kept in separate lists because they cannot be always compared with each other.
+    """
+    cdef:
+        object _text
+        object _bytes
+
+    def __init__(self):
+        self._text = SortedList()
+        self._bytes = SortedList()
+
+    cdef add(self, object key):
+        if isinstance(key, text_type):
+            self._text.add(key)
+        else:
+            self._bytes.add(key)
+
+    cdef remove(self, object key):
+        if isinstance(key, text_type):
+            self._text.remove(key)
+        else:
+            self._bytes.remove(key)
+
+    cdef clear(self):
+        self._text.clear()
+        self._bytes.clear()
+
+    cdef object _get_prefix_end(self, object prefix, object max_char, object to_char):
+        """ Returns the lowest string greater than any string starting with prefix, or None if there is no such string.
+        """
+        cdef long last_char
+
+        while prefix:
+            last_char = ord(prefix[-1])
+            if last_char < max_char:
+                return prefix[:-1] + to_char(last_char + 1)
+            prefix = prefix[:-1]
+
+    cdef list _get_by_prefix(self, object keys, object prefix, object max_char, object to_char):
+        cdef object prefix_end = self._get_prefix_end(prefix, max_char, to_char)
+        cdef Py_ssize_t start = keys.bisect_left(prefix)
+        cdef Py_ssize_t stop = keys.bisect_left(prefix_end) if prefix_end is not None else len(keys)
+
+        return keys[start:stop]
+
+    cdef list get_by_prefix(self, object prefix):
+        """ Returns all keys starting with prefix. Similarly to how Python compares text with bytes,
+        the prefix must be ASCII-only to match keys of the other type.
+        """
+        cdef list out = []
+        cdef object text_prefix = None
+        cdef object bytes_prefix = None
+
+        if isinstance(prefix, text_type):
+            text_prefix = prefix
+            try:
+                bytes_prefix = prefix.encode('ascii')
+            except UnicodeEncodeError:
+                pass
+        else:
+            bytes_prefix = prefix
+            try:
+                text_prefix = prefix.decode('ascii')
+            except UnicodeDecodeError:
+                pass
+
+        if text_prefix is not None and self._text:
+            out.extend(self._get_by_prefix(self._text, text_prefix, maxunicode, unichr))
+
+        if bytes_prefix is not None and self._bytes:
+            out.extend(self._get_by_prefix(self._bytes, bytes_prefix, 255, chr))
+
+        return out
+
+# ################################################################################################################################
+
 cdef class Cache(object):
     """ An LRU cache that optionally rejects entries bigger than N bytes. Entries can have a TTL assigned - periodic processes
     will clean up entries older than allowed.
+
+    LRU order is kept in a doubly-linked list threaded through entries themselves, with the most recently used entry
+    at its head, so that moving an entry to the head or evicting the tail one is O(1). Positions of entries are computed
+    in O(log n) from a Fenwick tree over logical timestamps of when each entry was last moved to the head.
+
+    Optionally, if needs_key_index is True, string-like keys are also stored in sorted indexes, of keys and of reversed keys,
+    which lets *_by_prefix and *_by_suffix methods find matching keys without scanning the whole cache,
+    at the expense of extra memory for the indexes.
+
+    If max_size_bytes is greater than zero, each entry's size in bytes is estimated when it is set, the total is kept
+    in current_size_bytes and least recently used entries are evicted whenever the total would exceed max_size_bytes.
+    Without such a budget, sizes are not estimated at all and current_size_bytes is always zero.
     """
     cdef:
         public long max_size
+        public long max_size_bytes
+        public long current_size_bytes
         public long max_item_size
         public bint has_max_item_size
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
+        public bint needs_key_index
         public dict _data
-        public list _index
+        KeyIndex _prefix_index # Keys as they are
+        KeyIndex _suffix_index # Reversed keys
+        Entry _head
+        Entry _tail
+        long *_positions     # A Fenwick tree - how many entries were moved to the head at a given logical time
+        long _positions_size # Capacity of self._positions, i.e. the greatest logical time that can be used before renumbering
+        long _clock          # Last logical time assigned to an entry moved to the head
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
         public uint64_t get_ops
         public dict hits_per_position # How many times a given position in cache was used
         public list _expired_on_op    # Keys that were found to have expired during a .get or .set operation
+        public list _expiry_index     # A min-heap of (expires_at, key) tuples for entries that may expire
         public object _lock
         public object default_get # A singleton indicating that no default value was given for self.get
         public dict _regex_cache
 
     def __cinit__(self):
         self._data = {}
-        self._index = []
+        self._prefix_index = None
+        self._suffix_index = None
+        self._head = None
+        self._tail = None
+        self._positions = NULL
+        self._positions_size = 0
+        self._clock = 0
+        self.current_size_bytes = 0
         self.hits_per_position = {}
         self._expired_on_op = []
+        self._expiry_index = []
         self.hits = 0
         self.misses = 0
         self.set_ops = 0
         self.get_ops = 0
         self._regex_cache = {}
 
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True,
+        needs_key_index=False, max_size_bytes=None, lock=None):
         self._lock = lock or RLock()
         self.default_get = object()
         with self._lock:
-            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
+            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, needs_key_index,
+                max_size_bytes)
+
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, needs_key_index,
+        max_size_bytes):
+        cdef bint had_max_size_bytes = self.max_size_bytes > 0
 
-    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set):
         self.max_size = max_size or CACHE.DEFAULT_SIZE
+        self.max_size_bytes = max_size_bytes or CACHE.MAX_SIZE_BYTES
         self.max_item_size = max_item_size or CACHE.MAX_ITEM_SIZE
         self.has_max_item_size = self.max_item_size > 0
         self.extend_expiry_on_get = extend_expiry_on_get
         self.extend_expiry_on_set = extend_expiry_on_set
+
+        # Build key indexes if they were just enabled or drop them if they are no longer needed
+        if needs_key_index and not self.needs_key_index:
+            self._prefix_index = KeyIndex()
+            self._suffix_index = KeyIndex()
+            for key in self._data:
+                self._add_key_to_index(key)
+        elif not needs_key_index:
+            self._prefix_index = None
+            self._suffix_index = None
+
+        self.needs_key_index = needs_key_index
         self.hits_per_position.update(dict((key, 0) for key in xrange(self.max_size)))
 
+        # There must always be room for at least as many logical timestamps as there can be entries in cache,
+        # twice as much makes renumbering them, which is O(n), happen only once in max_size operations.
+        self._resize_positions(2 * max(self.max_size, PyDict_Size(self._data)) + 1)
+
+        # Sizes of entries are known only if there is a budget in bytes so they must be estimated if it was just set
+        # and forgotten if it was just removed ..
+        if self.max_size_bytes > 0 and not had_max_size_bytes:
+            self._compute_size_bytes(True)
+        elif self.max_size_bytes <= 0 and had_max_size_bytes:
+            self._compute_size_bytes(False)
+
+        # .. whereas an existing budget may have been just lowered.
+        self._evict_by_size(None)
+
+    cdef _compute_size_bytes(self, bint needs_size):
+        """ Estimates sizes of all entries, or resets them to zero if needs_size is False. Must be called with self._lock held.
+        """
+        cdef Entry entry
+
+        self.current_size_bytes = 0
+        for entry in self._data.itervalues():
+            entry.size_bytes = (entry_size + getsizeof(entry.key) + get_deep_size(entry.value)) if needs_size else 0
+            self.current_size_bytes += entry.size_bytes
+
+    def __dealloc__(self):
+        free(self._positions)
+
     def update_config(self, config):
         with self._lock:
-            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set)
+            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('needs_key_index', False), config.get('max_size_bytes'))
 
 # ################################################################################################################################
 
@@ -164,8 +426,9 @@ cdef class Cache(object):
             get_to_set_ops = (round(1.0 * self.get_ops / self.set_ops, 1)) if self.set_ops and self.get_ops else 'n/a'
             get_to_set_ops = ' ({})'.format(get_to_set_ops)
 
-            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}>'.format(
+            return '<{} at {}, size:{}/{} bytes:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}>'.format(
                 self.__class__.__name__, hex(id(self)), len(self._data), self.max_size,
+                self.current_size_bytes, self.max_size_bytes or 'n/a',
                 self.hits, self.misses, hits_to_misses,
                 self.get_ops, self.set_ops, get_to_set_ops,
                 self.max_item_size
@@ -181,7 +444,7 @@ cdef class Cache(object):
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return PyDict_Size(self._data)
 
 # ################################################################################################################################
 
@@ -198,8 +461,16 @@ cdef class Cache(object):
 # ################################################################################################################################
 
     cpdef list keys_by_position(self):
+        cdef list out = []
+        cdef Entry entry
+
         with self._lock:
-            return list(self._index)
+            entry = self._head
+            while entry is not None:
+                out.append(entry.key)
+                entry = entry.next
+
+        return out
 
 # ################################################################################################################################
 
@@ -229,10 +500,11 @@ cdef class Cache(object):
 
     def get_slice(self, start, stop, step):
         with self._lock:
-            for key in self._index[start:stop:step]:
-                entry = self._data[key]
+            keys = self.keys_by_position()
+            for position in xrange(*slice(start, stop, step).indices(len(keys))):
+                entry = self._data[keys[position]]
                 as_dict = entry.to_dict()
-                as_dict['position'] = self._get_index(key)
+                as_dict['position'] = position
                 yield as_dict
 
 # ################################################################################################################################
@@ -241,11 +513,33 @@ cdef class Cache(object):
         """ Clears the cache - removes all entries and associated metadata.
         """
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
+        cdef Entry entry
+        cdef Entry next_entry
+
         with self._lock:
+
+            # Unlink all entries so as not to leave reference cycles behind
+            entry = self._head
+            while entry is not None:
+                next_entry = entry.next
+                entry.prev = None
+                entry.next = None
+                entry = next_entry
+
+            self._head = None
+            self._tail = None
+            self._renumber()
+
+            if self.needs_key_index:
+                self._prefix_index.clear()
+                self._suffix_index.clear()
+
             self._data.clear()
-            self._index[:] = []
+            self.current_size_bytes = 0
             self.hits_per_position.clear()
+            self.hits_per_position.update(dict.fromkeys(xrange(self.max_size), 0))
             self._expired_on_op[:] = []
+            self._expiry_index[:] = []
             self.hits = 0
             self.misses = 0
             self.set_ops = 0
@@ -254,11 +548,70 @@ cdef class Cache(object):
 # ################################################################################################################################
 
     cdef object _delete(self, object key):
-        cdef object out = self._data[key].value # raise Will KeyError on invalid key so _remove_from_index_by_idx is safe to call
+        cdef Entry entry = <Entry>self._data[key] # Will raise KeyError on invalid key so _unlink is safe to call
         del self._data[key]
-        self._remove_from_index_by_idx(self._get_index(key))
+        self._unlink(entry)
+        self.current_size_bytes -= entry.size_bytes
 
-        return out
+        # Use the key the entry was stored under, e.g. a str one when deleting by an equal unicode key,
+        # because this is the form that the key indexes contain.
+        if self.needs_key_index:
+            self._remove_key_from_index(entry.key)
+
+        return entry.value
+
+# ################################################################################################################################
+
+    cdef _evict_by_size(self, Entry keep):
+        """ Evicts least recently used entries, other than keep, for as long as the cache exceeds its size budget in bytes.
+        Must be called with self._lock held.
+        """
+        cdef Entry victim
+        cdef Entry prev
+
+        if self.max_size_bytes <= 0:
+            return
+
+        victim = self._tail
+        while victim is not None and self.current_size_bytes > self.max_size_bytes:
+            prev = victim.prev
+            if victim is not keep:
+                self._delete(victim.key)
+            victim = prev
+
+# ################################################################################################################################
+
+    cdef inline _add_key_to_index(self, object key):
+        """ Adds a key to prefix and suffix indexes. Must be called with self._lock held.
+        """
+        if isinstance(key, str_types):
+            self._prefix_index.add(key)
+            self._suffix_index.add(key[::-1])
+
+    cdef inline _remove_key_from_index(self, object key):
+        """ Removes a key from prefix and suffix indexes. Must be called with self._lock held.
+        """
+        if isinstance(key, str_types):
+            self._prefix_index.remove(key)
+            self._suffix_index.remove(key[::-1])
+
+# ################################################################################################################################
+
+    cdef list _keys_by_prefix(self, object data):
+        """ Returns all string-like keys starting with data. Must be called with self._lock held.
+        """
+        if self.needs_key_index:
+            return self._prefix_index.get_by_prefix(data)
+        else:
+            return [key for key in self._data if isinstance(key, str_types) and key.startswith(data)]
+
+    cdef list _keys_by_suffix(self, object data):
+        """ Returns all string-like keys ending with data. Must be called with self._lock held.
+        """
+        if self.needs_key_index:
+            return [key[::-1] for key in self._suffix_index.get_by_prefix(data[::-1])]
+        else:
+            return [key for key in self._data if isinstance(key, str_types) and key.endswith(data)]
 
 # ################################################################################################################################
 
@@ -277,22 +630,12 @@ cdef class Cache(object):
         """
         cdef object key
         cdef dict out = {}
-        cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._keys_by_prefix(data):
+                if return_found:
+                    out[key] = (<Entry>self._data[key]).value
+                self._delete(key)
 
         return out
 
@@ -305,22 +648,12 @@ cdef class Cache(object):
         """
         cdef object key
         cdef dict out = {}
-        cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._keys_by_suffix(data):
+                if return_found:
+                    out[key] = (<Entry>self._data[key]).value
+                self._delete(key)
 
         return out
 
@@ -484,38 +817,126 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cdef inline long _get_index(self, object key):
-        """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
+    cdef inline void _positions_add(self, long stamp, long value):
+        """ Adds value to the Fenwick tree's counter of entries moved to the head at a given logical time.
+        """
+        while stamp <= self._positions_size:
+            self._positions[stamp] += value
+            stamp += stamp & -stamp
+
+# ################################################################################################################################
+
+    cdef inline long _positions_sum(self, long stamp):
+        """ Returns the number of entries that were moved to the head at or before a given logical time.
         """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
+        cdef long out = 0
 
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
-                return index_idx
-            index_idx += 1
+        while stamp > 0:
+            out += self._positions[stamp]
+            stamp -= stamp & -stamp
+
+        return out
 
 # ################################################################################################################################
 
-    cpdef object index(self, object key):
-        """ Returns position the key given on input currently holds or None if key is not found.
+    cdef _renumber(self):
+        """ Assigns consecutive logical timestamps to all entries, from the tail to the head, and rebuilds the Fenwick tree
+        accordingly. Called when all timestamps available have been already used up. Must be called with self._lock held.
         """
-        with self._lock:
-            if PyDict_Contains(self._data, key):
-                return self._get_index(key)
+        cdef Entry entry = self._tail
+        cdef long idx
+        cdef long parent_idx
+
+        self._clock = 0
+
+        while entry is not None:
+            self._clock += 1
+            entry.stamp = self._clock
+            entry = entry.prev
+
+        # Each timestamp up to self._clock is used by exactly one entry, which lets the tree be built in O(n)
+        for idx in range(1, self._positions_size + 1):
+            self._positions[idx] = 1 if idx <= self._clock else 0
+
+        for idx in range(1, self._positions_size + 1):
+            parent_idx = idx + (idx & -idx)
+            if parent_idx <= self._positions_size:
+                self._positions[parent_idx] += self._positions[idx]
 
 # ################################################################################################################################
 
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+    cdef _resize_positions(self, long size):
+        """ Allocates a new Fenwick tree for up to size logical timestamps. Must be called with self._lock held.
         """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
+        cdef long *positions = <long *>calloc(size + 1, sizeof(long))
 
-        return index_key
+        if positions is NULL:
+            raise MemoryError()
+
+        free(self._positions)
+        self._positions = positions
+        self._positions_size = size
+        self._renumber()
+
+# ################################################################################################################################
+
+    cdef inline void _link_head(self, Entry entry):
+        """ Inserts an entry at the head of the LRU list. Must be called with self._lock held.
+        """
+        if self._clock == self._positions_size:
+            self._renumber()
+
+        self._clock += 1
+        entry.stamp = self._clock
+        self._positions_add(entry.stamp, 1)
+
+        entry.prev = None
+        entry.next = self._head
+
+        if self._head is not None:
+            self._head.prev = entry
+        else:
+            self._tail = entry
+
+        self._head = entry
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, Entry entry):
+        """ Removes an entry from the LRU list. Must be called with self._lock held.
+        """
+        self._positions_add(entry.stamp, -1)
+
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self._head = entry.next
+
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self._tail = entry.prev
+
+        entry.prev = None
+        entry.next = None
+
+# ################################################################################################################################
+
+    cdef inline long _get_position(self, Entry entry):
+        """ Returns position of an entry in the LRU list, 0 being the head. The entry must be in self._data
+        and this method may be called only with self._lock held.
+        """
+        # Position is the number of entries moved to the head later than the one given on input
+        return PyDict_Size(self._data) - self._positions_sum(entry.stamp)
+
+# ################################################################################################################################
+
+    cpdef object index(self, object key):
+        """ Returns position the key given on input currently holds or None if key is not found.
+        """
+        with self._lock:
+            if PyDict_Contains(self._data, key):
+                return self._get_position(<Entry>PyDict_GetItem(self._data, key))
 
 # ################################################################################################################################
 
@@ -535,17 +956,16 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cdef object _set(self, object key, value, expiry, bint details, dict meta_ref, _getsizeof=getsizeof, _key_types=key_types,
-        _len_values=len_values):
-
+    cdef object _set(self, object key, value, expiry, bint details, dict meta_ref, bint needs_evict_by_size=True,
+        _getsizeof=getsizeof, _key_types=key_types, _len_values=len_values):
+        """ A low-level method to set a key to a given value. Must be called with self._lock held. Callers that set
+        many keys at once in a loop over self._data pass needs_evict_by_size=False and evict entries themselves afterwards.
+        """
         cdef object out = None
         cdef Entry entry
         cdef double _now = self._get_timestamp()
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
-        cdef long hits_per_position
         cdef long len_value
+        cdef long size_bytes
 
         if not isinstance(key, _key_types):
             raise ValueError('Key must be an instance of one of {}'.format(key_types))
@@ -556,6 +976,14 @@ cdef class Cache(object):
                 if len_value > self.max_item_size:
                     raise ValueError('Value too long {} > {}'.format(len_value, self.max_item_size))
 
+        # Estimating sizes is not free so it is done only if there is a budget to enforce
+        if self.max_size_bytes > 0:
+            size_bytes = entry_size + _getsizeof(key) + get_deep_size(value)
+            if size_bytes > self.max_size_bytes:
+                raise ValueError('Value too big {} > {} bytes'.format(size_bytes, self.max_size_bytes))
+        else:
+            size_bytes = 0
+
         # Update total # of .set operations
         self.set_ops += 1
 
@@ -590,13 +1018,15 @@ cdef class Cache(object):
             entry.last_write = _now
             out = entry.value
             entry.value = value
+            self.current_size_bytes += size_bytes - entry.size_bytes
+            entry.size_bytes = size_bytes
 
         # No such key in cache - let's add it.
         else:
 
             # Make sure there is room for the new key
-            if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+            while PyDict_Size(self._data) >= self.max_size:
+                self._delete(self._tail.key)
 
             # Actually insert entry
             entry = Entry()
@@ -609,9 +1039,20 @@ cdef class Cache(object):
             entry.hits = 0
             entry.expiry = expiry
             entry.expires_at = 0.0 if not expiry else _now + expiry
+            entry.size_bytes = size_bytes
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._link_head(entry)
+            self.current_size_bytes += size_bytes
+
+            if self.needs_key_index:
+                self._add_key_to_index(key)
+
+        if needs_evict_by_size:
+            self._evict_by_size(entry)
+
+        # The entry may have just received its expiration time, in which case it needs to be indexed
+        self._index_expiry(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
@@ -636,16 +1077,15 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+            for key in self._keys_by_prefix(data):
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
+                self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -660,16 +1100,15 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+            for key in self._keys_by_suffix(data):
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
+                self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -694,7 +1133,9 @@ cdef class Cache(object):
                     if return_found:
                         entry = <Entry>self._data[key]
                         out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+                    self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -718,7 +1159,9 @@ cdef class Cache(object):
                     if return_found:
                         entry = <Entry>self._data[key]
                         out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+                    self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -742,7 +1185,9 @@ cdef class Cache(object):
                     if return_found:
                         entry = <Entry>self._data[key]
                         out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+                    self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -774,7 +1219,9 @@ cdef class Cache(object):
                     if return_found:
                         entry = <Entry>self._data[key]
                         out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+                    self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -806,7 +1253,9 @@ cdef class Cache(object):
                     if return_found:
                         entry = <Entry>self._data[key]
                         out[key] = entry if details else entry.value
-                    self._set(key, value, expiry, False, None)
+                    self._set(key, value, expiry, False, None, False)
+
+            self._evict_by_size(None)
 
         return out
 
@@ -816,11 +1265,9 @@ cdef class Cache(object):
         """ Returns data for key in cache if present. Otherwise returns None. If 'details' is True,
         returns a dictionary with value and metadata instead of value alone.
         """
-        cdef object _item
         cdef Entry entry
-        cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
+        cdef long index_idx
+        cdef long hits_per_position
         cdef double _now = self._get_timestamp()
 
         try:
@@ -849,7 +1296,7 @@ cdef class Cache(object):
             self.hits += 1
 
             # Current position of that key in index
-            index_idx = self._get_index(key)
+            index_idx = self._get_position(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
@@ -857,11 +1304,10 @@ cdef class Cache(object):
             hits_per_position += 1
             PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
 
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
-
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
+            # Move the entry to the head position unless it already is there.
+            if entry is not self._head:
+                self._unlink(entry)
+                self._link_head(entry)
 
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
@@ -872,9 +1318,9 @@ cdef class Cache(object):
             if self.extend_expiry_on_get and entry.expiry:
                 entry.expires_at = _now + entry.expiry
 
-            # If details are requested, add current position of key to data returned
+            # If details are requested, add current position of key to data returned. The entry keeps its own key,
+            # which may be of a different type than the one given on input, because this is what key indexes contain.
             if details:
-                entry.key = key
                 entry.position = index_idx
                 return entry
 
@@ -900,11 +1346,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    out[key] = self._get(key, self.default_get, details)
+            for key in self._keys_by_prefix(data):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -918,11 +1361,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    out[key] = self._get(key, self.default_get, details)
+            for key in self._keys_by_suffix(data):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1064,12 +1504,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
+            for key in self._keys_by_prefix(data):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1082,12 +1519,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
+            for key in self._keys_by_suffix(data):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1223,6 +1657,37 @@ cdef class Cache(object):
                 if expires_at > entry.expires_at:
                     entry.expiry = expiry
                     entry.expires_at = expires_at
+                    self._index_expiry(entry)
+
+# ################################################################################################################################
+
+    cdef _index_expiry(self, Entry entry):
+        """ Adds an entry to the expiry index unless it does not expire at all or it is already indexed under a time
+        that is not later than its current expiration time. Must be called with self._lock held.
+        """
+        if entry.expires_at and (not entry.indexed_expires_at or entry.expires_at < entry.indexed_expires_at):
+            heappush(self._expiry_index, (entry.expires_at, entry.key))
+            entry.indexed_expires_at = entry.expires_at
+
+            # Items of deleted entries, or of the ones indexed more than once, are removed only when their time comes.
+            # Make sure they do not accumulate if this happens much more often than delete_expired runs.
+            if PyList_GET_SIZE(self._expiry_index) > 2 * PyDict_Size(self._data) + 64:
+                self._rebuild_expiry_index()
+
+# ################################################################################################################################
+
+    cdef _rebuild_expiry_index(self):
+        """ Rebuilds the expiry index out of entries currently in cache. Must be called with self._lock held.
+        """
+        cdef Entry entry
+        cdef list expiry_index = []
+
+        for entry in PyDict_Values(self._data):
+            if entry.indexed_expires_at:
+                expiry_index.append((entry.indexed_expires_at, entry.key))
+
+        heapify(expiry_index)
+        self._expiry_index[:] = expiry_index
 
 # ################################################################################################################################
 
@@ -1232,20 +1697,37 @@ cdef class Cache(object):
         cdef list deleted
         cdef double _now = self._get_timestamp()
         cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef object key
+        cdef Entry entry
 
         with self._lock:
 
             deleted = self._expired_on_op[:]
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
+            # Visit only entries indexed under expiration times that are already in the past. Expiration time of some of them
+            # may have been extended in the meantime, in which case they are indexed again under their current time.
+            while self._expiry_index:
+                expires_at, key = self._expiry_index[0]
+                if expires_at >= _now:
+                    break
+
+                heappop(self._expiry_index)
+
+                # The entry was deleted or it was indexed again under a different expiration time
+                if not PyDict_Contains(self._data, key):
+                    continue
+
+                entry = <Entry>PyDict_GetItem(self._data, key)
+                if entry.indexed_expires_at != expires_at:
+                    continue
+
+                entry.indexed_expires_at = 0.0
+
+                if entry.expires_at and _now > entry.expires_at:
                     self._delete(key)
                     deleted.append(key)
+                else:
+                    self._index_expiry(entry)
 
             # Collect keys deleted by .get operations
             self._expired_on_op[:] = []
@@ -1253,3 +1735,36 @@ cdef class Cache(object):
         return deleted
 
 # ################################################################################################################################
+
+def run():
+    """ Benchmarks .get and .set latency for caches of various sizes - the time per operation should stay flat
+    regardless of how many keys there are in cache.
+    """
+    iters = 100000
+
+    for size in (1000, 10000, 100000, 1000000):
+
+        cache = Cache(size)
+        keys = ['key{}'.format(idx) for idx in xrange(size)]
+        for key in keys:
+            cache.set(key, key, 0.0, False, None)
+
+        # Existing keys, in random order, so that not only the head of the LRU list is read
+        sample = [keys[randint(0, size-1)] for idx in xrange(iters)]
+
+        start = datetime.utcnow()
+        for key in sample:
+            cache.get(key, None, False)
+        get_time = datetime.utcnow() - start
+
+        # New keys only, each .set needs to evict the least recently used entry
+        start = datetime.utcnow()
+        for idx in xrange(iters):
+            cache.set(idx, idx, 0.0, False, None)
+        set_time = datetime.utcnow() - start
+
+        print('size:{} get:{:.3f}us set:{:.3f}us'.format(
+            size, get_time.total_seconds() / iters * 1e6, set_time.total_seconds() / iters * 1e6))
+
+if __name__ == '__main__':
+    run()
@@ -14,6 +14,9 @@ from logging import getLogger
 from operator import itemgetter
 from uuid import uuid4
 
+# Cython
+from libc.stdint cimport uint64_t
+
 # regex
 from regex import compile as re_compile
 
@@ -35,6 +38,191 @@ target_separator = ':::'
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# Apart from {param} placeholders, match targets are compiled to regexes as they are, which means that none of the characters
+# below can be matched literally - a target's literal part ends with the first of them.
+_non_literal_chars = frozenset('{.^$*+?()[]\\|')
+
+# ################################################################################################################################
+
+cpdef object get_literal_prefix(object pattern, _non_literal_chars=_non_literal_chars):
+    """ Returns the part of a match target that can be only matched by a string starting with exactly the same characters.
+    """
+    cdef Py_ssize_t idx
+    cdef object char
+
+    for idx, char in enumerate(pattern):
+        if char in _non_literal_chars:
+            return pattern[:idx]
+
+    return pattern
+
+# ################################################################################################################################
+
+cdef class _RouterNode(object):
+    """ A node of URLRouter's tree, corresponding to a path segment of match targets.
+    """
+    cdef:
+        dict children  # Next path segment -> _RouterNode
+        dict exact     # Last path segment of fully literal match targets -> a list of their channel items
+        list prefixed  # Channel items whose match targets are literal only up to this node
+
+    def __init__(self):
+        self.children = {}
+        self.exact = {}
+        self.prefixed = []
+
+# ################################################################################################################################
+
+cdef class URLRouter(object):
+    """ Finds channel items whose match targets can possibly match an incoming one in time proportional to the number
+    of path segments in the latter, rather than to the number of channels. Match targets are kept in a tree of path segments
+    up to the last full segment of their literal parts. Fully literal targets, i.e. static URLs, are further indexed by their
+    last segments while the remaining ones, with {params} or regex characters, are attached to the tree's nodes as a whole.
+
+    The candidates returned still need to be matched by each one's Matcher. They are sorted by their position
+    in channel_data so the first one that matches is the same one that a linear scan of channel_data would find.
+    """
+    cdef:
+        _RouterNode root
+        dict _order      # id(item) -> position of that item in channel_data
+        dict _locations  # id(item) -> (node, key in node.exact or None if the item is in node.prefixed)
+        long _next_order
+
+    def __init__(self, channel_data=None):
+        self.build(channel_data or [])
+
+    def __len__(self):
+        return len(self._order)
+
+    cdef inline Py_ssize_t size(self):
+        return len(self._order)
+
+# ################################################################################################################################
+
+    cpdef build(self, object channel_data):
+        """ Builds the tree from scratch out of all channel items given on input.
+        """
+        cdef object item
+
+        self.root = _RouterNode()
+        self._order = {}
+        self._locations = {}
+        self._next_order = 0
+
+        for item in channel_data:
+            self.add(item)
+
+# ################################################################################################################################
+
+    cpdef add(self, object item):
+        """ Adds a channel item to the tree. The item will be last in order until set_order is called.
+        """
+        cdef _RouterNode node = self.root
+        cdef _RouterNode child
+        cdef object match_target = item.get('match_target')
+        cdef object literal
+        cdef list segments
+        cdef object segment
+
+        self._order[id(item)] = self._next_order
+        self._next_order += 1
+
+        # Items without a match target, if any, cannot be ever matched
+        if match_target is None:
+            return
+
+        literal = get_literal_prefix(match_target)
+        segments = literal.split('/')
+
+        for segment in segments[:-1]:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _RouterNode()
+            node = child
+
+        if literal == match_target:
+            node.exact.setdefault(segments[-1], []).append(item)
+            self._locations[id(item)] = (node, segments[-1])
+        else:
+            node.prefixed.append(item)
+            self._locations[id(item)] = (node, None)
+
+# ################################################################################################################################
+
+    cpdef remove(self, object item):
+        """ Removes a channel item from the tree, if it is there.
+        """
+        cdef tuple location = self._locations.pop(id(item), None)
+        cdef _RouterNode node
+        cdef list items
+        cdef Py_ssize_t idx
+
+        self._order.pop(id(item), None)
+
+        if location is None:
+            return
+
+        node, key = location
+        items = node.prefixed if key is None else node.exact[key]
+
+        # Compare by identity because different channels may have equal items
+        for idx in range(len(items)):
+            if items[idx] is item:
+                del items[idx]
+                break
+
+        if key is not None and not items:
+            del node.exact[key]
+
+# ################################################################################################################################
+
+    cpdef set_order(self, object channel_data):
+        """ Must be called each time channel_data is re-ordered, e.g. after it has been sorted.
+        """
+        cdef long idx
+        cdef object item
+        cdef dict order = {}
+
+        for idx, item in enumerate(channel_data):
+            order[id(item)] = idx
+
+        self._order = order
+        self._next_order = len(order)
+
+# ################################################################################################################################
+
+    cpdef list get_candidates(self, unicode target):
+        """ Returns, in channel_data order, all channel items whose match targets may match the input one.
+        """
+        cdef list out = []
+        cdef list segments = target.split('/')
+        cdef Py_ssize_t last = len(segments) - 1
+        cdef Py_ssize_t idx
+        cdef _RouterNode node = self.root
+        cdef list exact
+        cdef dict order
+        cdef object item
+
+        for idx in range(last):
+            if node.prefixed:
+                out.extend(node.prefixed)
+            node = node.children.get(segments[idx])
+            if node is None:
+                break
+
+        if node is not None:
+            if node.prefixed:
+                out.extend(node.prefixed)
+            exact = node.exact.get(segments[last])
+            if exact:
+                out.extend(exact)
+
+        if len(out) > 1:
+            order = self._order
+            out = [item for _, item in sorted([(order[id(item)], item) for item in out], key=itemgetter(0))]
+
+        return out
+
 # ################################################################################################################################
 
 cdef class Matcher(object):
@@ -104,18 +292,156 @@ cdef class Matcher(object):
 
 # ################################################################################################################################
 
+cdef class _MatchCacheEntry(object):
+    """ An individual result of URL matching stored in MatchCache.
+    """
+    cdef:
+        object key
+        dict match
+        object item
+        _MatchCacheEntry prev # Closer to the head, i.e. used more recently
+        _MatchCacheEntry next # Closer to the tail, i.e. used less recently
+
+# ################################################################################################################################
+
+cdef class MatchCache(object):
+    """ A bounded LRU cache of URL matching results - match targets map to channel items along with parameters extracted
+    from URL paths. Once max_size is reached, least recently used entries are evicted and max_size = 0 disables the cache.
+    It must be cleared each time any channel changes because a change of one channel may affect what other URL paths match.
+    """
+    cdef:
+        dict _data
+        _MatchCacheEntry _head
+        _MatchCacheEntry _tail
+        public long max_size
+        public uint64_t hits
+        public uint64_t misses
+
+    def __init__(self, max_size=MISC.DEFAULT_URL_MATCH_CACHE_SIZE):
+        self._data = {}
+        self.max_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.set_max_size(max_size)
+
+    def __len__(self):
+        return len(self._data)
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, _MatchCacheEntry entry):
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self._head = entry.next
+
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self._tail = entry.prev
+
+        entry.prev = None
+        entry.next = None
+
+    cdef inline void _link_head(self, _MatchCacheEntry entry):
+        entry.next = self._head
+        if self._head is not None:
+            self._head.prev = entry
+        self._head = entry
+        if self._tail is None:
+            self._tail = entry
+
+    cdef _evict(self, long max_size):
+        while len(self._data) > max_size:
+            del self._data[self._tail.key]
+            self._unlink(self._tail)
+
+# ################################################################################################################################
+
+    cdef _MatchCacheEntry get(self, object key):
+        """ Returns an entry stored under a given key, or None if there is none, and marks it as the most recently used one.
+        """
+        cdef _MatchCacheEntry entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if entry is not self._head:
+            self._unlink(entry)
+            self._link_head(entry)
+
+        return entry
+
+# ################################################################################################################################
+
+    cdef set(self, object key, dict match, object item):
+        """ Stores a new matching result for a key that is not in the cache yet.
+        """
+        cdef _MatchCacheEntry entry
+
+        if self.max_size <= 0:
+            return
+
+        entry = _MatchCacheEntry()
+        entry.key = key
+        entry.match = match
+        entry.item = item
+
+        self._data[key] = entry
+        self._link_head(entry)
+        self._evict(self.max_size)
+
+# ################################################################################################################################
+
+    cpdef set_max_size(self, long max_size):
+        """ Changes the maximum number of entries in the cache, evicting least recently used ones if need be.
+        """
+        self.max_size = max(max_size, 0)
+        self._evict(self.max_size)
+
+# ################################################################################################################################
+
+    cpdef clear(self):
+        """ Removes all entries from the cache, hit/miss counters are kept as they are.
+        """
+        cdef _MatchCacheEntry entry = self._head
+        cdef _MatchCacheEntry next_entry
+
+        # Unlink all entries so as not to leave reference cycles behind
+        while entry is not None:
+            next_entry = entry.next
+            entry.prev = None
+            entry.next = None
+            entry = next_entry
+
+        self._head = None
+        self._tail = None
+        self._data.clear()
+
+# ################################################################################################################################
+
 cdef class CyURLData(object):
+    """ Matches incoming requests against HTTP channels. Channels that may possibly match a given request are looked up
+    in self.router which must be kept in sync with self.channel_data - any item added to or removed from the latter must be
+    also added to or removed from the router, and the router's order must be updated each time channel_data is re-ordered.
+    As a safety net, the router is rebuilt if the number of items in channel_data is different from the router's one.
 
+    Results of matching, including parameters extracted from URL paths, are kept in self.match_cache which must be cleared
+    each time channel_data changes.
+    """
     cdef:
         public list channel_data
-        public dict url_path_cache
-        dict url_target_cache
+        public URLRouter router
+        public MatchCache match_cache
         bint has_trace1
 
-    def __init__(self, channel_data=None):
+    def __init__(self, channel_data=None, match_cache_size=MISC.DEFAULT_URL_MATCH_CACHE_SIZE):
         self.channel_data = channel_data
-        self.url_path_cache = {}
-        self.url_target_cache = {}
+        self.router = URLRouter(channel_data)
+        self.match_cache = MatchCache(match_cache_size)
         self.has_trace1 = logger.isEnabledFor(TRACE1)
 
 # ################################################################################################################################
@@ -125,48 +451,42 @@ cdef class CyURLData(object):
         """ Attemps to match the combination of SOAPt Action and URL path against
         the list of HTTP channel targets.
         """
-        cdef bint needs_user, has_target_in_cache=True
+        cdef bint needs_user
         cdef Matcher matcher
         cdef dict item
+        cdef dict match
         cdef object item_bunch
-        cdef unicode target
-        cdef unicode target_cache_key = (url_path + soap_action) if has_soap_action else url_path
+        cdef unicode target = soap_action + _target_separator + url_path
+        cdef _MatchCacheEntry cached
 
-        try:
-            target = self.url_target_cache[target_cache_key]
-        except KeyError:
-            target = '%s%s%s' % (soap_action, _target_separator, url_path)
-            has_target_in_cache = False
+        if self.router.size() != len(self.channel_data):
+            self.router.build(self.channel_data)
+            self.router.set_order(self.channel_data)
+            self.match_cache.clear()
 
-        # Return from cache if already seen
-        try:
-            return {}, self.url_path_cache[target]
-        except KeyError:
-            needs_user = not url_path.startswith('/zato')
+        # Return from cache if already seen, each caller receives its own copy of parameters because they may be modified
+        cached = self.match_cache.get(target)
+        if cached is not None:
+            return (dict(cached.match) if cached.match else {}), cached.item
 
-            for item in self.channel_data:
-                matcher = item['match_target_compiled']
-                if needs_user and matcher.is_internal:
-                    continue
+        needs_user = not url_path.startswith('/zato')
 
-                match = matcher.match(target)
-                if match is not None:
-                    if self.has_trace1:
-                        _log_trace1(_trace1, 'Matched target:`%s` with:`%r`', target, item)
+        for item in self.router.get_candidates(target):
+            matcher = item['match_target_compiled']
+            if needs_user and matcher.is_internal:
+                continue
 
-                    # Cache that target but only if it's a static URL without dynamic variables
-                    if (not has_target_in_cache) and matcher.is_static:
-                        self.url_target_cache[target_cache_key] = target
+            match = matcher.match(target)
+            if match is not None:
+                if self.has_trace1:
+                    _log_trace1(_trace1, 'Matched target:`%s` with:`%r`', target, item)
 
-                    item_bunch = _bunchify(item)
+                item_bunch = _bunchify(item)
+                self.match_cache.set(target, (dict(match) if match else {}), item_bunch)
 
-                    # Cache that URL if it's a static one, i.e. does not contain dynamically computed variables
-                    if matcher.is_static:
-                        self.url_path_cache[target] = item_bunch
+                return match, item_bunch
 
-                    return match, item_bunch
-
-            return None, None
+        return None, None
 
 # ################################################################################################################################
 
@@ -194,7 +514,20 @@ cdef class CyURLData(object):
                 url_path = '/zato/{}/{}'.format(prefix, str(uuid4()).replace('-', '/'))
                 channel_data.append(self.get_item(url_path, soap_action))
 
-        self.channel_data = tuple(sorted(channel_data, key=itemgetter('name')))
+        self.channel_data = sorted(channel_data, key=itemgetter('name'))
+        self.router.build(self.channel_data)
+
+    def set_up_router_test_data(self, count):
+        """ Sets up count channels, half of them static and half with {params} in their URL paths.
+        """
+        channel_data = []
+
+        for idx in xrange(count // 2):
+            channel_data.append(self.get_item('/api/v1/static/{}/items'.format(idx), ''))
+            channel_data.append(self.get_item('/api/v1/customer/{}/{{cid}}/order/{{oid}}'.format(idx), ''))
+
+        self.channel_data = sorted(channel_data, key=itemgetter('name'))
+        self.router.build(self.channel_data)
 
 # ################################################################################################################################
 
@@ -213,5 +546,44 @@ def run():
 
     print(datetime.utcnow() - start)
 
+# ################################################################################################################################
+
+def run_router(count=10000, iters=10000):
+    """ Compares matching URL paths against count channels through the router with a linear scan of all channels.
+    """
+    url_data = CyURLData([])
+    url_data.set_up_router_test_data(count)
+
+    url_paths = []
+    for idx in xrange(0, count // 2, max(count // 200, 1)):
+        url_paths.append('/api/v1/static/{}/items'.format(idx))
+        url_paths.append('/api/v1/customer/{}/123/order/456'.format(idx))
+
+    targets = ['{}{}'.format(target_separator, url_path) for url_path in url_paths]
+    len_url_paths = len(url_paths)
+
+    for match_cache_size in (0, MISC.DEFAULT_URL_MATCH_CACHE_SIZE):
+        url_data.match_cache.set_max_size(match_cache_size)
+        start = datetime.utcnow()
+
+        for idx in xrange(iters):
+            url_data.match(url_paths[idx % len_url_paths], '', False)
+
+        print('Router, {} channels, match cache size {}, {} matches: {}'.format(
+            count, match_cache_size, iters, datetime.utcnow() - start))
+
+    start = datetime.utcnow()
+
+    for idx in xrange(iters // 100):
+        target = targets[idx % len_url_paths]
+        for item in url_data.channel_data:
+            if item['match_target_compiled'].matcher.match(target):
+                break
+
+    print('Linear scan, {} channels, {} matches: {}'.format(count, iters // 100, datetime.utcnow() - start))
+
+# ################################################################################################################################
+
 if __name__ == '__main__':
     run()
+    run_router()
@@ -13,8 +13,11 @@ from time import sleep
 from unittest import TestCase
 from uuid import uuid4
 
+# Bunch
+from bunch import Bunch
+
 # Zato
-from zato.cache import Cache, KeyExpiredError
+from zato.cache import Cache, get_deep_size, KeyExpiredError
 
 # ################################################################################################################################
 
@@ -29,9 +32,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache()
-        c.set(key1, expected1, 1.0, None)
-        c.set(key2, expected2, 1.0, None)
-        c.set(key3, expected3, 1.0, None)
+        c.set(key1, expected1, 1.0, False, None)
+        c.set(key2, expected2, 1.0, False, None)
+        c.set(key3, expected3, 1.0, False, None)
 
         returned1 = c.get(key1, None, False)
         self.assertEquals(returned1, expected1)
@@ -51,8 +54,8 @@ class CacheTestCace(TestCase):
         key2_expiry = 1000
 
         c = Cache()
-        c.set(key1, expected1, 0.0, None)
-        c.set(key2, expected2, key2_expiry, None)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, key2_expiry, False, None)
 
         returned1 = c.get(key1, None, True)
         sleep(0.01)
@@ -87,9 +90,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache()
-        c.set(key1, expected1, 1.0, None)
-        c.set(key2, expected2, 1.0, None)
-        c.set(key3, expected3, 1.0, None)
+        c.set(key1, expected1, 1.0, False, None)
+        c.set(key2, expected2, 1.0, False, None)
+        c.set(key3, expected3, 1.0, False, None)
 
         # Add one second to be sure that at least that much time elapsed between when keys were stored and current time.
         now = c.get_timestamp() + 1
@@ -129,9 +132,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache(max_size)
-        c.set(key1, expected1, 1.0, None)
-        c.set(key2, expected2, 1.0, None)
-        c.set(key3, expected3, 1.0, None)
+        c.set(key1, expected1, 1.0, False, None)
+        c.set(key2, expected2, 1.0, False, None)
+        c.set(key3, expected3, 1.0, False, None)
 
         # The value of max_size is 2 but we added 3 keys and there were no .get in between .set calls,
         # so we now expect that the first key will have been evicted and only key2 and key3 still exist.
@@ -152,8 +155,8 @@ class CacheTestCace(TestCase):
         expected1_new = 'value1_new'
 
         c = Cache()
-        c.set(key1, expected1, 1.0, None)
-        c.set(key1, expected1_new, 1.0, None)
+        c.set(key1, expected1, 1.0, False, None)
+        c.set(key1, expected1_new, 1.0, False, None)
 
         returned1_a = c.get(key1, None, False)
         returned1_b = c.get(key1, None, True)
@@ -176,7 +179,7 @@ class CacheTestCace(TestCase):
         sleep_time = expiry - expiry * 0.01
 
         c = Cache(extend_expiry_on_get=True)
-        c.set(key1, expected1, expiry, None)
+        c.set(key1, expected1, expiry, False, None)
 
         sleep(sleep_time)
 
@@ -209,7 +212,7 @@ class CacheTestCace(TestCase):
         sleep_time = expiry - expiry * 0.01
 
         c = Cache(extend_expiry_on_get=False)
-        c.set(key1, expected1, expiry, None)
+        c.set(key1, expected1, expiry, False, None)
 
         sleep(sleep_time)
 
@@ -236,9 +239,9 @@ class CacheTestCace(TestCase):
         expected1_new = 'value1_new'
 
         c = Cache(extend_expiry_on_set=True)
-        c.set(key1, expected1, 3.0, None)
+        c.set(key1, expected1, 3.0, False, None)
         sleep(0.11)
-        c.set(key1, expected1_new, 0.0, None)
+        c.set(key1, expected1_new, 0.0, False, None)
 
         returned1_a = c.get(key1, None, False)
         returned1_b = c.get(key1, None, True)
@@ -255,10 +258,10 @@ class CacheTestCace(TestCase):
         expected1_new = 'value1_new'
 
         c = Cache(extend_expiry_on_set=False)
-        c.set(key1, expected1, 0.1, None)
+        c.set(key1, expected1, 0.1, False, None)
         sleep(0.11)
 
-        self.assertRaises(KeyExpiredError, c.set, key1, expected1_new, 0.0, None)
+        self.assertRaises(KeyExpiredError, c.set, key1, expected1_new, 0.0, False, None)
         self.assertEquals(len(c), 0)
         self.assertListEqual(c._expired_on_op, [key1])
 
@@ -276,9 +279,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache(max_size)
-        c.set(key1, expected1, 5.0, None)
-        c.set(key2, expected2, 5.0, None)
-        c.set(key3, expected3, 5.0, None)
+        c.set(key1, expected1, 5.0, False, None)
+        c.set(key2, expected2, 5.0, False, None)
+        c.set(key3, expected3, 5.0, False, None)
 
 
         self.assertEquals(len(c.hits_per_position), 2)
@@ -329,9 +332,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache()
-        c.set(key1, expected1, 0.0, None)
-        c.set(key2, expected2, 0.0, None)
-        c.set(key3, expected3, 0.0, None)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.0, False, None)
 
         c.delete(key1)
 
@@ -349,9 +352,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache()
-        c.set(key1, expected1, 0.1, None)
-        c.set(key2, expected2, 0.0, None)
-        c.set(key3, expected3, 0.03, None)
+        c.set(key1, expected1, 0.1, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.03, False, None)
 
         sleep(0.12)
 
@@ -372,9 +375,9 @@ class CacheTestCace(TestCase):
         key3, expected3 = 'key3', 'value3'
 
         c = Cache()
-        c.set(key1, expected1, 0.03, None)
-        c.set(key2, expected2, 0.0, None)
-        c.set(key3, expected3, 0.05, None)
+        c.set(key1, expected1, 0.03, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.05, False, None)
 
         sleep(0.12)
 
@@ -404,9 +407,9 @@ class CacheTestCace(TestCase):
         c = Cache(max_item_size=6)
 
         # No exception should be raised by the calls below as all values are not greater than max_item_size
-        c.set(key1, expected1, 0.0, None)
-        c.set(key2, expected2, 0.0, None)
-        c.set(key3, expected3, 0.0, None)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.0, False, None)
 
 # ################################################################################################################################
 
@@ -419,12 +422,12 @@ class CacheTestCace(TestCase):
         c = Cache(max_item_size=6)
 
         # The first two must succeed
-        c.set(key1, expected1, 0.0, None)
-        c.set(key2, expected2, 0.0, None)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, 0.0, False, None)
 
         # This fails because expected3 is > than max_item_size
         try:
-            c.set(key3, expected3, 0.0, None)
+            c.set(key3, expected3, 0.0, False, None)
         except ValueError, e:
             self.assertEquals(e.message, 'Value too long 7 > 6')
         else:
@@ -443,10 +446,10 @@ class CacheTestCace(TestCase):
 
         # No exception should be raised by the calls below as all values are numbers
 
-        c.set(key1, expected1, 0.0, None)
-        c.set(key2, expected2, 0.0, None)
-        c.set(key3, expected3, 0.0, None)
-        c.set(key4, expected4, 0.0, None)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.0, False, None)
+        c.set(key4, expected4, 0.0, False, None)
 
         returned1 = c.get(key1, None, False)
         self.assertEquals(returned1, expected1)
@@ -475,9 +478,512 @@ class CacheTestCace(TestCase):
         c = Cache(max_item_size=1)
 
         # No exception should be raised by the calls below value is a non-string Python object
-        c.set(key1, expected1, 0.0, None)
+        c.set(key1, expected1, 0.0, False, None)
 
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_lru_order(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+        key3, expected3 = 'key3', 'value3'
+        key4, expected4 = 'key4', 'value4'
+
+        c = Cache(3)
+        c.set(key1, expected1, 0.0, False, None)
+        c.set(key2, expected2, 0.0, False, None)
+        c.set(key3, expected3, 0.0, False, None)
+
+        self.assertListEqual(c.keys_by_position(), [key3, key2, key1])
+
+        # Reading a key moves it to the head of the list
+        c.get(key1, None, False)
+        self.assertListEqual(c.keys_by_position(), [key1, key3, key2])
+        self.assertEquals(c.index(key1), 0)
+        self.assertEquals(c.index(key3), 1)
+        self.assertEquals(c.index(key2), 2)
+
+        # Deleting a key in the middle of the list shifts all keys behind it by one position
+        c.delete(key3)
+        self.assertListEqual(c.keys_by_position(), [key1, key2])
+        self.assertEquals(c.index(key2), 1)
+
+        # The cache is not full so nothing is evicted ..
+        c.set(key3, expected3, 0.0, False, None)
+        self.assertListEqual(c.keys_by_position(), [key3, key1, key2])
+
+        # .. but now key2 is the least recently used one and will make room for key4.
+        c.set(key4, expected4, 0.0, False, None)
+        self.assertListEqual(c.keys_by_position(), [key4, key3, key1])
+        self.assertIsNone(c.index(key2))
+
+# ################################################################################################################################
+
+    def test_lru_positions_many_keys(self):
+
+        # More operations than there are entries in cache so that positions need to be renumbered a few times
+        max_size = 10
+        c = Cache(max_size)
+
+        for idx in xrange(max_size):
+            c.set(idx, idx, 0.0, False, None)
+
+        for idx in xrange(max_size * 10):
+            key = idx * 7 % max_size
+            expected_position = c.keys_by_position().index(key)
+
+            entry = c.get(key, None, True)
+            self.assertEquals(entry.position, expected_position)
+            self.assertEquals(c.index(key), 0)
+
+        for key in c.keys():
+            self.assertEquals(c.index(key), c.keys_by_position().index(key))
+
+# ################################################################################################################################
+
+    def test_get_slice(self):
+
+        c = Cache()
+        for idx in xrange(5):
+            c.set('key{}'.format(idx), idx, 0.0, False, None)
+
+        items = list(c.get_slice(1, 5, 2))
+
+        self.assertEquals(len(items), 2)
+        self.assertEquals(items[0]['key'], 'key3')
+        self.assertEquals(items[0]['position'], 1)
+        self.assertEquals(items[1]['key'], 'key1')
+        self.assertEquals(items[1]['position'], 3)
+
+# ################################################################################################################################
+
+    def test_clear(self):
+
+        c = Cache(2)
+        c.set('key1', 'value1', 0.0, False, None)
+        c.get('key1', None, False)
+        c.clear()
+
+        self.assertEquals(len(c), 0)
+        self.assertListEqual(c.keys_by_position(), [])
+        self.assertEquals(c.hits_per_position[0], 0)
+
+        # The cache must be still usable after it was cleared
+        c.set('key1', 'value1', 0.0, False, None)
+        self.assertEquals(c.get('key1', None, False), 'value1')
+        self.assertEquals(c.hits_per_position[0], 1)
+
+# ################################################################################################################################
+
+    def test_delete_expired_visits_only_expiring_keys(self):
+
+        c = Cache()
+
+        for idx in xrange(100):
+            c.set('no-expiry-{}'.format(idx), idx, 0.0, False, None)
+
+        c.set('key1', 'value1', 0.01, False, None)
+        c.set('key2', 'value2', 100.0, False, None)
+
+        # Only keys with an expiration time are indexed
+        self.assertEquals(len(c._expiry_index), 2)
+
+        sleep(0.02)
+
+        deleted = c.delete_expired()
+        self.assertListEqual(deleted, ['key1'])
+        self.assertEquals(len(c), 101)
+        self.assertEquals(len(c._expiry_index), 1)
+
+# ################################################################################################################################
+
+    def test_delete_expired_extended_expiry(self):
+
+        # Each .get extends the key's expiration time so it is not deleted by the first .delete_expired call
+        # even though the time it was originally indexed under is already in the past.
+
+        c = Cache(extend_expiry_on_get=True)
+        c.set('key1', 'value1', 0.05, False, None)
+
+        sleep(0.03)
+        c.get('key1', None, False)
+        sleep(0.03)
+
+        self.assertListEqual(c.delete_expired(), [])
+        self.assertIn('key1', c)
+        self.assertEquals(len(c._expiry_index), 1)
+
+        sleep(0.06)
+
+        self.assertListEqual(c.delete_expired(), ['key1'])
+        self.assertNotIn('key1', c)
+        self.assertListEqual(c._expiry_index, [])
+
+# ################################################################################################################################
+
+    def test_delete_expired_stale_index_items(self):
+
+        c = Cache()
+
+        # A key deleted and added again without an expiration time must not be deleted ..
+        c.set('key1', 'value1', 0.01, False, None)
+        c.delete('key1')
+        c.set('key1', 'value1', 0.0, False, None)
+
+        # .. and neither can a key whose expiration time was reset ..
+        c.set('key2', 'value2', 0.01, False, None)
+        c.set('key2', 'value2', 0.0, False, None)
+
+        # .. but a key that received its expiration time from another worker is deleted.
+        c.set('key3', 'value3', 0.0, False, None)
+        c.set_expiration_data('key3', 0.01, c.get_timestamp() + 0.01)
+
+        sleep(0.02)
+
+        self.assertListEqual(c.delete_expired(), ['key3'])
+        self.assertIn('key1', c)
+        self.assertIn('key2', c)
+        self.assertListEqual(c._expiry_index, [])
+
+# ################################################################################################################################
+
+    def _get_key_index_caches(self, max_size=None):
+        """ Returns two caches with the same keys, one of them without and one with key indexes.
+        """
+        keys = ['abc', 'abd', 'ab', 'a', 'b', 'bab', 'cab', 'xab', u'abc-unicode', u'ąbc', u'ab\uffff', '', 1, 2]
+
+        no_index = Cache(max_size)
+        with_index = Cache(max_size, needs_key_index=True)
+
+        for c in no_index, with_index:
+            for key in keys:
+                c.set(key, 'value-{}'.format(repr(key)), 0.0, False, None)
+
+        return no_index, with_index
+
+# ################################################################################################################################
+
+    def test_key_index_get(self):
+
+        no_index, with_index = self._get_key_index_caches()
+        patterns = ['a', 'ab', u'ab', 'abc', 'b', 'c', u'ą', u'ąbc', u'ab\uffff', u'\uffff', '', 'no-such-key']
+
+        for pattern in patterns:
+            self.assertDictEqual(with_index.get_by_prefix(pattern, False), no_index.get_by_prefix(pattern, False))
+            self.assertDictEqual(with_index.get_by_suffix(pattern, False), no_index.get_by_suffix(pattern, False))
+
+        self.assertListEqual(sorted(with_index.get_by_prefix('ab', False)), ['ab', 'abc', u'abc-unicode', 'abd', u'ab\uffff'])
+        self.assertListEqual(sorted(with_index.get_by_suffix('ab', False)), ['ab', 'bab', 'cab', 'xab'])
+
+# ################################################################################################################################
+
+    def test_key_index_set_expire_delete(self):
+
+        no_index, with_index = self._get_key_index_caches()
+
+        for c in no_index, with_index:
+            self.assertTrue(c.expire_by_suffix('b', 100.0))
+            self.assertFalse(c.expire_by_prefix('no-such-key', 100.0))
+            c.set_by_suffix('c', 'new-value', 0.0, False, False)
+
+        for key in no_index.keys():
+            expected = no_index.get(key, None, True)
+            given = with_index.get(key, None, True)
+            self.assertEquals(given.value, expected.value)
+            self.assertEquals(given.expiry, expected.expiry)
+
+        deleted_no_index = no_index.delete_by_prefix('ab', True)
+        deleted_with_index = with_index.delete_by_prefix('ab', True)
+
+        self.assertDictEqual(deleted_with_index, deleted_no_index)
+        self.assertDictEqual(with_index.get_by_prefix('ab', False), {})
+        self.assertDictEqual(with_index.get_by_suffix('ab', False), no_index.get_by_suffix('ab', False))
+
+        self.assertDictEqual(with_index.delete_by_suffix('ab', True), no_index.delete_by_suffix('ab', True))
+        self.assertListEqual(sorted(with_index.keys()), sorted(no_index.keys()))
+
+# ################################################################################################################################
+
+    def test_key_index_non_ascii_bytes(self):
+
+        # Non-ASCII bytes cannot be compared with text so such keys match only bytes patterns
+        c = Cache(needs_key_index=True)
+        c.set(b'ab\xff', 'value1', 0.0, False, None)
+        c.set(u'abc', 'value2', 0.0, False, None)
+
+        found = c.get_by_prefix(b'ab', False)
+        self.assertEquals(len(found), 2)
+        self.assertIn(b'ab\xff', found)
+        self.assertIn(u'abc', found)
+        self.assertListEqual(sorted(c.get_by_prefix(b'ab\xff', False)), [b'ab\xff'])
+        self.assertListEqual(sorted(c.get_by_suffix(b'\xff', False)), [b'ab\xff'])
+        self.assertListEqual(sorted(c.get_by_suffix(u'c', False)), [u'abc'])
+
+# ################################################################################################################################
+
+    def test_key_index_delete_by_other_string_type(self):
+
+        # In Python 2, equal str and unicode keys point to the same entry so either can be used to delete it
+        c = Cache(needs_key_index=True)
+        c.set(b'abc', 'value1', 0.0, False, None)
+        c.set(u'abd', 'value2', 0.0, False, None)
+
+        self.assertEquals(c.delete(u'abc'), 'value1')
+        self.assertEquals(c.delete(b'abd'), 'value2')
+
+        self.assertEquals(len(c), 0)
+        self.assertDictEqual(c.get_by_prefix('ab', False), {})
+        self.assertDictEqual(c.get_by_suffix('c', False), {})
+
+        # Getting an entry's details by a key of the other type does not change the key the entry was stored under
+        c.set(b'abe', 'value4', 0.0, False, None)
+        self.assertEquals(c.get(u'abe', None, True).key, b'abe')
+        self.assertIsInstance(c.get(u'abe', None, True).key, bytes)
+
+        self.assertEquals(c.delete(u'abe'), 'value4')
+        self.assertEquals(len(c), 0)
+        self.assertDictEqual(c.get_by_prefix('ab', False), {})
+
+        # The keys can be added to the index again
+        c.set(u'abc', 'value3', 0.0, False, None)
+        self.assertDictEqual(c.get_by_prefix(b'ab', False), {u'abc': 'value3'})
+
+# ################################################################################################################################
+
+    def test_key_index_eviction_and_clear(self):
+
+        c = Cache(2, needs_key_index=True)
+        c.set('key1', 'value1', 0.0, False, None)
+        c.set('key2', 'value2', 0.0, False, None)
+        c.set('key3', 'value3', 0.0, False, None)
+
+        # key1 was evicted so it must not be returned from the index
+        self.assertListEqual(sorted(c.get_by_prefix('key', False)), ['key2', 'key3'])
+        self.assertListEqual(sorted(c.get_by_suffix('1', False)), [])
+
+        c.clear()
+        self.assertDictEqual(c.get_by_prefix('key', False), {})
+
+        c.set('key4', 'value4', 0.0, False, None)
+        self.assertListEqual(c.get_by_suffix('4', False).keys(), ['key4'])
+
+# ################################################################################################################################
+
+    def test_key_index_update_config(self):
+
+        c = Cache()
+        c.set('key1', 'value1', 0.0, False, None)
+        c.set('key2', 'value2', 0.0, False, None)
+
+        config = Bunch(max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True)
+
+        # Enabling the index populates it with keys already in cache ..
+        config.needs_key_index = True
+        c.update_config(config)
+        self.assertTrue(c.needs_key_index)
+        self.assertListEqual(sorted(c.get_by_prefix('key', False)), ['key1', 'key2'])
+
+        # .. and disabling it makes the cache scan all keys again.
+        config.needs_key_index = False
+        c.update_config(config)
+        self.assertFalse(c.needs_key_index)
+        c.set('key3', 'value3', 0.0, False, None)
+        self.assertListEqual(sorted(c.get_by_prefix('key', False)), ['key1', 'key2', 'key3'])
+
+# ################################################################################################################################
+
+    def test_get_deep_size(self):
+
+        value = 'a' * 100
+        self.assertEquals(get_deep_size(value), sys.getsizeof(value))
+
+        inner = ['b' * 100]
+        self.assertTrue(get_deep_size({'key': inner}) > get_deep_size('b' * 100) + sys.getsizeof({}))
+
+        # Objects referenced more than once are counted once
+        self.assertEquals(get_deep_size([inner, inner]), sys.getsizeof([inner, inner]) + get_deep_size(inner))
+
+        # Cycles are not followed indefinitely
+        cycle = []
+        cycle.append(cycle)
+        self.assertEquals(get_deep_size(cycle), sys.getsizeof(cycle))
+
+# ################################################################################################################################
+
+    def test_get_deep_size_bounded(self):
+
+        class MyClass(object):
+            pass
+
+        class MyOldStyleClass:
+            pass
+
+        # Modules, classes, functions and methods are shared rather than owned by a value so they are not included
+        value = MyClass()
+        value.module = sys
+        value.cls = MyClass
+        value.old_style_cls = MyOldStyleClass
+        value.func = get_deep_size
+        value.method = self.test_get_deep_size_bounded
+        value.builtin = len
+
+        self.assertEquals(get_deep_size(value), sys.getsizeof(value) + sys.getsizeof(value.__dict__) +
+            sum(sys.getsizeof(key) for key in value.__dict__))
+
+        # Deeply nested values are followed only up to a certain depth ..
+        nested = []
+        for _ in range(1000):
+            nested = [nested]
+        self.assertTrue(get_deep_size(nested) < sys.getsizeof([[]]) * 50)
+
+        # .. and only up to a certain number of objects are visited.
+        many = [[idx] for idx in xrange(100000)]
+        self.assertTrue(get_deep_size(many) < sum(sys.getsizeof(elem) for elem in many))
+
+        # Containers larger than the limit of objects are still counted, including ones that come after them
+        dict1 = dict((idx, 'a{}'.format(idx)) for idx in xrange(1000))
+        dict2 = dict((idx, 'b{}'.format(idx)) for idx in xrange(1000))
+
+        size = get_deep_size([dict1, dict2], _max_objects=100)
+        self.assertTrue(size >= sys.getsizeof([dict1, dict2]) + sys.getsizeof(dict1) + sys.getsizeof(dict2))
+
+        # .. and, with the default limits, so are dicts bigger than these limits.
+        big = dict((idx, 'c' * 100) for idx in xrange(50000))
+        self.assertTrue(get_deep_size(big) > sys.getsizeof(big))
+
+        # The same limits apply when values are stored in a cache
+        c = Cache(max_size_bytes=10 ** 9)
+        c.set('key1', value, 0.0, False, None)
+        c.set('key2', nested, 0.0, False, None)
+        c.set('key3', many, 0.0, False, None)
+
+        size1 = c.get('key1', None, True).size_bytes
+        size3 = c.get('key3', None, True).size_bytes
+        self.assertEquals(size1 - get_deep_size(value), size3 - get_deep_size(many))
+
+# ################################################################################################################################
+
+    def test_current_size_bytes_update_config(self):
+
+        c = Cache()
+        c.set('key1', 'a' * 1000, 0.0, False, None)
+        c.set('key2', 'b' * 1000, 0.0, False, None)
+        self.assertEquals(c.current_size_bytes, 0)
+
+        config = Bunch(max_size=None, max_item_size=-1, extend_expiry_on_get=True, extend_expiry_on_set=True)
+
+        # Setting a budget estimates sizes of entries already in cache ..
+        config.max_size_bytes = 100000
+        c.update_config(config)
+
+        entry1 = c.get('key1', None, True)
+        entry2 = c.get('key2', None, True)
+
+        self.assertTrue(entry1.size_bytes > 1000)
+        self.assertEquals(c.current_size_bytes, entry1.size_bytes + entry2.size_bytes)
+
+        # .. and removing it resets them.
+        config.max_size_bytes = 0
+        c.update_config(config)
+
+        self.assertEquals(c.current_size_bytes, 0)
+        self.assertEquals(c.get('key1', None, True).size_bytes, 0)
+
+# ################################################################################################################################
+
+    def test_current_size_bytes(self):
+
+        # Without a budget in bytes, sizes are not estimated at all
+        c = Cache()
+        c.set('key1', 'a' * 100, 0.0, False, None)
+        self.assertEquals(c.current_size_bytes, 0)
+        self.assertEquals(c.get('key1', None, True).size_bytes, 0)
+
+        c = Cache(max_size_bytes=100000)
+        self.assertEquals(c.current_size_bytes, 0)
+
+        c.set('key1', 'a' * 100, 0.0, False, None)
+        c.set('key2', {'data': ['b' * 1000]}, 0.0, False, None)
+
+        entry1 = c.get('key1', None, True)
+        entry2 = c.get('key2', None, True)
+
+        self.assertTrue(entry2.size_bytes > 1000)
+        self.assertEquals(c.current_size_bytes, entry1.size_bytes + entry2.size_bytes)
+
+        # Replacing a value changes the size of its entry ..
+        c.set('key2', 'c', 0.0, False, None)
+        entry2 = c.get('key2', None, True)
+        self.assertTrue(entry2.size_bytes < 1000)
+        self.assertEquals(c.current_size_bytes, entry1.size_bytes + entry2.size_bytes)
+
+        # .. as does deleting it ..
+        c.delete('key1')
+        self.assertEquals(c.current_size_bytes, entry2.size_bytes)
+
+        # .. or clearing the whole cache.
+        c.clear()
+        self.assertEquals(c.current_size_bytes, 0)
+
+# ################################################################################################################################
+
+    def test_max_size_bytes_eviction(self):
+
+        value = 'a' * 900
+        c = Cache(max_item_size=-1, max_size_bytes=100000)
+        c.set('key0', value, 0.0, False, None)
+        entry_size = c.current_size_bytes
+
+        c = Cache(max_item_size=-1, max_size_bytes=entry_size * 3)
+        for idx in range(3):
+            c.set('key{}'.format(idx), value, 0.0, False, None)
+
+        self.assertEquals(len(c), 3)
+
+        # Make key0 the most recently used one so that key1 is evicted first
+        c.get('key0', None, False)
+        c.set('key3', value, 0.0, False, None)
+
+        self.assertEquals(len(c), 3)
+        self.assertListEqual(c.keys_by_position(), ['key3', 'key0', 'key2'])
+        self.assertTrue(c.current_size_bytes <= c.max_size_bytes)
+
+        # Growing an existing entry evicts other ones but never the entry itself
+        c.set('key2', value * 2, 0.0, False, None)
+        self.assertListEqual(sorted(c.keys()), ['key2', 'key3'])
+        self.assertTrue(c.current_size_bytes <= c.max_size_bytes)
+
+        # Values that would not fit in an empty cache are rejected
+        self.assertRaises(ValueError, c.set, 'key4', value * 4, 0.0, False, None)
+
+# ################################################################################################################################
+
+    def test_max_size_bytes_set_by_prefix_and_update_config(self):
+
+        c = Cache(max_item_size=-1, max_size_bytes=100000)
+        for idx in range(4):
+            c.set('key{}'.format(idx), 'a', 0.0, False, None)
+
+        c.max_size_bytes = c.current_size_bytes + 2000
+
+        # Setting many keys at once evicts least recently used entries only after all of them have been set
+        c.set_by_prefix('key', 'b' * 1000, 0.0, False, False)
+        self.assertTrue(c.current_size_bytes <= c.max_size_bytes)
+        self.assertTrue(len(c) < 4)
+
+        # Lowering the budget evicts the least recently used entries immediately
+        len_before = len(c)
+        tail = c.keys_by_position()[-1]
+
+        config = Bunch(max_size=None, max_item_size=-1, extend_expiry_on_get=True, extend_expiry_on_set=True,
+            max_size_bytes=c.current_size_bytes - 1)
+        c.update_config(config)
+
+        self.assertTrue(c.current_size_bytes <= c.max_size_bytes)
+        self.assertEquals(len(c), len_before - 1)
+        self.assertNotIn(tail, c)
+
 # ################################################################################################################################
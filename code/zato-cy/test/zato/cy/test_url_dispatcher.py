@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from operator import itemgetter
+from unittest import TestCase
+
+# Zato
+from zato.url_dispatcher import CyURLData, get_literal_prefix, Matcher, MatchCache, URLRouter
+
+# ################################################################################################################################
+
+def get_item(name, url_path, soap_action='', match_slash=True):
+    match_target = '{}:::{}'.format(soap_action, url_path)
+    return {
+        'name': name,
+        'match_target': match_target,
+        'match_target_compiled': Matcher(match_target, match_slash),
+    }
+
+# ################################################################################################################################
+
+class URLRouterTestCase(TestCase):
+
+    def get_channel_data(self):
+        return sorted([
+            get_item('a1', '/customer/{cid}'),
+            get_item('a2', '/customer/{cid}/order/{oid}', match_slash=False),
+            get_item('a3', '/customer/me'),
+            get_item('a4', '/customer/me/order/{oid}'),
+            get_item('a5', '/customer/{cid}/order', 'aaabbbccc'),
+            get_item('a6', '/static/path'),
+            get_item('a7', '/static/path', 'soap-action'),
+            get_item('a8', '/file{name}.json'),
+            get_item('a9', '/dotted.path'),
+            get_item('b1', '/static/{x}-{y}/end'),
+            get_item('b2', '{anything}'),
+            get_item('b3', '/zato/ping'),
+            get_item('b4', '/'),
+        ], key=itemgetter('name'))
+
+    def match_linear(self, channel_data, target):
+        for item in channel_data:
+            match = item['match_target_compiled'].matcher.match(target)
+            if match:
+                return item
+
+# ################################################################################################################################
+
+    def test_get_literal_prefix(self):
+        self.assertEquals(get_literal_prefix(':::/customer/me'), ':::/customer/me')
+        self.assertEquals(get_literal_prefix(':::/customer/{cid}/order'), ':::/customer/')
+        self.assertEquals(get_literal_prefix(':::/dotted.path'), ':::/dotted')
+        self.assertEquals(get_literal_prefix('{anything}'), '')
+
+# ################################################################################################################################
+
+    def test_candidates_same_as_linear_scan(self):
+        channel_data = self.get_channel_data()
+        router = URLRouter(channel_data)
+
+        targets = [
+            ':::/customer/123', ':::/customer/123/order/456', ':::/customer/1/2/order/3', ':::/customer/me',
+            ':::/customer/me/order/1', 'aaabbbccc:::/customer/123/order', ':::/static/path', 'soap-action:::/static/path',
+            ':::/file123.json', ':::/fileabc.json/more', ':::/dotted.path', ':::/dottedXpath', ':::/static/1-2/end',
+            ':::/zato/ping', ':::/', ':::/no/such/path', 'no-such-action:::/static/path', '',
+        ]
+
+        for target in targets:
+            expected = self.match_linear(channel_data, target)
+            candidates = router.get_candidates(target)
+
+            if expected is None:
+                self.assertIsNone(self.match_linear(candidates, target), target)
+            else:
+                self.assertIs(self.match_linear(candidates, target), expected, target)
+
+            # Candidates are always returned in channel_data order
+            self.assertListEqual(candidates, [item for item in channel_data if item in candidates])
+
+# ################################################################################################################################
+
+    def test_static_lookup_is_exact(self):
+        channel_data = [get_item('a{}'.format(idx), '/static/{}'.format(idx)) for idx in range(1000)]
+        router = URLRouter(channel_data)
+
+        candidates = router.get_candidates(':::/static/123')
+        self.assertEquals(len(candidates), 1)
+        self.assertIs(candidates[0], channel_data[123])
+
+        self.assertListEqual(router.get_candidates(':::/static/1000'), [])
+
+# ################################################################################################################################
+
+    def test_add_remove_set_order(self):
+        item1 = get_item('a1', '/customer/{cid}')
+        item2 = get_item('a2', '/customer/me')
+        item3 = get_item('a3', '/customer/{cid}')
+
+        router = URLRouter()
+        router.add(item2)
+        router.add(item1)
+        self.assertEquals(len(router), 2)
+
+        # Until set_order is called, items are in the order they were added in ..
+        self.assertListEqual(router.get_candidates(':::/customer/me'), [item2, item1])
+
+        # .. and afterwards, in the order given on input.
+        router.set_order([item1, item2])
+        self.assertListEqual(router.get_candidates(':::/customer/me'), [item1, item2])
+
+        # Equal items are still told apart on removal
+        router.add(item3)
+        router.remove(item3)
+        self.assertEquals(len(router), 2)
+        self.assertListEqual(router.get_candidates(':::/customer/me'), [item1, item2])
+
+        router.remove(item1)
+        self.assertListEqual(router.get_candidates(':::/customer/me'), [item2])
+        self.assertListEqual(router.get_candidates(':::/customer/123'), [])
+
+        # Removing items no longer in the router is a no-op
+        router.remove(item1)
+        self.assertEquals(len(router), 1)
+
+# ################################################################################################################################
+
+class CyURLDataTestCase(TestCase):
+
+    def test_match(self):
+        channel_data = [
+            get_item('a1', '/customer/{cid}/order/{oid}'),
+            get_item('a2', '/customer/me'),
+        ]
+        url_data = CyURLData(channel_data)
+
+        match, item = url_data.match('/customer/123/order/456', '', False)
+        self.assertDictEqual(match, {'cid': '123', 'oid': '456'})
+        self.assertEquals(item.name, 'a1')
+
+        match, item = url_data.match('/customer/me', '', False)
+        self.assertDictEqual(match, {})
+        self.assertEquals(item.name, 'a2')
+
+        match, item = url_data.match('/customer', '', False)
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
+    def test_match_channel_data_changed_directly(self):
+        url_data = CyURLData([])
+        url_data.channel_data.append(get_item('a1', '/customer/{cid}'))
+
+        match, item = url_data.match('/customer/123', '', False)
+        self.assertDictEqual(match, {'cid': '123'})
+        self.assertEquals(item.name, 'a1')
+
+# ################################################################################################################################
+
+    def test_match_cache(self):
+        url_data = CyURLData([get_item('a1', '/customer/{cid}'), get_item('a2', '/customer/me')])
+        match_cache = url_data.match_cache
+
+        match1, item1 = url_data.match('/customer/123', '', False)
+        self.assertEquals(match_cache.misses, 1)
+        self.assertEquals(match_cache.hits, 0)
+
+        # Dynamic matches are cached too ..
+        match2, item2 = url_data.match('/customer/123', '', False)
+        self.assertEquals(match_cache.misses, 1)
+        self.assertEquals(match_cache.hits, 1)
+        self.assertDictEqual(match2, {'cid': '123'})
+        self.assertIs(item2, item1)
+
+        # .. but each caller receives its own copy of parameters.
+        self.assertIsNot(match2, match1)
+        match2['cid'] = 'abc'
+        self.assertDictEqual(url_data.match('/customer/123', '', False)[0], {'cid': '123'})
+
+        # SOAP actions are part of cache keys
+        self.assertEquals(url_data.match('/customer/123', 'my-action', True), (None, None))
+        self.assertEquals(len(match_cache), 1)
+
+        # Items that did not match anything are not cached
+        self.assertEquals(url_data.match('/no/such/path', '', False), (None, None))
+        self.assertEquals(len(match_cache), 1)
+
+    def test_match_cache_max_size(self):
+        url_data = CyURLData([get_item('a1', '/customer/{cid}')], 2)
+
+        url_data.match('/customer/1', '', False)
+        url_data.match('/customer/2', '', False)
+        url_data.match('/customer/1', '', False)
+        url_data.match('/customer/3', '', False)
+        self.assertEquals(len(url_data.match_cache), 2)
+
+        # /customer/2 was the least recently used one so it must have been evicted
+        hits = url_data.match_cache.hits
+        url_data.match('/customer/1', '', False)
+        url_data.match('/customer/3', '', False)
+        self.assertEquals(url_data.match_cache.hits, hits + 2)
+        url_data.match('/customer/2', '', False)
+        self.assertEquals(url_data.match_cache.hits, hits + 2)
+
+        url_data.match_cache.set_max_size(1)
+        self.assertEquals(len(url_data.match_cache), 1)
+
+        # Size 0 disables the cache
+        url_data.match_cache.set_max_size(0)
+        self.assertEquals(len(url_data.match_cache), 0)
+        self.assertDictEqual(url_data.match('/customer/1', '', False)[0], {'cid': '1'})
+        self.assertEquals(len(url_data.match_cache), 0)
+
+    def test_match_cache_invalidated_on_direct_change(self):
+        url_data = CyURLData([get_item('b1', '/customer/{cid}')])
+        self.assertEquals(url_data.match('/customer/me', '', False)[1].name, 'b1')
+
+        url_data.channel_data.insert(0, get_item('a1', '/customer/me'))
+        self.assertEquals(url_data.match('/customer/me', '', False)[1].name, 'a1')
+
+# ################################################################################################################################
+
+class MatchCacheTestCase(TestCase):
+
+    def test_clear(self):
+        match_cache = MatchCache(10)
+        self.assertEquals(len(match_cache), 0)
+
+        match_cache.clear()
+        self.assertEquals(len(match_cache), 0)
+        self.assertEquals(match_cache.max_size, 10)
+
+# ################################################################################################################################
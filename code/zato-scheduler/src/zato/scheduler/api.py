@@ -19,7 +19,10 @@ from crontab import CronTab
 from dateutil.parser import parse
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn
+
+# Paste
+from paste.util.converters import asbool
 
 # Zato
 from zato.broker import BrokerMessageReceiver
@@ -28,7 +31,7 @@ from zato.common import CHANNEL, DATA_FORMAT, SCHEDULER, ZATO_NONE
 from zato.common.broker_message import MESSAGE_TYPE, SCHEDULER as SCHEDULER_MSG, SERVICE, TOPICS
 from zato.common.kvdb import KVDB
 from zato.common.util import new_cid, spawn_greenlet
-from zato.scheduler.backend import Interval, Job, Scheduler as _Scheduler
+from zato.scheduler.backend import Interval, Job, Scheduler as _Scheduler, TimerScheduler
 
 # ################################################################################################################################
 
@@ -52,7 +55,18 @@ class Scheduler(BrokerMessageReceiver):
         self.config = config
         self.broker_client = None
         self.config.on_job_executed_cb = self.on_job_executed
-        self.sched = _Scheduler(self.config, self)
+
+        # Job execution requests waiting to be sent to the broker, all jobs due at the same time are sent in one round-trip
+        self.job_msgs = []
+
+        # Either a single greenlet executes all the jobs or each job runs in a greenlet of its own
+        sched_config = self.config.main.get('scheduler') or {}
+
+        if asbool(sched_config.get('use_timer_loop', False)):
+            self.config.missed_run_policy = sched_config.get('missed_run_policy') or SCHEDULER.MISSED_RUN_POLICY.SKIP
+            self.sched = TimerScheduler(self.config, self)
+        else:
+            self.sched = _Scheduler(self.config, self)
 
         # Broker connection
         self.broker_conn = KVDB(config=self.config.main.broker, decrypt_func=self.config.crypto_manager.decrypt)
@@ -103,10 +117,15 @@ class Scheduler(BrokerMessageReceiver):
         if extra_data_format != ZATO_NONE:
             msg['data_format'] = extra_data_format
 
-        self.broker_client.invoke_async(msg)
+        self.job_msgs.append(msg)
+
+        # The first message in a batch schedules the sending of all of them, by the time the sender runs,
+        # all of the other jobs executed in the same iteration of the scheduler's loop will have added theirs.
+        if len(self.job_msgs) == 1:
+            spawn(self.send_job_msgs)
 
         if _has_debug:
-            msg = 'Sent a job execution request, name [{}], service [{}], extra [{}]'.format(
+            msg = 'Queued a job execution request, name [{}], service [{}], extra [{}]'.format(
                 name, ctx['cb_kwargs']['service'], ctx['cb_kwargs']['extra'])
             logger.debug(msg)
 
@@ -122,6 +141,21 @@ class Scheduler(BrokerMessageReceiver):
             }
             self.broker_client.publish(msg)
 
+# ################################################################################################################################
+
+    def send_job_msgs(self):
+        """ Sends all of the job execution requests queued up so far to the broker in a single round-trip.
+        """
+        msgs, self.job_msgs = self.job_msgs, []
+
+        try:
+            self.broker_client.invoke_async_many(msgs)
+        except Exception:
+            logger.warn('Could not send %d job execution request(s), e:`%s`', len(msgs), format_exc())
+        else:
+            if _has_debug:
+                logger.debug('Sent %d job execution request(s)', len(msgs))
+
 # ################################################################################################################################
 
     def create_edit(self, action, job_data, **kwargs):
@@ -10,7 +10,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import datetime
+from heapq import heapify, heappop, heappush
+from itertools import count
 from logging import getLogger
+from time import time
 from traceback import format_exc
 
 # datetime
@@ -19,6 +22,7 @@ from dateutil.rrule import rrule, SECONDLY
 # gevent
 import gevent # Imported directly so it can be mocked out in tests
 from gevent import lock, sleep
+from gevent.event import Event
 
 # paodate
 from paodate import Delta
@@ -79,6 +83,7 @@ class Job(object):
         self.max_repeats_reached = False
         self.max_repeats_reached_at = None
         self.keep_running = True
+        self.in_heap = False # Used by TimerScheduler only - whether this job's next run is in the heap of run times
 
         if clone_start_time:
             self.start_time = start_time
@@ -455,9 +460,6 @@ class Scheduler(object):
             # Add default jobs to the ODB and start all of them, the default and user-defined ones
             self.init_jobs()
 
-            _sleep = self.sleep
-            _sleep_time = self.sleep_time
-
             with self.lock:
                 for job in sorted(self.jobs.itervalues()):
                     if job.max_repeats_reached:
@@ -470,11 +472,285 @@ class Scheduler(object):
 
             logger.info('Scheduler started')
 
-            while self.keep_running:
-                _sleep(_sleep_time)
-
-                if self.iter_cb:
-                    self.iter_cb(*self.iter_cb_args)
+            self.main_loop()
 
         except Exception, e:
             logger.warn(format_exc(e))
+
+    def main_loop(self):
+        """ Keeps the scheduler running until it is told to stop. Each job has its own greenlet so there is nothing
+        else to do here.
+        """
+        _sleep = self.sleep
+        _sleep_time = self.sleep_time
+
+        while self.keep_running:
+            _sleep(_sleep_time)
+
+            if self.iter_cb:
+                self.iter_cb(*self.iter_cb_args)
+
+# ################################################################################################################################
+
+class TimerScheduler(Scheduler):
+    """ A scheduler which executes all the jobs from a single greenlet instead of spawning a greenlet for each job.
+    Next run times of all jobs are kept in a heap and the greenlet sleeps until the earliest of them is due or until
+    a job is scheduled to run before that. Each next run time is computed from the previous one rather than from the time
+    a job actually ran at, so jobs do not drift.
+
+    Jobs are not removed from the heap when they are unscheduled, they are only ignored when their run time is due,
+    hence creating, editing and deleting jobs are all O(log n) operations.
+
+    Runs that could not be executed on time, e.g. because the process was busy for longer than a job's interval,
+    are handled according to missed_run_policy - they can be skipped, executed once, or all of them can be executed.
+    A run is considered missed if it is due for longer than missed_run_grace_time seconds.
+    """
+    def __init__(self, config, api):
+        super(TimerScheduler, self).__init__(config, api)
+        self.missed_run_policy = getattr(config, 'missed_run_policy', None) or SCHEDULER.MISSED_RUN_POLICY.SKIP
+        self.missed_run_grace_time = datetime.timedelta(seconds=1)
+        self.max_catch_up_runs = 1000 # So as not to flood servers with requests if a job with a short interval is late
+        self.max_wait_time = 10 # In seconds, how often to check if the scheduler should keep running when no jobs are due
+        self.heap = []
+        self.heap_seq = count()
+        self.stale_heap_entries = 0
+        self.wakeup = Event()
+
+        if not SCHEDULER.MISSED_RUN_POLICY.has(self.missed_run_policy):
+            raise ValueError('Unsupported missed_run_policy `{}`'.format(self.missed_run_policy))
+
+    def spawn_job(self, job):
+        """ Adds a job's first run to the heap. Must be called with self.lock held.
+        """
+        job.callback = self.on_job_executed
+        job.on_max_repeats_reached_cb = self.on_max_repeats_reached
+
+        if not job.start_time:
+            logger.warn('Job `%s` cannot start without start_time set', job.name)
+            return
+
+        # Next run times of interval-based jobs are computed by dividing by their intervals
+        if job.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED and not job.interval.in_seconds > 0:
+            logger.warn('Job `%s` cannot start with interval `%s`, it must be greater than zero',
+                job.name, job.interval.in_seconds)
+            return
+
+        self._push(job, job.start_time)
+
+    def _push(self, job, run_time, _heappush=heappush):
+        """ Adds a job's next run to the heap and wakes up the timer loop if the run is due before anything else.
+        """
+        is_earliest = not self.heap or run_time < self.heap[0][0]
+        _heappush(self.heap, (run_time, next(self.heap_seq), job))
+        job.in_heap = True
+
+        if is_earliest:
+            self.wakeup.set()
+
+    def _unschedule(self, job):
+        """ Marks a job so that its entry in the heap is ignored and rebuilds the heap if too many such entries accumulated.
+        Must be called with self.lock held.
+        """
+        # The job could have been renamed so we need to unschedule it by the previous name, if there is one
+        scheduled = self.jobs.get(job.old_name if job.old_name else job.name)
+
+        if scheduled:
+            scheduled.keep_running = False
+
+            # Jobs that are inactive, already completed, or not pushed back to the heap yet, have no entries there
+            if scheduled.in_heap:
+                self.stale_heap_entries += 1
+
+                if self.stale_heap_entries > 1000 and self.stale_heap_entries > len(self.heap) // 2:
+                    self._rebuild_heap()
+
+        return super(TimerScheduler, self)._unschedule(job)
+
+    def _rebuild_heap(self):
+        heap = []
+        for elem in self.heap:
+            if self._is_scheduled(elem[2]):
+                heap.append(elem)
+            else:
+                elem[2].in_heap = False
+
+        # In place because main_loop keeps a reference to the heap
+        heapify(heap)
+        self.heap[:] = heap
+        self.stale_heap_entries = 0
+
+    def _is_scheduled(self, job):
+        return job.keep_running and self.jobs.get(job.name) is job
+
+    def on_job_executed(self, ctx, unschedule_one_time=True):
+
+        # One-time jobs are already unscheduled by _run_job
+        super(TimerScheduler, self).on_job_executed(ctx, False)
+
+    def _get_due_run_times(self, job, run_time, now):
+        """ Returns all the run times of a job up to now, starting from run_time, which is due already,
+        along with the first run time that is still in the future.
+        """
+        if job.type == SCHEDULER.JOB_TYPE.ONE_TIME:
+            return [run_time], None
+
+        elif job.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED:
+            interval = datetime.timedelta(seconds=job.interval.in_seconds)
+            due = int((now - run_time).total_seconds() // job.interval.in_seconds) + 1
+            return [run_time + interval * idx for idx in xrange(min(due, self.max_catch_up_runs))], run_time + interval * due
+
+        else:
+            out = []
+            while run_time <= now:
+                if len(out) < self.max_catch_up_runs:
+                    out.append(run_time)
+                run_time += datetime.timedelta(seconds=job.get_sleep_time(run_time))
+            return out, run_time
+
+    def _execute(self, job, _utcnow=datetime.datetime.utcnow, _spawn=gevent.spawn):
+        """ Runs a job once, in a new greenlet so it does not block the timer loop.
+        """
+        job.current_run += 1
+
+        # Perhaps we've already been executed enough times
+        if job.max_repeats and job.current_run == job.max_repeats:
+            job.keep_running = False
+            job.max_repeats_reached = True
+            job.max_repeats_reached_at = _utcnow()
+
+            if job.on_max_repeats_reached_cb:
+                job.on_max_repeats_reached_cb(job)
+
+        _spawn(job.callback, ctx=job.get_context())
+
+    def _run_job(self, job, run_time, now):
+        """ Executes a job whose run time is due, including any runs that were missed, and schedules its next run.
+        """
+        due, next_run_time = self._get_due_run_times(job, run_time, now)
+        policy = self.missed_run_policy
+
+        # Runs are missed only if the latest of them is late, otherwise we simply run the job as usual ..
+        if now - due[-1] <= self.missed_run_grace_time:
+            runs = 1
+
+        # .. one-time jobs have only one run which must not be skipped even if it is late ..
+        elif job.type == SCHEDULER.JOB_TYPE.ONE_TIME:
+            runs = 1
+
+        # .. but if it is late, we need to consult the policy.
+        elif policy == SCHEDULER.MISSED_RUN_POLICY.SKIP:
+            runs = 0
+
+        elif policy == SCHEDULER.MISSED_RUN_POLICY.CATCH_UP_ONCE:
+            runs = 1
+
+        else:
+            runs = len(due)
+
+        if len(due) > runs:
+            logger.info('Job `%s` missed %d run(s) since `%s` (%s)', job.name, len(due) - runs, due[0], policy)
+
+        for _ in xrange(runs):
+            if job.keep_running:
+                self._execute(job)
+
+        if next_run_time and job.keep_running:
+            self._push(job, next_run_time)
+
+        # One-time jobs are unscheduled as soon as they run rather than by their callbacks, which run in other greenlets,
+        # so that no such job stays in self.jobs once its only run is over.
+        elif job.type == SCHEDULER.JOB_TYPE.ONE_TIME:
+            with self.lock:
+                self._unschedule_stop(job, '(src:one-time)')
+
+    def main_loop(self, _utcnow=datetime.datetime.utcnow, _heappop=heappop):
+        """ Sleeps until the earliest run of any job is due, executes all the runs that are due and schedules
+        the next ones.
+        """
+        while self.keep_running:
+            self.wakeup.clear()
+            heap = self.heap
+            now = _utcnow()
+
+            while heap and heap[0][0] <= now:
+                run_time, _, job = _heappop(heap)
+                job.in_heap = False
+
+                if self._is_scheduled(job):
+                    try:
+                        self._run_job(job, run_time, now)
+                    except Exception, e:
+                        logger.warn(format_exc(e))
+
+                # Only entries of jobs that were unscheduled were counted as stale, unlike e.g. ones of a job replaced
+                # in self.jobs by another one of the same name without being unscheduled first.
+                elif not job.keep_running:
+                    self.stale_heap_entries = max(self.stale_heap_entries - 1, 0)
+
+            if self.iter_cb:
+                self.iter_cb(*self.iter_cb_args)
+
+            wait_time = (heap[0][0] - _utcnow()).total_seconds() if heap else self.max_wait_time
+            self.wakeup.wait(min(wait_time, self.max_wait_time))
+
+# ################################################################################################################################
+
+def run(jobs=100000, duration=30, interval=10, create_wait_time=5):
+    """ Schedules a number of interval-based jobs in TimerScheduler and measures how long it takes to create them, how many runs
+    were executed in a given duration and how late they were against their expected run times.
+    """
+    # Bunch
+    from bunch import Bunch
+
+    # psutil
+    import psutil
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    lateness = []
+    interval = Interval(seconds=interval)
+    _interval = datetime.timedelta(seconds=interval.in_seconds)
+
+    # Start times are spread evenly over the first interval so that runs are not all due at once
+    def get_start_time(idx):
+        return start_time + _interval * idx // jobs
+
+    def on_job_executed(ctx, _utcnow=datetime.datetime.utcnow):
+        lateness.append((_utcnow() - (get_start_time(ctx['id']) + _interval * (ctx['current_run'] - 1))).total_seconds())
+
+    config = Bunch(on_job_executed_cb=on_job_executed, startup_jobs=[], odb=None, job_log_level='debug',
+        _add_startup_jobs=False, _add_scheduler_jobs=False)
+
+    scheduler = TimerScheduler(config, None)
+    scheduler.init_jobs = lambda: None
+    scheduler.iter_cb = lambda: setattr(scheduler, 'keep_running', time() < until)
+
+    until = time() + create_wait_time + duration
+    start_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=create_wait_time)
+
+    greenlet = gevent.spawn(scheduler.run)
+    sleep(0)
+
+    now = time()
+    for idx in xrange(jobs):
+        scheduler.create(Job(idx, 'job-{}'.format(idx), SCHEDULER.JOB_TYPE.INTERVAL_BASED, interval,
+            get_start_time(idx), clone_start_time=True))
+    create_time = time() - now
+
+    greenlet.join()
+
+    lateness.sort()
+    len_lateness = len(lateness) or 1
+
+    print('Jobs:{} created in {:.3f}s, RSS +{:.1f} MB'.format(jobs, create_time, (process.memory_info().rss - rss_before) / 2**20))
+    print('Runs:{} in {}s (expected {}), lateness: median:{:.4f}s p99:{:.4f}s max:{:.4f}s'.format(
+        len(lateness), duration, jobs * duration // interval.in_seconds, lateness[len_lateness // 2] if lateness else 0,
+        lateness[int(len_lateness * 0.99)] if lateness else 0, lateness[-1] if lateness else 0))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    run()
+
+# ################################################################################################################################
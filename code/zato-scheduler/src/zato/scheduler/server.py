@@ -46,6 +46,7 @@ class Config(object):
         self.on_job_executed_cb = None
         self.stats_enabled = None
         self.job_log_level = 'info'
+        self.missed_run_policy = None
         self.broker_client = None
         self._add_startup_jobs = True
         self._add_scheduler_jobs = True
@@ -262,8 +262,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
             logger.info('Deploying user-defined services (%s)', self.name)
 
-            user_defined_deployed = self.service_store.import_services_from_anywhere(
-                self.service_modules + self.service_sources, self.base_dir)
+            with self.service_store.bulk_deployment('user-defined'):
+                user_defined_deployed = self.service_store.import_services_from_anywhere(
+                    self.service_modules + self.service_sources, self.base_dir)
 
             locally_deployed.extend(user_defined_deployed)
             len_user_defined_deployed = len(user_defined_deployed)
@@ -661,15 +662,16 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
 # ################################################################################################################################
 
-    def set_in_cache(self, cache_type, cache_name, key, value):
-        """ Sets a value in cache for input parameters.
+    def set_in_cache(self, cache_type, cache_name, key, value, expiry=0):
+        """ Sets a value in cache for input parameters, optionally with an expiry time in seconds.
         """
-        return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value)
+        return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value, expiry)
 
 # ################################################################################################################################
 
-    def invoke_all_pids(self, service, request, timeout=5, *args, **kwargs):
-        """ Invokes a given service in each of processes current server has.
+    def invoke_all_pids(self, service, request, timeout=5):
+        """ Invokes a given service in each of processes current server has. All of the processes are invoked concurrently
+        and timeout is the overall time to wait for their responses in.
         """
         try:
             # PID -> response from that process
@@ -682,23 +684,24 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             # Underlying IPC needs strings on input instead of None
             request = request or ''
 
-            for pid in pids:
+            for pid, pid_response in self.ipc_api.invoke_all_pids(
+                    service, request, self.cluster.name, self.name, pids, timeout).items():
+
                 response = {
                     'is_ok': False,
                     'pid_data': None,
                     'error_info': None
                 }
 
-                try:
-                    is_ok, pid_data = self.invoke_by_pid(service, request, pid, timeout=timeout, *args, **kwargs)
+                if pid_response:
+                    is_ok, pid_data = pid_response
                     response['is_ok'] = is_ok
                     response['pid_data' if is_ok else 'error_info'] = pid_data
+                else:
+                    response['error_info'] = 'No response from PID `{}` in {}s'.format(pid, timeout)
+
+                out[pid] = response
 
-                except Exception:
-                    e = format_exc()
-                    response['error_info'] = e
-                finally:
-                    out[pid] = response
         except Exception:
             logger.warn('PID invocation error `%s`', format_exc())
         finally:
@@ -709,8 +712,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
     def invoke_by_pid(self, service, request, target_pid, *args, **kwargs):
         """ Invokes a service in a worker process by the latter's PID.
         """
-        return self.ipc_api.invoke_by_pid(service, request, self.cluster.name, self.name, target_pid,
-            self.fifo_response_buffer_size, *args, **kwargs)
+        return self.ipc_api.invoke_by_pid(service, request, self.cluster.name, self.name, target_pid, *args, **kwargs)
 
 # ################################################################################################################################
 
@@ -866,6 +868,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             # Close ZeroMQ-based IPC
             self.ipc_api.close()
 
+            # Flush any statistics not written to KVDB yet
+            self.worker_store.stats_aggregator.stop()
+
             # Delete persistent information about all clients currently connected
             wsx_service = 'zato.channel.web-socket.client.delete-by-server'
             if self.service_store.is_deployed(wsx_service):
@@ -74,7 +74,7 @@ from zato.server.connection.vault import VaultConnAPI
 from zato.server.pubsub import PubSub
 from zato.server.query import CassandraQueryAPI, CassandraQueryStore
 from zato.server.rbac_ import RBAC
-from zato.server.stats import MaintenanceTool
+from zato.server.stats import DEFAULT_FLUSH_INTERVAL, MaintenanceTool, ServiceStatsAggregator
 from zato.zmq_.channel import MDPv01 as ChannelZMQMDPv01, Simple as ChannelZMQSimple
 from zato.zmq_.outgoing import Simple as OutZMQSimple
 
@@ -155,6 +155,13 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         # Statistics maintenance
         self.stats_maint = MaintenanceTool(self.kvdb.conn)
 
+        # Statistics of services invoked in this process, flushed to KVDB periodically
+        self.stats_aggregator = ServiceStatsAggregator(self.kvdb,
+            float(self.server.fs_server_config.get('stats', {}).get('flush_interval', DEFAULT_FLUSH_INTERVAL)))
+
+        if self.server.component_enabled.stats:
+            gevent.spawn(self.stats_aggregator.run)
+
         self.msg_ns_store = self.worker_config.msg_ns_store
         self.json_pointer_store = self.worker_config.json_pointer_store
         self.xpath_store = self.worker_config.xpath_store
@@ -2082,9 +2089,66 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
             data = '{};{}'.format(status, response)
 
         try:
-            with open(msg.reply_to_fifo, 'wb') as fifo:
-                fifo.write(data)
+            # Reply through the IPC socket of the process that invoked us ..
+            if msg.reply_to_tag:
+                self.server.ipc_api.send_reply(msg.reply_to_tag, msg.request_id, data)
+
+            # .. or through a FIFO, if that is what the caller is waiting on.
+            elif msg.reply_to_fifo:
+                with open(msg.reply_to_fifo, 'wb') as fifo:
+                    fifo.write(data)
+
         except Exception:
-            logger.warn('Could not write to FIFO, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
+            logger.warn('Could not send IPC response, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
 
 # ################################################################################################################################
+
+def run(iters=100000):
+    """ Measures how many empty services per second can be invoked through WorkerStore.invoke.
+    No connections, statistics or ODB/KVDB are involved so it is the overhead of invoking services only.
+    """
+    # Imported here because services and ServiceStore import this module indirectly
+    from zato.server.service import Service
+    from zato.server.service.store import ServiceStore, set_up_class_attributes
+
+    class Empty(Service):
+        name = 'zato.bench.empty'
+
+        def handle(self):
+            pass
+
+    component_enabled = Bunch(stats=False, slow_response=False)
+
+    server = Bunch(component_enabled=component_enabled, user_config=Bunch(), static_config=Bunch(), time_util=None,
+        encrypt=None, kvdb=Bunch(translate=None), fs_server_config=Bunch(main=Bunch(token='')))
+
+    worker_store = WorkerStore.__new__(WorkerStore)
+    worker_store.server = server
+    worker_store.broker_client = None
+    worker_store.worker_config = Bunch(simple_io={})
+    worker_store.cache_api = None
+    worker_store._simple_types = simple_types
+
+    service_store = server.service_store = ServiceStore({}, server=server)
+    service_store.services[Empty.get_impl_name()] = {'service_class': Empty, 'is_active': True, 'slow_threshold': 99999}
+    service_store.name_to_impl_name[Empty.get_name()] = Empty.get_impl_name()
+
+    set_up_class_attributes(Empty)
+    Empty._worker_store = worker_store
+    Empty._worker_config = worker_store.worker_config
+    for name in ('cassandra', 'email', 'search', 'msg_path', 'ibm_mq', 'patterns', 'zeromq', 'sms', 'target_matcher',
+            'invoke_matcher'):
+        setattr(Empty, 'component_enabled_{}'.format(name), False)
+
+    start = datetime.utcnow()
+
+    for x in xrange(iters):
+        worker_store.invoke(Empty.get_name(), '')
+
+    total = (datetime.utcnow() - start).total_seconds()
+    print('{} invocations in {:.3f}s, {:.0f}/s'.format(iters, total, iters / total))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    run()
@@ -12,8 +12,11 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from logging import getLogger
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
 from gevent.lock import RLock
 
 # python-memcached
@@ -67,6 +70,75 @@ default_get = ZATO_NOT_GIVEN # A singleton to indicate that no default for Cache
 
 # ################################################################################################################################
 
+class _SyncBatch(object):
+    """ Collects state changes of a single cache and publishes them to other workers in batches rather than one by one.
+    A batch is published once it reaches its maximum size or once its oldest change has waited for max_wait milliseconds.
+    A SET or DELETE of a key replaces an earlier SET or DELETE of the same key still in the batch unless another operation
+    that could have affected that key was queued in between, and a CLEAR replaces everything queued before it.
+    """
+    def __init__(self, cache_name, callback, max_size, max_wait):
+        self.cache_name = cache_name
+        self.callback = callback
+        self.max_size = max_size
+        self.max_wait = max_wait / 1000.0
+        self.lock = RLock()
+        self.items = []     # A list of (op, data) tuples, or None for ones replaced by later changes
+        self.key_idx = {}   # Key -> position in self.items of the last SET or DELETE for that key
+        self.len_items = 0  # How many elements in self.items are not None
+        self.has_flusher = False
+        self.flush_pending = False # Whether a flush of a full batch is already scheduled
+
+    def add(self, op, data, _CLEAR=CACHE.STATE_CHANGED.CLEAR, _SET=CACHE.STATE_CHANGED.SET,
+        _DELETE=CACHE.STATE_CHANGED.DELETE, _EXPIRE=CACHE.STATE_CHANGED.EXPIRE):
+
+        with self.lock:
+
+            if op == _CLEAR:
+                self.items[:] = []
+                self.key_idx.clear()
+                self.len_items = 0
+
+            elif op == _SET or op == _DELETE:
+                idx = self.key_idx.get(data['key'])
+                if idx is not None:
+                    self.items[idx] = None
+                    self.len_items -= 1
+                self.key_idx[data['key']] = len(self.items)
+
+            # An expiration of a key must be applied after any SET queued before it
+            elif op == _EXPIRE:
+                self.key_idx.pop(data['key'], None)
+
+            # Pattern-based operations may affect any key so nothing queued before them can be replaced
+            else:
+                self.key_idx.clear()
+
+            self.items.append((op, data))
+            self.len_items += 1
+
+            if self.len_items >= self.max_size:
+                if not self.flush_pending:
+                    self.flush_pending = True
+                    spawn(self.flush)
+
+            elif not self.has_flusher:
+                self.has_flusher = True
+                spawn_later(self.max_wait, self.flush)
+
+    def flush(self):
+        with self.lock:
+            items = [{'op':elem[0], 'data':elem[1]} for elem in self.items if elem]
+            self.items = []
+            self.key_idx.clear()
+            self.len_items = 0
+            self.has_flusher = False
+            self.flush_pending = False
+
+        if items:
+            self.callback(self.cache_name, items)
+
+# ################################################################################################################################
+
 class Cache(object):
     """ The cache API through which services access the built-in self.cache objects.
     Attribute self.impl is the actual Cython-based cache implementation.
@@ -74,11 +146,55 @@ class Cache(object):
     def __init__(self, config):
         self.config = config
         self.after_state_changed_callback = self.config.after_state_changed_callback
+        self.after_state_changed_batch_callback = self.config.after_state_changed_batch_callback
         self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self.sync_batch = None
+        self._set_up_sync_batch(self.config)
         self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
-            self.config.extend_expiry_on_set)
+            self.config.extend_expiry_on_set, self.config.get('needs_key_index', False), self.config.get('max_size_bytes'))
+        self.delete_expired_interval = self._get_delete_expired_interval(self.config)
         spawn(self._delete_expired)
 
+# ################################################################################################################################
+
+    def _get_delete_expired_interval(self, config, _default=CACHE.DEFAULT.DELETE_EXPIRED_INTERVAL):
+        """ Returns how often, in seconds, expired keys should be deleted, as configured for this cache.
+        """
+        return float(config.get('delete_expired_interval') or _default)
+
+# ################################################################################################################################
+
+    def _set_up_sync_batch(self, config, _batched=CACHE.SYNC_METHOD.IN_BACKGROUND_BATCHED.id,
+        _max_size=CACHE.DEFAULT.SYNC_BATCH_MAX_SIZE, _max_wait=CACHE.DEFAULT.SYNC_BATCH_MAX_WAIT):
+        """ Creates or updates the batch that state changes are published through if this cache is configured to use one,
+        or publishes and removes an existing batch if it is not.
+        """
+        max_size = int(config.get('sync_batch_max_size') or _max_size)
+        max_wait = int(config.get('sync_batch_max_wait') or _max_wait)
+
+        if config.sync_method == _batched:
+            if self.sync_batch:
+                self.sync_batch.flush()
+                self.sync_batch.cache_name = config.name
+                self.sync_batch.max_size = max_size
+                self.sync_batch.max_wait = max_wait / 1000.0
+            else:
+                self.sync_batch = _SyncBatch(config.name, self.after_state_changed_batch_callback, max_size, max_wait)
+        else:
+            if self.sync_batch:
+                self.sync_batch.flush()
+            self.sync_batch = None
+
+# ################################################################################################################################
+
+    def _after_state_changed(self, op, data):
+        """ Publishes information about a state change to other workers, either immediately or as part of a batch.
+        """
+        if self.sync_batch:
+            self.sync_batch.add(op, data)
+        else:
+            spawn(self.after_state_changed_callback, op, self.config.name, data)
+
 # ################################################################################################################################
 
     def __getitem__(self, key):
@@ -172,7 +288,7 @@ class Cache(object):
         meta_ref = {'key':key, 'value':value, 'expiry':expiry} if self.needs_sync else None
         value = self.impl.set(key, value, expiry, details, meta_ref)
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self._after_state_changed(_OP, meta_ref)
 
         return value
 
@@ -185,7 +301,7 @@ class Cache(object):
         """
         out = self.impl.set_by_prefix(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -198,7 +314,7 @@ class Cache(object):
         """
         out = self.impl.set_by_suffix(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -211,7 +327,7 @@ class Cache(object):
         """
         out = self.impl.set_by_regex(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -224,7 +340,7 @@ class Cache(object):
         """
         out = self.impl.set_contains(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -237,7 +353,7 @@ class Cache(object):
         """
         out = self.impl.set_not_contains(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -250,7 +366,7 @@ class Cache(object):
         """
         out = self.impl.set_contains_all(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -263,7 +379,7 @@ class Cache(object):
         """
         out = self.impl.set_contains_any(key, value, expiry, return_found, details=False)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -279,7 +395,7 @@ class Cache(object):
                 raise
         else:
             if self.needs_sync:
-                spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+                self._after_state_changed(_OP, {'key':key})
 
             return value
 
@@ -291,7 +407,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_prefix(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -303,7 +419,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_suffix(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -315,7 +431,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_regex(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -327,7 +443,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -339,7 +455,7 @@ class Cache(object):
         """
         out = self.impl.delete_not_contains(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -351,7 +467,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains_all(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -363,7 +479,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains_any(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self._after_state_changed(_OP, {'key':key})
 
         return out
 
@@ -376,7 +492,7 @@ class Cache(object):
         found_key = self.impl.expire(key, expiry, meta_ref)
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self._after_state_changed(_OP, meta_ref)
 
         return found_key
 
@@ -387,7 +503,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_prefix(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -398,7 +514,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_suffix(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -409,7 +525,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_regex(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -420,7 +536,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -431,7 +547,7 @@ class Cache(object):
         """
         out = self.impl.expire_not_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -442,7 +558,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains_all(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -453,7 +569,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains_any(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self._after_state_changed(_OP, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -507,22 +623,26 @@ class Cache(object):
         self.impl.clear()
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _CLEAR, self.config.name, {})
+            self._after_state_changed(_CLEAR, {})
 
 # ################################################################################################################################
 
     def update_config(self, config):
-        self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self.needs_sync = config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self._set_up_sync_batch(config)
+        self.delete_expired_interval = self._get_delete_expired_interval(config)
         self.impl.update_config(config)
 
 # ################################################################################################################################
 
-    def _delete_expired(self, interval=5, _sleep=sleep):
+    def _delete_expired(self, _sleep=sleep):
         """ Invokes in its own greenlet in background to delete expired cache entries.
         """
         try:
             while True:
                 try:
+                    # Read each time because configuration may have changed in the meantime
+                    interval = self.delete_expired_interval
                     _sleep(interval)
                     deleted = self.impl.delete_expired()
                 except Exception, e:
@@ -539,7 +659,7 @@ class Cache(object):
     def sync_after_set(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set operation in another worker process.
         """
-        self.impl.set(data.key, data.value, data.expiry, False, False)
+        self.impl.set(data.key, data.value, data.expiry, False, None)
 
     def sync_after_set_by_prefix(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_by_prefix operation in another worker process.
@@ -684,6 +804,24 @@ class Cache(object):
         """
         self.impl.clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, items, _CLEAR=CACHE.STATE_CHANGED.CLEAR):
+        """ Invoked by Cache API to synchronizes this worker's cache after a batch of operations in another worker process.
+        All the operations are applied in the order they were carried out in, with the cache's lock held throughout.
+        """
+        with self.impl._lock:
+            for item in items:
+                op = item['op']
+                try:
+                    if op == _CLEAR:
+                        self.sync_after_clear()
+                    else:
+                        getattr(self, 'sync_after_{}'.format(op.lower()))(Bunch(item['data']))
+                except Exception, e:
+                    logger.warn('Could not sync `%s` in cache `%s`, data:`%s`, e:`%s`',
+                        op, self.config.name, item['data'], format_exc(e))
+
 # ################################################################################################################################
 
 class _NotConfiguredAPI(object):
@@ -726,12 +864,29 @@ class CacheAPI(object):
             logger.warn('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
                 op, cache_name, data, format_exc(e))
 
+# ################################################################################################################################
+
+    def after_state_changed_batch(self, cache_name, items, _action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        """ Callback method invoked by caches that synchronize with other worker processes in batches.
+        """
+        try:
+            self.server.broker_client.publish({
+                'action': _action,
+                'cache_name': cache_name,
+                'source_worker_id': self.server.worker_id,
+                'items': items,
+            })
+        except Exception, e:
+            logger.warn('Could not publish a batch of %d state changes in cache `%s`, e:`%s`',
+                len(items), cache_name, format_exc(e))
+
 # ################################################################################################################################
 
     def _create_builtin(self, config):
         """ A low-level method building a bCache object for built-in caches. Must be called with self.lock held.
         """
         config.after_state_changed_callback = self.after_state_changed
+        config.after_state_changed_batch_callback = self.after_state_changed_batch
         return Cache(config)
 
 # ################################################################################################################################
@@ -855,6 +1010,13 @@ class CacheAPI(object):
         """
         return len(self.caches[cache_type][name])
 
+# ################################################################################################################################
+
+    def get_size_bytes(self, cache_type, name):
+        """ Returns an estimate of how many bytes all entries in a given cache take up.
+        """
+        return self.caches[cache_type][name].impl.current_size_bytes
+
 # ################################################################################################################################
 
     def sync_after_set(self, cache_type, data):
@@ -988,4 +1150,11 @@ class CacheAPI(object):
         """
         self.caches[cache_type][data.cache_name].sync_after_clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, cache_type, data):
+        """ Synchronizes the state of this worker's cache after a batch of operations in another worker process.
+        """
+        self.caches[cache_type][data.cache_name].sync_after_batch(data['items'])
+
 # ################################################################################################################################
@@ -12,8 +12,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 from cStringIO import StringIO
 from gzip import GzipFile
-from hashlib import sha256
-from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
+from hashlib import sha1, sha256
+from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, NOT_MODIFIED, OK, \
+     UNAUTHORIZED
+from time import time
 from traceback import format_exc
 
 # anyjson
@@ -22,6 +24,10 @@ from anyjson import dumps, loads
 # Django
 from django.http import QueryDict
 
+# gevent
+from gevent import spawn
+from gevent.event import AsyncResult
+
 # Paste
 from paste.util.converters import asbool
 
@@ -49,6 +55,7 @@ _status_not_found = b'{} {}'.format(NOT_FOUND, HTTP_RESPONSES[NOT_FOUND])
 _status_method_not_allowed = b'{} {}'.format(METHOD_NOT_ALLOWED, HTTP_RESPONSES[METHOD_NOT_ALLOWED])
 _status_unauthorized = b'{} {}'.format(UNAUTHORIZED, HTTP_RESPONSES[UNAUTHORIZED])
 _status_forbidden = b'{} {}'.format(FORBIDDEN, HTTP_RESPONSES[FORBIDDEN])
+_status_not_modified = b'{} {}'.format(NOT_MODIFIED, HTTP_RESPONSES[NOT_MODIFIED])
 _status_too_many_requests = b'{} {}'.format(TOO_MANY_REQUESTS, HTTP_RESPONSES[TOO_MANY_REQUESTS])
 
 # ################################################################################################################################
@@ -126,16 +133,122 @@ def get_client_error_wrapper(transport, data_format):
 
 # ################################################################################################################################
 
+# How many decoded cached responses each worker keeps
+_encoded_responses_max_size = 1000
+
+# ################################################################################################################################
+
+def gzip_payload(payload, _stringio=StringIO, _gzipfile=GzipFile):
+    """ Returns input payload compressed with gzip.
+    """
+    s = _stringio()
+    with _gzipfile(fileobj=s, mode='w') as f:
+        f.write(payload)
+    out = s.getvalue()
+    s.close()
+
+    return out
+
+# ################################################################################################################################
+
+def etag_matches(if_none_match, etag):
+    """ Returns True if the value of an If-None-Match header matches input ETag, using weak comparison, as per RFC 7232.
+    """
+    if if_none_match == etag:
+        return True
+
+    if if_none_match.strip() == '*':
+        return True
+
+    for elem in if_none_match.split(','):
+        elem = elem.strip()
+        if elem.startswith('W/'):
+            elem = elem[2:]
+        if elem == etag:
+            return True
+
+    return False
+
+# ################################################################################################################################
+
 class _CachedResponse(object):
     """ A wrapper for responses served from caches.
     """
-    __slots__ = ('payload', 'content_type', 'headers', 'status_code')
+    __slots__ = ('payload', 'content_type', 'headers', 'status_code', 'is_stale', 'etag', 'gzipped_payload')
+
+    def __init__(self, payload, content_type, headers, status_code, is_stale=False, etag=None, gzipped_payload=None):
+        self.payload = payload
+        self.content_type = content_type
+        self.headers = headers
+        self.status_code = status_code
+        self.is_stale = is_stale
+        self.etag = etag
+        self.gzipped_payload = gzipped_payload
+
+# ################################################################################################################################
+
+class _EncodedResponse(object):
+    """ A response as it is kept in a cache, i.e. a line of JSON metadata followed by the payload as-is, along with the same
+    response already decoded. Each worker decodes a given value only once and, if the channel uses gzip, compresses it
+    only once too.
+    """
+    __slots__ = ('value', 'payload', 'content_type', 'headers', 'status_code', 'etag', 'fresh_until', 'gzipped_payload')
 
-    def __init__(self, payload, content_type, headers, status_code):
+    def __init__(self, value, payload, content_type, headers, status_code, etag, fresh_until, needs_gzip):
+        self.value = value
         self.payload = payload
         self.content_type = content_type
         self.headers = headers
         self.status_code = status_code
+        self.etag = etag
+        self.fresh_until = fresh_until
+        self.gzipped_payload = gzip_payload(payload) if needs_gzip else None
+
+    @staticmethod
+    def from_response(response, fresh_until, needs_gzip, _dumps=dumps, _sha1=sha1):
+        """ Encodes a service's response.
+        """
+        payload = response.payload
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        etag_ctx = _sha1(payload)
+        etag_ctx.update(str(response.status_code))
+        etag_ctx.update(response.content_type or '')
+        etag = '"%s"' % etag_ctx.hexdigest()
+
+        headers = dict(response.headers)
+
+        value = b'%s\n%s' % (_dumps({
+            'content_type': response.content_type,
+            'headers': headers,
+            'status_code': response.status_code,
+            'etag': etag,
+            'fresh_until': fresh_until,
+        }), payload)
+
+        return _EncodedResponse(value, payload, response.content_type, headers, response.status_code, etag, fresh_until,
+            needs_gzip)
+
+    @staticmethod
+    def from_value(value, needs_gzip, _loads=loads):
+        """ Decodes a response kept in a cache, returning None if it is not in the expected format.
+        """
+        # Values synchronized from other workers are deserialized from JSON and arrive as unicode objects
+        raw = value.encode('utf-8') if isinstance(value, unicode) else value
+
+        idx = raw.find(b'\n')
+        if idx == -1:
+            return None
+
+        meta = _loads(raw[:idx])
+
+        return _EncodedResponse(value, raw[idx+1:], meta['content_type'], meta['headers'], meta['status_code'],
+            meta['etag'], meta['fresh_until'], needs_gzip)
+
+    def get_response(self, is_stale=False, _CachedResponse=_CachedResponse):
+        return _CachedResponse(self.payload, self.content_type, self.headers, self.status_code, is_stale, self.etag,
+            self.gzipped_payload)
 
 # ################################################################################################################################
 
@@ -191,7 +304,8 @@ class RequestDispatcher(object):
 
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store, _status_response=status_response,
         no_url_match=(None, False), _response_404=response_404, _has_debug=_has_debug,
-        _http_soap_action='HTTP_SOAPACTION', _stringio=StringIO, _gzipfile=GzipFile):
+        _http_soap_action='HTTP_SOAPACTION', _gzip_payload=gzip_payload, _etag_matches=etag_matches,
+        _CachedResponse=_CachedResponse, _conditional_methods=('GET', 'HEAD')):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
         configuration is one of the technical account or HTTP basic auth,
         the security validation is being performed. Otherwise, that step
@@ -271,18 +385,35 @@ class RequestDispatcher(object):
                 wsgi_environ['zato.http.response.headers'].update(response.headers)
                 wsgi_environ['zato.http.response.status'] = _status_response[response.status_code]
 
+                if isinstance(response, _CachedResponse):
+
+                    # Responses from cache have an ETag so clients that already have them do not need to receive them again
+                    wsgi_environ['zato.http.response.headers']['ETag'] = response.etag
+                    if_none_match = wsgi_environ.get('HTTP_IF_NONE_MATCH')
+
+                    if if_none_match and response.status_code == OK and \
+                       wsgi_environ['REQUEST_METHOD'] in _conditional_methods and \
+                       _etag_matches(if_none_match, response.etag):
+                        wsgi_environ['zato.http.response.status'] = _status_not_modified
+                        return b''
+
+                    payload = response.gzipped_payload
+                else:
+                    payload = None
+
                 if channel_item['content_encoding'] == 'gzip':
 
-                    s = _stringio()
-                    with _gzipfile(fileobj=s, mode='w') as f:
-                        f.write(response.payload)
-                    response.payload = s.getvalue()
-                    s.close()
+                    # Cached responses are already compressed
+                    if payload is None:
+                        payload = _gzip_payload(response.payload)
 
                     wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
 
+                else:
+                    payload = response.payload
+
                 # Finally return payload to the client
-                return response.payload
+                return payload
 
             except Exception, e:
                 _format_exc = format_exc(e)
@@ -355,6 +486,12 @@ class RequestHandler(object):
         self.server = server # A ParallelServer instance
         self.use_soap_envelope = asbool(self.server.fs_server_config.misc.use_soap_envelope)
 
+        # Cache key -> AsyncResult for each service invocation currently in progress in channels using single-flight mode
+        self.in_flight = {}
+
+        # Cache key -> _EncodedResponse for responses from cache already decoded by this worker
+        self.encoded_responses = {}
+
 # ################################################################################################################################
 
     def _set_response_data(self, service, **kwargs):
@@ -423,8 +560,8 @@ class RequestHandler(object):
 
 # ################################################################################################################################
 
-    def get_response_from_cache(self, service, raw_request, channel_item, channel_params, wsgi_environ, _loads=loads,
-        _CachedResponse=_CachedResponse, _HashCtx=_HashCtx, _sha256=sha256, split_re=regex_compile('........?').findall):
+    def get_response_from_cache(self, service, raw_request, channel_item, channel_params, wsgi_environ,
+        _HashCtx=_HashCtx, _sha256=sha256, _time=time, split_re=regex_compile('........?').findall):
         """ Returns a cached response for incoming request or None if there is nothing cached for it.
         By default, an incoming request's hash is calculated by sha256 over a concatenation of:
           * WSGI REQUEST_METHOD   # E.g. GET or POST
@@ -433,6 +570,7 @@ class RequestHandler(object):
           * payload bytes         # E.g. '{"customer_id":"123"}' - a string object, before parsing
         Note that query string is sorted which means that ?foo=123&bar=456 is equal to ?bar=456&foo=123,
         that is, the order of parameters in query string does not matter.
+        Responses past their freshness period, if the channel uses stale-while-revalidate, are returned with is_stale set.
         """
         if service.get_request_hash:
             hash_value = service.get_request_hash(_HashCtx(raw_request, channel_item, channel_params, wsgi_environ))
@@ -446,27 +584,60 @@ class RequestHandler(object):
         cache_key = 'http-channel-%s-%s' % (channel_item['id'], hash_value)
 
         # We have the key so now we can check if there is any matching response already stored in cache
-        response = self.server.get_from_cache(channel_item['cache_type'], channel_item['cache_name'], cache_key)
+        value = self.server.get_from_cache(channel_item['cache_type'], channel_item['cache_name'], cache_key)
+
+        if not value:
+            return cache_key, None
+
+        # If this worker has already decoded this very value, it can be reused as is ..
+        encoded = self.encoded_responses.get(cache_key)
+
+        if encoded is None or not (encoded.value is value or encoded.value == value):
+
+            # .. otherwise, we need to decode it now.
+            encoded = _EncodedResponse.from_value(value, channel_item['content_encoding'] == 'gzip')
 
-        # If there is any response, we can now load into a format that our callers expect
-        if response:
-            response = _loads(response)
-            response = _CachedResponse(response['payload'], response['content_type'], response['headers'],
-                response['status_code'])
+            # This will be the case with values kept in a format other than ours, e.g. by previous versions in Memcached
+            if encoded is None:
+                return cache_key, None
+
+            self._set_encoded_response(cache_key, encoded)
+
+        fresh_until = encoded.fresh_until
+        return cache_key, encoded.get_response(bool(fresh_until and _time() > fresh_until))
+
+# ################################################################################################################################
+
+    def _set_encoded_response(self, cache_key, encoded, _max_size=_encoded_responses_max_size):
+        """ Stores a decoded response for later use, evicting an arbitrary one if there are too many already.
+        """
+        if cache_key not in self.encoded_responses and len(self.encoded_responses) >= _max_size:
+            self.encoded_responses.popitem()
 
-        return cache_key, response
+        self.encoded_responses[cache_key] = encoded
 
 # ################################################################################################################################
 
-    def set_response_in_cache(self, channel_item, key, response, _dumps=dumps):
+    def set_response_in_cache(self, channel_item, key, response, _time=time):
         """ Caches responses from this channel's invocation for as long as the cache is configured to keep it.
+        If the channel has a stale grace period, the response is kept for that much longer than cache_expiry
+        and it is marked as stale once cache_expiry elapses. Returns the response as it was encoded for the cache.
         """
-        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, _dumps({
-            'payload': response.payload,
-            'content_type': response.content_type,
-            'headers': response.headers,
-            'status_code': response.status_code,
-        }))
+        stale_grace = channel_item.get('cache_stale_grace')
+        cache_expiry = channel_item['cache_expiry']
+        fresh_until = _time() + cache_expiry if stale_grace and cache_expiry else None
+
+        encoded = _EncodedResponse.from_response(response, fresh_until, channel_item['content_encoding'] == 'gzip')
+
+        if fresh_until:
+            self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, encoded.value,
+                cache_expiry + stale_grace)
+        else:
+            self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, encoded.value)
+
+        self._set_encoded_response(key, encoded)
+
+        return encoded
 
 # ################################################################################################################################
 
@@ -488,25 +659,96 @@ class RequestHandler(object):
         if channel_item['cache_type']:
             cache_key, response = self.get_response_from_cache(service, raw_request, channel_item, channel_params, wsgi_environ)
             if response:
+
+                # Stale responses are still returned but a refresh is started in background unless one is running already
+                if response.is_stale and cache_key not in self.in_flight:
+                    wsgi_environ = dict(wsgi_environ)
+                    wsgi_environ['zato.http.response.headers'] = {}
+                    self.in_flight[cache_key] = AsyncResult()
+                    spawn(self._revalidate, cache_key, service, cid, url_match, channel_item, wsgi_environ, raw_request,
+                        worker_store, simple_io_config, channel_type, channel_params)
+
                 return response
 
+            # Concurrent misses for the same key share a single invocation of the service
+            if channel_item.get('cache_single_flight'):
+                encoded = self._invoke_single_flight(cache_key, service, cid, url_match, channel_item, wsgi_environ,
+                    raw_request, worker_store, simple_io_config, channel_type, channel_params)
+            else:
+                encoded = self._invoke_and_cache(cache_key, service, cid, url_match, channel_item, wsgi_environ,
+                    raw_request, worker_store, simple_io_config, channel_type, channel_params)
+
+            return encoded.get_response()
+
+        # No cache for this channel, invoke the service then.
+        return self._invoke(service, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store,
+            simple_io_config, channel_type, channel_params)
+
+# ################################################################################################################################
+
+    def _invoke(self, service, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config,
+        channel_type, channel_params):
+        """ Invokes a service and returns its response.
+        """
         # Add any path params matched to WSGI environment so it can be easily accessible later on
         wsgi_environ['zato.http.path_params'] = url_match
 
-        # No cache for this channel or no cached response, invoke the service then.
-        response = service.update_handle(self._set_response_data, service, raw_request,
+        return service.update_handle(self._set_response_data, service, raw_request,
             channel_type, channel_item.data_format, channel_item.transport, self.server, worker_store.broker_client,
             worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
             url_match=url_match, channel_item=channel_item, channel_params=channel_params,
             merge_channel_params=channel_item.merge_url_params_req,
             params_priority=channel_item.params_pri)
 
-        # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
-        if channel_item['cache_type']:
-            self.set_response_in_cache(channel_item, cache_key, response)
+# ################################################################################################################################
+
+    def _invoke_and_cache(self, cache_key, service, cid, url_match, channel_item, *args):
+        """ Invokes a service and caches its response, returning it in the form it was cached in.
+        """
+        response = self._invoke(service, cid, url_match, channel_item, *args)
+        return self.set_response_in_cache(channel_item, cache_key, response)
+
+# ################################################################################################################################
 
-        # Having used the cache or not, we can return the response now
-        return response
+    def _invoke_single_flight(self, cache_key, *args):
+        """ Invokes a service unless another invocation for the same cache key is already in progress in this process,
+        in which case the result of that other invocation is waited for and shared, including any exception it raised.
+        """
+        in_flight = self.in_flight.get(cache_key)
+
+        if in_flight:
+            return in_flight.get()
+
+        self.in_flight[cache_key] = in_flight = AsyncResult()
+
+        try:
+            encoded = self._invoke_and_cache(cache_key, *args)
+        except Exception, e:
+            in_flight.set_exception(e)
+            raise
+        else:
+            in_flight.set(encoded)
+            return encoded
+        finally:
+            del self.in_flight[cache_key]
+
+# ################################################################################################################################
+
+    def _revalidate(self, cache_key, *args):
+        """ Refreshes a stale response in background. Any callers that miss the cache in the meantime
+        and use single-flight mode will wait for this refresh instead of invoking the service on their own.
+        """
+        in_flight = self.in_flight[cache_key]
+
+        try:
+            encoded = self._invoke_and_cache(cache_key, *args)
+        except Exception, e:
+            logger.warn('Could not refresh stale response for `%s`, e:`%s`', cache_key, format_exc(e))
+            in_flight.set_exception(e)
+        else:
+            in_flight.set(encoded)
+        finally:
+            del self.in_flight[cache_key]
 
 # ################################################################################################################################
 
@@ -48,7 +48,8 @@ class URLData(CyURLData, OAuthDataStore):
                  openstack_config=None, xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, \
                  vault_conn_sec_config=None, kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None,
                  jwt_secret=None, vault_conn_api=None):
-        super(URLData, self).__init__(channel_data)
+        super(URLData, self).__init__(channel_data, int(worker.server.fs_server_config.get('misc', {}).get(
+            'url_match_cache_size', MISC.DEFAULT_URL_MATCH_CACHE_SIZE)))
         self.worker = worker
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -67,6 +68,8 @@ class URLData(CyURLData, OAuthDataStore):
         self.broker_client = broker_client
         self.odb = odb
         self.jwt_secret = jwt_secret
+        self.jwt = JWT(kvdb, odb, jwt_secret, float(worker.server.fs_server_config.get('misc', {}).get(
+            'jwt_renew_interval', MISC.DEFAULT_JWT_RENEW_INTERVAL))) if jwt_secret else None
         self.vault_conn_api = vault_conn_api
         self.rbac_auth_type_hooks = self.worker.server.fs_server_config.rbac.auth_type_hook
 
@@ -256,7 +259,7 @@ class URLData(CyURLData, OAuthDataStore):
                 return False
 
         token = authorization.split('Bearer ', 1)[1]
-        result = JWT(self.kvdb, self.odb, self.jwt_secret).validate(sec_def.username, token.encode('utf8'))
+        result = self.jwt.validate(sec_def.username, token.encode('utf8'))
 
         if not result.valid:
             if enforce_auth:
@@ -520,7 +523,7 @@ class URLData(CyURLData, OAuthDataStore):
 # ################################################################################################################################
 
     def check_rbac_delegated_security(self, sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store,
-            sep=MISC.SEPARATOR, plain_http=URL_TYPE.PLAIN_HTTP):
+            plain_http=URL_TYPE.PLAIN_HTTP):
 
         is_allowed = False
 
@@ -531,28 +534,38 @@ class URLData(CyURLData, OAuthDataStore):
             logger.error('Invalid HTTP method `%s`, cid:`%s`', http_method, cid)
             raise Forbidden(cid, 'You are not allowed to access this URL\n')
 
-        for role_id, perm_id, resource_id in worker_store.rbac.registry._allowed.iterkeys():
+        # Security types that cannot possibly authenticate this request given the credentials it has
+        authorization = wsgi_environ.get('HTTP_AUTHORIZATION') or ''
+
+        if authorization.startswith('Basic '):
+            skip_sec_types = (SEC_DEF_TYPE.JWT,)
+        elif authorization.startswith('Bearer '):
+            skip_sec_types = (SEC_DEF_TYPE.BASIC_AUTH,)
+        else:
+            skip_sec_types = (SEC_DEF_TYPE.BASIC_AUTH, SEC_DEF_TYPE.JWT)
+
+        for sec_type, client_defs in worker_store.rbac.get_client_defs(http_method_permission_id, channel_item['service_id']):
 
             if is_allowed:
                 break
 
-            if perm_id == http_method_permission_id and resource_id == channel_item['service_id']:
-                for client_def in worker_store.rbac.role_id_to_client_def[role_id]:
+            if sec_type in skip_sec_types:
+                continue
 
-                    _, sec_type, sec_name = client_def.split(sep)
+            for sec_name, client_def in client_defs:
 
-                    _sec = Bunch()
-                    _sec.is_active = True
-                    _sec.transport = plain_http
-                    _sec.sec_use_rbac = False
-                    _sec.sec_def = self.sec_config_getter[sec_type](sec_name)['config']
+                _sec = Bunch()
+                _sec.is_active = True
+                _sec.transport = plain_http
+                _sec.sec_use_rbac = False
+                _sec.sec_def = self.sec_config_getter[sec_type](sec_name)['config']
 
-                    is_allowed = self.check_security(
-                        _sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store, False)
+                is_allowed = self.check_security(
+                    _sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store, False)
 
-                    if is_allowed:
-                        self.enrich_with_sec_data(wsgi_environ, _sec.sec_def, sec_type)
-                        break
+                if is_allowed:
+                    self.enrich_with_sec_data(wsgi_environ, _sec.sec_def, sec_type)
+                    break
 
         if not is_allowed:
             logger.warn('None of RBAC definitions allowed request in, cid:`%s`', cid)
@@ -630,7 +643,8 @@ class URLData(CyURLData, OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
-            self.channel_data.pop(match_idx)
+            self.router.remove(self.channel_data.pop(match_idx))
+            self.match_cache.clear()
 
 # ################################################################################################################################
 
@@ -1131,6 +1145,7 @@ class URLData(CyURLData, OAuthDataStore):
         channel_data.extend(internal_services)
 
         self.channel_data[:] = channel_data
+        self.router.set_order(self.channel_data)
 
 # ################################################################################################################################
 
@@ -1145,6 +1160,10 @@ class URLData(CyURLData, OAuthDataStore):
 
             channel_item[name] = msg[name]
 
+        # Optional cache-related settings, kept in opaque attributes
+        channel_item['cache_single_flight'] = msg.get('cache_single_flight')
+        channel_item['cache_stale_grace'] = msg.get('cache_stale_grace')
+
         if msg.get('security_id'):
             channel_item['sec_type'] = msg['sec_type']
             channel_item['security_id'] = msg['security_id']
@@ -1183,11 +1202,15 @@ class URLData(CyURLData, OAuthDataStore):
         Clears out URL cache for that entry, if it existed at all.
         """
         match_target = '{}{}{}'.format(msg.soap_action, MISC.SEPARATOR, msg.url_path)
-        self.channel_data.append(self._channel_item_from_msg(msg, match_target, old_data))
+        channel_item = self._channel_item_from_msg(msg, match_target, old_data)
+        self.channel_data.append(channel_item)
+        self.router.add(channel_item)
         self.url_sec[match_target] = self._sec_info_from_msg(msg)
-        self.url_path_cache.pop(match_target, None)
         self.sort_channel_data()
 
+        # The new channel may match URL paths previously matched by other channels
+        self.match_cache.clear()
+
     def _delete_channel(self, msg):
         """ Deletes a channel, both its core data and the related security definition. Clears relevant
         entry in URL cache. Returns the deleted data.
@@ -1204,14 +1227,15 @@ class URLData(CyURLData, OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             old_data = self.channel_data.pop(match_idx)
+            self.router.remove(old_data)
         else:
             old_data = {}
 
         # Channel's security now
         del self.url_sec[old_match_target]
 
-        # Delete from URL cache
-        self.url_path_cache.pop(old_match_target, None)
+        # Delete all cached matches - they may point to this channel
+        self.match_cache.clear()
 
         # Re-sort all elements to match against
         self.sort_channel_data()
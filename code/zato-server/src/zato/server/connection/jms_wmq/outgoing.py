@@ -16,6 +16,7 @@ class WMQFacade(object):
     """ A IBM MQ facade for services so they aren't aware that sending WMQ
     messages actually requires us to use the Zato broker underneath.
     """
+    __slots__ = ('service',)
 
 # ################################################################################################################################
 
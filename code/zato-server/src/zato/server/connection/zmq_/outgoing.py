@@ -22,6 +22,8 @@ class ZMQFacade(object):
     """ A ZeroMQ facade for services so they aren't aware that sending ZMQ
     messages actually requires us to use the Zato broker underneath.
     """
+    __slots__ = ('server',)
+
     def __init__(self, server):
         self.server = server
 
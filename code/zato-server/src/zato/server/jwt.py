@@ -13,6 +13,7 @@ import uuid
 from contextlib import closing
 from datetime import datetime
 from logging import getLogger
+from time import time
 
 # Bunch
 from bunch import bunchify, Bunch
@@ -33,20 +34,42 @@ logger = getLogger(__name__)
 
 # ################################################################################################################################
 
+class VerifiedToken(object):
+    """ A token that was already found in the cache, decrypted and decoded.
+    """
+    __slots__ = ('data', 'expires_at', 'renew_at')
+
+    def __init__(self, data, expires_at, renew_at):
+        self.data = data
+        self.expires_at = expires_at
+        self.renew_at = renew_at
+
+# ################################################################################################################################
+
 class JWT(object):
     """ JWT authentication backend.
     """
     ALGORITHM = 'HS256'
 
+    # How many verified tokens to keep in RAM at most before the expired ones are removed
+    MAX_VERIFIED = 100000
+
 # ################################################################################################################################
 
-    def __init__(self, kvdb, odb, secret):
+    def __init__(self, kvdb, odb, secret, renew_interval=0):
         self.odb = odb
         self.cache = RobustCache(kvdb, odb)
 
         self.secret = secret
         self.fernet = Fernet(self.secret)
 
+        # How often, in seconds, to renew TTLs of tokens that keep being used, 0 = on each use.
+        # This is also how long tokens deleted by other processes may be still considered valid in this one.
+        self.renew_interval = renew_interval
+
+        # Token -> VerifiedToken
+        self.verified = {}
+
 # ################################################################################################################################
 
     def _lookup_jwt(self, username, password):
@@ -88,31 +111,73 @@ class JWT(object):
 
 # ################################################################################################################################
 
-    def validate(self, expected_username, token):
+    def _renew(self, token, token_data, now):
+        """ Renews the cache expiration of a token asynchronously and stores it as a verified one.
+        """
+        self.cache.put(token, token, token_data.ttl, async=True)
+
+        verified = self.verified
+        if len(verified) >= self.MAX_VERIFIED:
+            for key, item in verified.items():
+                if item.expires_at <= now:
+                    del verified[key]
+
+            if len(verified) >= self.MAX_VERIFIED:
+                verified.clear()
+
+        # Renewals are not needed more often than every half of a token's TTL
+        verified[token] = VerifiedToken(token_data, now + token_data.ttl, now + min(self.renew_interval, token_data.ttl / 2))
+
+# ################################################################################################################################
+
+    def _check_username(self, expected_username, token_data):
+        if token_data.username == expected_username:
+            return Bunch(valid=True, token=token_data)
+        else:
+            return Bunch(valid=False, message='Unexpected user for token found')
+
+# ################################################################################################################################
+
+    def validate(self, expected_username, token, _time=time):
         """ Check if the given token is (still) valid.
 
-        1. Look for the token in Cache without decrypting/decoding it.
-        2.a If not found, return "Invalid"
-        2.b If found:
-            3. decrypt
-            4. decode
-            5. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
-            5. return "valid" + the token contents
+        1. Look for the token among the ones already verified, if found and its renewal is not due yet,
+           return "valid" + the token contents (or "Unexpected user").
+        2. Look for the token in Cache without decrypting/decoding it.
+        3.a If not found, return "Invalid"
+        3.b If found:
+            4. decrypt (unless it was already verified)
+            5. decode (unless it was already verified)
+            6. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
+            7. return "valid" + the token contents
         """
+        now = _time()
+        verified = self.verified.get(token)
+
+        if verified:
+            if verified.expires_at <= now:
+                del self.verified[token]
+                verified = None
+
+            elif verified.renew_at > now:
+                return self._check_username(expected_username, verified.data)
+
         if self.cache.get(token):
-            decrypted = self.fernet.decrypt(token)
-            token_data = bunchify(jwt.decode(decrypted, self.secret))
+            if verified:
+                token_data = verified.data
+            else:
+                decrypted = self.fernet.decrypt(token)
+                token_data = bunchify(jwt.decode(decrypted, self.secret))
 
             if token_data.username == expected_username:
 
                 # Renew the token expiration
-                self.cache.put(token, token, token_data.ttl, async=True)
-                return Bunch(valid=True, token=token_data)
+                self._renew(token, token_data, now)
 
-            else:
-                return Bunch(valid=False, message='Unexpected user for token found')
+            return self._check_username(expected_username, token_data)
 
         else:
+            self.verified.pop(token, None)
             return Bunch(valid=False, message='Invalid token')
 
 # ################################################################################################################################
@@ -120,6 +185,7 @@ class JWT(object):
     def delete(self, token):
         """ Deletes a token in both KVDB and ODB.
         """
+        self.verified.pop(token, None)
         self.cache.delete(token)
 
 # ################################################################################################################################
@@ -71,6 +71,8 @@ class MessageFacade(object):
     """ An object through which services access all the message-related features,
     such as namespaces, JSON Pointer or XPath.
     """
+    __slots__ = ('_json_pointer_store', '_xpath_store', '_ns_store', '_payload', '_time_util')
+
     def __init__(self, json_pointer_store=None, xpath_store=None, ns_store=None, payload=None, time_util=None):
         self._json_pointer_store = json_pointer_store
         self._xpath_store = xpath_store
@@ -16,7 +16,8 @@ from operator import attrgetter
 from traceback import format_exc
 
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
+from gevent.event import AsyncResult, Event
 from gevent.lock import RLock
 
 # globre
@@ -30,10 +31,15 @@ from zato.common import DATA_FORMAT, PUBSUB, SEARCH
 from zato.common.broker_message import PUBSUB as BROKER_MSG_PUBSUB
 from zato.common.exception import BadRequest
 from zato.common.odb.model import WebSocketClientPubSubKeys
+from zato.common.odb.query.pubsub.cleanup import delete_enq_delivered, delete_enq_marked_deleted, delete_msg_delivered, \
+     delete_msg_expired_batch
 from zato.common.odb.query.pubsub.delivery import confirm_pubsub_msg_delivered as _confirm_pubsub_msg_delivered, \
-     get_delivery_server_for_sub_key, get_sql_messages_by_msg_id_list as _get_sql_messages_by_msg_id_list, \
+     confirm_pubsub_msg_delivered_by_queue_id, get_delivery_server_for_sub_key, \
+     get_sql_messages_by_msg_id_list as _get_sql_messages_by_msg_id_list, \
      get_sql_messages_by_sub_key as _get_sql_messages_by_sub_key, get_sql_msg_ids_by_sub_key as _get_sql_msg_ids_by_sub_key
+from zato.common.odb.query.pubsub.publish import sql_publish_batch_with_retry
 from zato.common.odb.query.pubsub.queue import set_to_delete
+from zato.common.odb.query.pubsub.topic import get_gd_depth_all_topics
 from zato.common.pubsub import skip_to_external
 from zato.common.util import make_repr, new_cid, spawn_greenlet
 from zato.common.util.hook import HookTool
@@ -220,6 +226,10 @@ class Topic(object):
         # The last time a GD message was published to this topic
         self.gd_pub_time_max = None
 
+        # An approximate number of GD messages in this topic that are not in any subscriber's queue yet, updated on each
+        # publication from current server and periodically refreshed from SQL by PubSubHousekeeper.
+        self.gd_depth = 0
+
 # ################################################################################################################################
 
     def _set_hooks(self):
@@ -256,13 +266,10 @@ class Topic(object):
 
 # ################################################################################################################################
 
-    def needs_msg_cleanup(self):
-        return self.msg_pub_counter_gd % 10000 == 0
-
-# ################################################################################################################################
-
-    def needs_depth_check(self):
-        return self.msg_pub_counter_gd % self.depth_check_freq == 0
+    def get_task_sync_wait_time(self, _utcnow_as_ms=utcnow_as_ms):
+        """ Returns how many seconds are left until the topic needs to sync its state with subscribers.
+        """
+        return max(self.task_sync_interval - (_utcnow_as_ms() - self.last_synced), 0)
 
 # ################################################################################################################################
 
@@ -346,6 +353,7 @@ class InRAMSyncBacklog(object):
         self.msg_id_to_sub_key = {} # Msg ID   -> Sub key set  - What subscribers are interested in a given message
         self.msg_id_to_msg = {}     # Msg ID   -> Message data - What is the actual contents of each message
         self.topic_msg_id = {}      # Topic ID -> Msg ID set --- What messages are available for each topic (no matter sub_key)
+        self.msg_id_to_topic_id = {} # Msg ID  -> Topic ID ------- What topic a given message was published to
         self.lock = RLock()
 
         # Start in background a cleanup task that deletes all expired and removed messages
@@ -390,9 +398,10 @@ class InRAMSyncBacklog(object):
                 if 'priority' not in msg:
                     msg['priority'] = _default_pri
 
-                # .. add a reverse mapping, from message ID to sub_key ..
+                # .. add reverse mappings, from message ID to sub_key and to topic ..
                 msg_sub_key = self.msg_id_to_sub_key.setdefault(msg['pub_msg_id'], set())
                 msg_sub_key.update(sub_keys)
+                self.msg_id_to_topic_id[msg['pub_msg_id']] = topic_id
 
             # .. and add a reference to it to the topic.
             topic_messages.update(msg_ids)
@@ -420,6 +429,34 @@ class InRAMSyncBacklog(object):
         """
         return self.delete_messages([msg_id])
 
+# ################################################################################################################################
+
+    def _delete_msg(self, msg_id):
+        """ Deletes all references to a message, using reverse mappings to visit only the topic and sub_keys
+        that the message belongs to. Must be called with self.lock held. Returns a tuple of flags indicating what was found.
+        """
+        found_to_sub_key = self.msg_id_to_sub_key.pop(msg_id, None)
+        found_to_msg = self.msg_id_to_msg.pop(msg_id, None)
+        topic_id = self.msg_id_to_topic_id.pop(msg_id, None)
+
+        _has_topic_msg = False # Was the ID found for its topic
+        _has_sk_msg = False    # Was the ID found for at least one sub_key
+
+        _topic_msg_set = self.topic_msg_id.get(topic_id)
+        if _topic_msg_set is not None and msg_id in _topic_msg_set:
+            _topic_msg_set.remove(msg_id)
+            _has_topic_msg = True
+
+        # It is possible that not all of the sub_keys from the reverse mapping point to the message,
+        # e.g. if it could not be stored for some of them because the topic's max depth was reached.
+        for sub_key in found_to_sub_key or ():
+            _sk_msg_set = self.sub_key_to_msg_id.get(sub_key)
+            if _sk_msg_set is not None and msg_id in _sk_msg_set:
+                _sk_msg_set.remove(msg_id)
+                _has_sk_msg = True
+
+        return found_to_sub_key, found_to_msg, _has_topic_msg, _has_sk_msg
+
 # ################################################################################################################################
 
     def _delete_messages(self, msg_list):
@@ -429,27 +466,7 @@ class InRAMSyncBacklog(object):
 
         for msg_id in list(msg_list):
 
-            found_to_sub_key = self.msg_id_to_sub_key.pop(msg_id, None)
-            found_to_msg = self.msg_id_to_msg.pop(msg_id, None)
-
-            _has_topic_msg = False # Was the ID found for at least one topic
-            _has_sk_msg = False     # Ditto but for sub_keys
-
-            for _topic_msg_set in self.topic_msg_id.itervalues():
-                try:
-                    _topic_msg_set.remove(msg_id)
-                except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
-                else:
-                    _has_topic_msg = True
-
-            for _sk_msg_set in self.sub_key_to_msg_id.itervalues():
-                try:
-                    _sk_msg_set.remove(msg_id)
-                except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
-                else:
-                    _has_sk_msg = True
+            found_to_sub_key, found_to_msg, _has_topic_msg, _has_sk_msg = self._delete_msg(msg_id)
 
             if not found_to_sub_key:
                 logger.warn('Message not found (msg_id_to_sub_key) %s', msg_id)
@@ -475,6 +492,30 @@ class InRAMSyncBacklog(object):
         with self.lock:
             self._delete_messages(msg_list)
 
+# ################################################################################################################################
+
+    def _delete_messages_by_sub_key(self, sub_key, msg_list):
+        """ Deletes all messages from input msg_list for a single subscriber, messages that no other subscriber
+        is waiting for are deleted completely. Must be called with self.lock held.
+        """
+        sub_key_msg = self.sub_key_to_msg_id.get(sub_key)
+
+        for msg_id in msg_list:
+
+            current_subs = self.msg_id_to_sub_key.get(msg_id)
+
+            # The message may have been already deleted, e.g. because it expired
+            if current_subs is None:
+                continue
+
+            current_subs.discard(sub_key)
+            if sub_key_msg:
+                sub_key_msg.discard(msg_id)
+
+            # No other subscribers are interested in this message so we can delete it altogether
+            if not current_subs:
+                self._delete_msg(msg_id)
+
 # ################################################################################################################################
 
     def has_messages_by_sub_key(self, sub_key):
@@ -533,41 +574,16 @@ class InRAMSyncBacklog(object):
         # Explicitly delete a left-over name from the loop above
         del sub_key
 
-        # Delete all messages marked to be deleted ..
+        # Delete all messages marked to be deleted, along with all their references ..
         for msg_id in to_delete_msg:
-
-            # .. first, direct mappings ..
-            self.msg_id_to_msg.pop(msg_id, None)
+            self._delete_msg(msg_id)
 
             logger.info('Deleting msg from mapping dict `%s`', msg_id)
 
-            # .. now, remove the message from topic ..
-            self.topic_msg_id[topic_id].remove(msg_id)
-
-            logger.info('Deleting msg from mapping topic `%s`', msg_id)
-
-            # .. now, find the message for each sub_key ..
+        # .. and now delete the sub_keys if we are explicitly told to (e.g. during unsubscribe).
+        if delete_sub:
             for sub_key in sub_keys:
-                sub_key_to_msg_id = self.sub_key_to_msg_id.get(sub_key)
-
-                # We need this if statement because it is possible that a client is subscribed to a topic
-                # but it will not receive a particular message. This is possible if the message is a response
-                # to a previous request and the latter used reply_to_sk, in which only that one sub_key pointed to by reply_to_sk
-                # will get the response, which ultimately means that self.sub_key_to_msg_id will not have this response
-                # for current sub_key.
-                if sub_key_to_msg_id:
-
-                    # .. delete the message itself - but we need to catch ValueError because
-                    # to_delete_msg is a list of all messages to be deleted and we do not know
-                    # if this particular message belonged to this particular sub_key or not.
-                    try:
-                        sub_key_to_msg_id.remove(msg_id)
-                    except KeyError:
-                        pass # OK, message was not found for this sub_key
-
-                    # .. now delete the sub_key either because we are explicitly told to (e.g. during unsubscribe)
-                    if delete_sub:# or (not sub_key_to_msg_id):
-                        del self.sub_key_to_msg_id[sub_key]
+                self.sub_key_to_msg_id.pop(sub_key, None)
 
         return out
 
@@ -628,21 +644,9 @@ class InRAMSyncBacklog(object):
                 # .. get all messages waiting for this subscriber, assuming there are any at all ..
                 msg_ids = self.sub_key_to_msg_id.pop(sub_key, [])
 
-                # .. for each message found we need to check if it is needed by any other subscriber,
-                # and if it's not, then we delete all the reference to this message. Otherwise, we leave it
-                # as is, because there is at least one other subscriber waiting for it.
-                for msg_id in msg_ids:
-
-                    # Get all subscribers interested in this message ..
-                    current_subs = self.msg_id_to_sub_key[msg_id]
-                    current_subs.remove(sub_key)
-
-                    # .. if the list is empty, it means that there no some subscribers left for that message,
-                    # in which case we may deleted references to this message from other look-up structures.
-                    if not current_subs:
-                        del self.msg_id_to_msg[msg_id]
-                        topic_msg = self.topic_msg_id[topic_id]
-                        topic_msg.remove(msg_id)
+                # .. and delete them for this subscriber. Messages that at least one other subscriber is waiting for
+                # are left as they are, all references to the remaining ones are deleted.
+                self._delete_messages_by_sub_key(sub_key, msg_ids)
 
         logger.info(pattern, sub_keys, topic_name)
         logger_zato.info(pattern, sub_keys, topic_name)
@@ -687,20 +691,10 @@ class InRAMSyncBacklog(object):
                     # For logging what was done
                     len_expired = len(expired_msg)
 
-                    # Iterate over all the expired messages found and delete them from in-RAM structures
+                    # Iterate over all the expired messages found and delete them from in-RAM structures,
+                    # including all sub_keys waiting for them and their topics.
                     for msg_id, topic_id in expired_msg:
-
-                        # Get all sub_keys waiting for these messages and delete the message from each one,
-                        # but note that there may be possibly no subscribers at all if the message was published
-                        # to a topic without any subscribers.
-                        for sub_key in self.msg_id_to_sub_key.pop(msg_id):
-                            self.sub_key_to_msg_id[sub_key].remove(msg_id)
-
-                        # Remove all references to the message from topic
-                        self.topic_msg_id[topic_id].remove(msg_id)
-
-                        # And finally, remove the message's contents
-                        del self.msg_id_to_msg[msg_id]
+                        self._delete_msg(msg_id)
 
                 suffix = 's' if (len_expired==0 or len_expired > 1) else ''
                 len_messages = len(self.msg_id_to_msg)
@@ -741,6 +735,291 @@ class InRAMSyncBacklog(object):
 
 # ################################################################################################################################
 
+class GDPubBatch(object):
+    """ Publications of GD messages to a single topic that are to be committed to SQL in one transaction.
+    """
+    __slots__ = ('topic', 'items')
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.items = [] # A list of (cid, ctx, AsyncResult) tuples
+
+# ################################################################################################################################
+
+class GDPubBatcher(object):
+    """ Group-commits publications of GD messages - publications to the same topic that arrive within wait_time milliseconds
+    of each other are written to SQL in a single transaction, with multi-row INSERTs, and each publisher waits until
+    the batch its messages are in is committed.
+    """
+    def __init__(self, pubsub, wait_time, max_size):
+        self.pubsub = pubsub
+        self.wait_time = wait_time / 1000.0
+        self.max_size = max_size
+        self.lock = RLock()
+        self.batches = {} # Topic ID -> GDPubBatch object still accepting new publications
+
+# ################################################################################################################################
+
+    def publish(self, cid, ctx):
+        """ Adds ctx, a publication context, to its topic's current batch and blocks until the batch is committed.
+        """
+        result = AsyncResult()
+        topic = ctx.topic
+
+        with self.lock:
+            batch = self.batches.get(topic.id)
+
+            # This is the first publication in a new batch which will be flushed once self.wait_time elapses ..
+            if batch is None:
+                batch = self.batches[topic.id] = GDPubBatch(topic)
+                spawn_later(self.wait_time, self.flush, batch)
+
+            batch.items.append((cid, ctx, result))
+
+            # .. or sooner if it is already full, in which case new publications will go to a new batch.
+            if len(batch.items) >= self.max_size:
+                del self.batches[topic.id]
+                spawn(self._flush, batch)
+
+        result.get()
+
+# ################################################################################################################################
+
+    def flush(self, batch):
+        """ Commits all publications from a batch to SQL and wakes up their publishers, unless the batch was already flushed.
+        """
+        with self.lock:
+
+            # This batch has been already flushed because it became full before self.wait_time elapsed
+            if self.batches.get(batch.topic.id) is not batch:
+                return
+
+            del self.batches[batch.topic.id]
+
+        self._flush(batch)
+
+# ################################################################################################################################
+
+    def _flush(self, batch):
+        """ Publishes a batch that no longer accepts new publications.
+        """
+        try:
+            try:
+                self._publish(batch, batch.items)
+            except Exception as e:
+
+                # If there was only one publication, it is its publisher that receives the exception ..
+                if len(batch.items) == 1:
+                    batch.items[0][2].set_exception(e)
+
+                # .. otherwise, it may have been caused by any of them, e.g. because of a duplicate msg_id, so each one
+                # is published separately to let only publishers of messages that caused the error receive an exception.
+                else:
+                    logger.info('Could not publish GD batch for `%s` (%d), publishing separately, e:`%s`',
+                        batch.topic.name, len(batch.items), format_exc())
+
+                    for item in batch.items:
+                        try:
+                            self._publish(batch, [item])
+                        except Exception as e:
+                            item[2].set_exception(e)
+
+        # Publishers wait for their results without a timeout so each of them must receive one even if we could not
+        # even finish trying, e.g. because this greenlet was killed.
+        except BaseException as e:
+            for item in batch.items:
+                if not item[2].ready():
+                    item[2].set_exception(e)
+            raise
+
+# ################################################################################################################################
+
+    def _publish(self, batch, items):
+        """ Runs the actual SQL transaction for publications from items which all belong to the same batch.
+        """
+        topic = batch.topic
+        cid, ctx, _ = items[0]
+
+        logger.info('Inserting GD batch for topic `%s` (%d) cids:`%s`', topic.name, len(items), [item[0] for item in items])
+
+        with closing(self.pubsub.server.odb.session()) as session:
+            sql_publish_batch_with_retry(session, cid, ctx.cluster_id, topic.id,
+                [(item_ctx.subscriptions_by_topic, item_ctx.gd_msg_list, item_ctx.now) for _, item_ctx, _ in items])
+
+            session.commit()
+
+        for item in items:
+            item[2].set(True)
+
+# ################################################################################################################################
+
+class PubSubHousekeeper(object):
+    """ Runs in background pub/sub maintenance that would otherwise slow down publications - refreshes approximate depths
+    of topics and, in the first worker of a server only, deletes messages already delivered or expired,
+    the latter in batches of no more than batch_size messages per transaction.
+    """
+    def __init__(self, pubsub, interval, batch_size):
+        self.pubsub = pubsub
+        self.interval = interval
+        self.batch_size = batch_size
+
+# ################################################################################################################################
+
+    def run(self):
+        while self.pubsub.keep_running:
+            sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                logger.warn('Could not run pub/sub housekeeping, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def run_once(self, _utcnow_as_ms=utcnow_as_ms):
+        """ Runs a single housekeeping iteration for all topics.
+        """
+        cluster_id = self.pubsub.cluster_id
+
+        with self.pubsub.lock:
+            topics = self.pubsub.topics.values()
+
+        with closing(self.pubsub.server.odb.session()) as session:
+
+            # Only one worker process needs to delete messages ..
+            if self.pubsub.server.is_first_worker:
+                for topic in topics: # type: Topic
+
+                    # An error in one topic should not prevent the other ones from being cleaned up
+                    try:
+                        self.cleanup_topic(session, cluster_id, topic.id, _utcnow_as_ms())
+                    except Exception:
+                        session.rollback()
+                        logger.warn('Could not clean up topic `%s`, e:`%s`', topic.name, format_exc())
+
+            # .. but each one refreshes depths of its topics - worker processes share no memory and each of them checks
+            # max_depth_gd against its own copy of a topic when publishing. This is a single query for all topics.
+            topic_depth = dict(get_gd_depth_all_topics(session, cluster_id))
+
+        for topic in topics: # type: Topic
+            topic.gd_depth = topic_depth.get(topic.id, 0)
+
+# ################################################################################################################################
+
+    def cleanup_topic(self, session, cluster_id, topic_id, now):
+        """ Deletes messages already delivered from a topic and its queues and then expired messages in batches.
+        """
+        delete_enq_delivered(session, cluster_id, topic_id)
+        delete_enq_marked_deleted(session, cluster_id, topic_id)
+        delete_msg_delivered(session, cluster_id, topic_id)
+        session.commit()
+
+        total_expired = 0
+
+        while True:
+            deleted = delete_msg_expired_batch(session, cluster_id, topic_id, now, self.batch_size)
+            session.commit()
+
+            total_expired += deleted
+
+            # Nothing more to delete ..
+            if deleted < self.batch_size:
+                break
+
+            # .. otherwise, let other greenlets run before the next batch.
+            sleep(0)
+
+        if total_expired:
+            logger.info('Deleted %d expired message(s) from topic `%s`', total_expired, topic_id)
+
+# ################################################################################################################################
+
+class DeliveryConfirmationBuffer(object):
+    """ Collects confirmations of GD messages delivered by all delivery tasks of a worker process and periodically
+    flushes them to SQL with set-based UPDATEs by IDs of messages in subscriber queues, rather than running an UPDATE
+    each time a batch of messages is delivered. Until a confirmation is flushed, messages are still waiting for delivery
+    in SQL, so if the process stops before that, they will be delivered again rather than lost.
+    """
+    def __init__(self, pubsub, interval, max_size):
+        self.pubsub = pubsub
+        self.interval = interval / 1000.0
+        self.max_size = max_size
+        self.lock = RLock()
+        self.flush_event = Event()
+        self.len_pending = 0
+        self.pending = {}  # Sub key -> A set of endp_msg_queue_id values delivered but not confirmed in SQL yet
+        self.flushing = {} # Sub key -> The same but for a flush currently in progress
+
+# ################################################################################################################################
+
+    def add(self, sub_key, endp_msg_queue_id_list):
+        with self.lock:
+            self.pending.setdefault(sub_key, set()).update(endp_msg_queue_id_list)
+            self.len_pending += len(endp_msg_queue_id_list)
+
+            # Do not wait for self.interval if there are already enough confirmations for a flush
+            if self.len_pending >= self.max_size:
+                self.flush_event.set()
+
+# ################################################################################################################################
+
+    def get_pending(self, sub_key):
+        """ Returns endp_msg_queue_id values of all messages delivered to sub_key whose confirmations are not in SQL yet.
+        """
+        with self.lock:
+            return self.pending.get(sub_key, set()) | self.flushing.get(sub_key, set())
+
+# ################################################################################################################################
+
+    def run(self):
+        while self.pubsub.keep_running:
+            self.flush_event.wait(self.interval)
+            self.flush_event.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                logger.warn('Could not flush delivery confirmations, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def flush(self, _utcnow_as_ms=utcnow_as_ms):
+        """ Confirms in SQL all the messages delivered since the previous flush.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+
+            self.flushing = self.pending
+            self.pending = {}
+            self.len_pending = 0
+
+        try:
+            endp_msg_queue_id_list = []
+            for value in self.flushing.itervalues():
+                endp_msg_queue_id_list.extend(value)
+
+            with closing(self.pubsub.server.odb.session()) as session:
+                confirm_pubsub_msg_delivered_by_queue_id(
+                    session, self.pubsub.cluster_id, endp_msg_queue_id_list, _utcnow_as_ms())
+                session.commit()
+
+        except Exception:
+
+            # Keep the confirmations for the next flush - until then, they will be still in self.pending
+            # so delivery tasks will not fetch their messages from SQL again.
+            with self.lock:
+                for sub_key, value in self.flushing.iteritems():
+                    self.pending.setdefault(sub_key, set()).update(value)
+                    self.len_pending += len(value)
+                self.flushing = {}
+            raise
+
+        else:
+            with self.lock:
+                self.flushing = {}
+
+# ################################################################################################################################
+
 class PubSub(object):
     def __init__(self, cluster_id, server, broker_client=None):
         self.cluster_id = cluster_id
@@ -800,7 +1079,40 @@ class PubSub(object):
         # Manages access to service hooks
         self.hook_tool = HookTool(self.server, HookCtx, hook_type_to_method, self.invoke_service)
 
+        # Set each time a message is published to any topic so that trigger_notify_pubsub_tasks does not need to poll topics
+        self.sync_event = Event()
+
+        # How long trigger_notify_pubsub_tasks should wait, in seconds, if no messages at all are waiting to be synced
+        self.sync_idle_wait_time = 5
+
+        # If batches of GD messages are to be committed to SQL in one transaction, this is how long, in milliseconds,
+        # to wait for publications to the same topic to gather in a batch. Zero means that each one is committed separately.
+        gd_pub_batch_wait_time = int(self.server.fs_server_config.pubsub.get('gd_pub_batch_wait_time') or 0)
+        gd_pub_batch_max_size = int(self.server.fs_server_config.pubsub.get('gd_pub_batch_max_size') or 500)
+
+        self.gd_pub_batcher = GDPubBatcher(self, gd_pub_batch_wait_time, gd_pub_batch_max_size) \
+            if gd_pub_batch_wait_time else None
+
+        # How often, in seconds, to refresh topic and subscription depths and to delete old messages in background,
+        # and how many expired messages at most to delete in a single transaction.
+        housekeeping_interval = int(self.server.fs_server_config.pubsub.get('housekeeping_interval') or 10)
+        housekeeping_batch_size = int(self.server.fs_server_config.pubsub.get('housekeeping_batch_size') or 1000)
+
+        self.housekeeper = PubSubHousekeeper(self, housekeeping_interval, housekeeping_batch_size)
+
+        # How often, in milliseconds, to flush confirmations of GD messages delivered to SQL, and how many confirmations
+        # at most to collect before flushing them sooner. Zero means that each delivery is confirmed immediately.
+        delivery_confirm_interval = int(self.server.fs_server_config.pubsub.get('delivery_confirm_interval') or 0)
+        delivery_confirm_max_size = int(self.server.fs_server_config.pubsub.get('delivery_confirm_max_size') or 5000)
+
+        self.delivery_confirm_buffer = DeliveryConfirmationBuffer(self, delivery_confirm_interval, delivery_confirm_max_size) \
+            if delivery_confirm_interval else None
+
         spawn_greenlet(self.trigger_notify_pubsub_tasks)
+        spawn_greenlet(self.housekeeper.run)
+
+        if self.delivery_confirm_buffer:
+            spawn_greenlet(self.delivery_confirm_buffer.run)
 
 # ################################################################################################################################
 
@@ -1630,12 +1942,34 @@ class PubSub(object):
 
 # ################################################################################################################################
 
-    def confirm_pubsub_msg_delivered(self, sub_key, delivered_pub_msg_id_list):
-        """ Sets in SQL delivery status of a given message to True.
+    def confirm_pubsub_msg_delivered(self, sub_key, delivered_msg_list):
+        """ Sets in SQL delivery status of input GD messages to delivered, either immediately or in the next flush
+        of delivery confirmations.
         """
-        with closing(self.server.odb.session()) as session:
-            _confirm_pubsub_msg_delivered(session, self.server.cluster_id, sub_key, delivered_pub_msg_id_list, utcnow_as_ms())
-            session.commit()
+        if self.delivery_confirm_buffer:
+            self.delivery_confirm_buffer.add(sub_key, [msg.endp_msg_queue_id for msg in delivered_msg_list])
+        else:
+            with closing(self.server.odb.session()) as session:
+                _confirm_pubsub_msg_delivered(session, self.server.cluster_id, sub_key,
+                    [msg.pub_msg_id for msg in delivered_msg_list], utcnow_as_ms())
+                session.commit()
+
+# ################################################################################################################################
+
+    def get_pending_confirmations(self, sub_key):
+        """ Returns endp_msg_queue_id values of messages delivered to sub_key that are not confirmed in SQL yet.
+        """
+        return self.delivery_confirm_buffer.get_pending(sub_key) if self.delivery_confirm_buffer else set()
+
+# ################################################################################################################################
+
+    def incr_gd_depth(self, topic, subscriptions_by_topic, len_gd_msg_list):
+        """ Updates approximate depth of a topic after GD messages were published to it. Messages that went straight
+        to subscriber queues do not stay in the topic so they do not increase its depth.
+        """
+        if not subscriptions_by_topic:
+            with self.lock:
+                topic.gd_depth += len_gd_msg_list
 
 # ################################################################################################################################
 
@@ -1888,6 +2222,10 @@ class PubSub(object):
         else:
             topic.sync_has_non_gd_msg = value
 
+        # Wake up trigger_notify_pubsub_tasks because there are new messages for the topic
+        if value:
+            self.sync_event.set()
+
 # ################################################################################################################################
 
     def set_sync_has_msg(self, topic_id, is_gd, value, gd_pub_time_max):
@@ -1905,12 +2243,18 @@ class PubSub(object):
         def _cmp_non_gd_msg(elem):
             return elem['pub_time']
 
+        # How long to wait for new messages before checking the topics again
+        wait_time = self.sync_idle_wait_time
+
         # Loop forever or until stopped
         while self.keep_running:
 
-            # Sleep for a while before continuing - the call to sleep is here because this while loop is quite long
-            # so it would be inconvenient to have it down below.
-            sleep(0.01)
+            # Wait until a message is published or until it is time to sync a topic that has messages already - the call
+            # is here because this while loop is quite long so it would be inconvenient to have it down below.
+            self.sync_event.wait(wait_time)
+            self.sync_event.clear()
+
+            wait_time = self.sync_idle_wait_time
 
             # Blocks other pub/sub processes for a moment
             with self.lock:
@@ -1921,17 +2265,18 @@ class PubSub(object):
                 # Get all topics ..
                 for _topic in self.topics.itervalues(): # type: Topic
 
-                    # Does the topic require task synchronization now?
+                    # Skip the topic if we know that there have been no messages published to it since the last time ..
+                    if not (_topic.sync_has_gd_msg or _topic.sync_has_non_gd_msg):
+                        continue
+
+                    # .. otherwise, check if the time has come for this topic to sync its state with subscribers,
+                    # and if it has not, make sure we wake up when it does.
                     if not _topic.needs_task_sync():
+                        wait_time = min(wait_time, _topic.get_task_sync_wait_time())
                         continue
                     else:
                         _topic.update_task_sync_time()
 
-                    # OK, the time has come for this topic to sync its state with subscribers
-                    # but still skip it if we know that there have been no messages published to it since the last time.
-                    if not (_topic.sync_has_gd_msg or _topic.sync_has_non_gd_msg):
-                        continue
-
                     # If it does, get subscriptions for it ..
                     subs = self.get_subscriptions_by_topic(_topic.name, require_backlog_messages=True)
 
@@ -2246,3 +2591,77 @@ class PubSub(object):
 
 # ################################################################################################################################
 # ################################################################################################################################
+
+def run(subscribers=10000, messages=100000, topics=100, batch_size=100):
+    """ Measures how long it takes to add non-GD messages to InRAMSyncBacklog and then to delete them,
+    half of them by unsubscribing individual subscribers and the other half in batches of message IDs.
+    Each topic has the same number of subscribers and messages.
+    """
+    # stdlib
+    from time import time
+
+    # Bunch
+    from bunch import Bunch
+
+    pubsub = Bunch(server=Bunch(name='bench', pid=1))
+    backlog = InRAMSyncBacklog(pubsub)
+
+    subs_per_topic = subscribers // topics
+    msg_per_topic = messages // topics
+    expiration_time = utcnow_as_ms() + 3600
+
+    topic_sub_keys = {}
+    topic_msg_ids = {}
+
+    for topic_id in xrange(topics):
+        topic_sub_keys[topic_id] = ['zpsk.{}.{}'.format(topic_id, idx) for idx in xrange(subs_per_topic)]
+        topic_msg_ids[topic_id] = ['zpsm.{}.{}'.format(topic_id, idx) for idx in xrange(msg_per_topic)]
+
+    # Keep it quiet, otherwise each message ID and each subscriber would be logged
+    logger.disabled = True
+    logger_zato.disabled = True
+
+    try:
+        now = time()
+        for topic_id in xrange(topics):
+            msg_list = [{'pub_msg_id': msg_id, 'expiration_time': expiration_time} for msg_id in topic_msg_ids[topic_id]]
+            backlog.add_messages(None, topic_id, 'topic.{}'.format(topic_id), messages, topic_sub_keys[topic_id], msg_list)
+        add_time = time() - now
+
+        unsub_topics = xrange(0, topics, 2)
+        batch_topics = xrange(1, topics, 2)
+
+        now = time()
+        for topic_id in unsub_topics:
+            topic_name = 'topic.{}'.format(topic_id)
+            for sub_key in topic_sub_keys[topic_id]:
+                backlog.unsubscribe(topic_id, topic_name, [sub_key])
+        unsub_time = time() - now
+
+        now = time()
+        for topic_id in batch_topics:
+            msg_ids = topic_msg_ids[topic_id]
+            for idx in xrange(0, len(msg_ids), batch_size):
+                backlog.delete_messages(msg_ids[idx:idx+batch_size])
+        batch_time = time() - now
+
+    finally:
+        logger.disabled = False
+        logger_zato.disabled = False
+
+    unsub_messages = len(unsub_topics) * subs_per_topic * msg_per_topic
+    batch_messages = len(batch_topics) * msg_per_topic
+
+    print('Subscribers:{} messages:{} topics:{}, left:{}'.format(subscribers, messages, topics, len(backlog.msg_id_to_msg)))
+    print('Added in {:.3f}s'.format(add_time))
+    print('Unsubscribed from {} messages in {:.3f}s ({:.2f} us each)'.format(
+        unsub_messages, unsub_time, unsub_time / (unsub_messages or 1) * 10**6))
+    print('Deleted {} messages in batches of {} in {:.3f}s ({:.2f} us each)'.format(
+        batch_messages, batch_size, batch_time, batch_time / (batch_messages or 1) * 10**6))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    run()
+
+# ################################################################################################################################
@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from bisect import bisect_left
 from copy import deepcopy
+from operator import attrgetter
 from json import loads
 from logging import getLogger
 from socket import error as SocketError
@@ -18,10 +19,11 @@ from traceback import format_exc
 
 # gevent
 from gevent import sleep, spawn
+from gevent.event import Event
 from gevent.lock import RLock
 
 # sortedcontainers
-from sortedcontainers import SortedList as _SortedList
+from sortedcontainers import SortedListWithKey
 
 # Zato
 from zato.common import GENERIC, PUBSUB
@@ -45,26 +47,37 @@ _notify_methods = (PUBSUB.DELIVERY_METHOD.NOTIFY.id, PUBSUB.DELIVERY_METHOD.WEB_
 
 # ################################################################################################################################
 
-class SortedList(_SortedList):
+class SortedList(SortedListWithKey):
     """ A custom subclass that knows how to remove pubsub messages from SortedList instances.
+    Messages are ordered by their precomputed sort keys rather than through Message.__cmp__ so that insertions
+    and lookups compare plain tuples without calling any Python-level methods.
     """
+    def __init__(self, iterable=None, key=attrgetter('sort_key'), *args, **kwargs):
+        super(SortedList, self).__init__(iterable, key, *args, **kwargs)
+
     def remove_pubsub_msg(self, msg):
         """ Removes a pubsub message from a SortedList instance - we cannot use the regular .remove method
         because it may triggger __cmp__ per https://github.com/grantjenks/sorted_containers/issues/81.
         """
-        pos = bisect_left(self._maxes, msg)
+        key = msg.sort_key
+        pos = bisect_left(self._maxes, key)
 
-        if pos == len(self._maxes):
-            raise ValueError('{0!r} not in list'.format(msg))
+        # Messages with the same sort key may span more than one sublist
+        while pos < len(self._maxes):
+            _keys = self._keys[pos]
+            _list = self._lists[pos]
 
-        for _list_idx, _list_msg in enumerate(self._lists[pos]):
-            if msg.pub_msg_id == _list_msg.pub_msg_id:
-                idx = _list_idx
-                break
-        else:
-            raise ValueError('{0!r} not in list'.format(msg))
+            for idx in xrange(bisect_left(_keys, key), len(_keys)):
+                if _keys[idx] != key:
+                    raise ValueError('{0!r} not in list'.format(msg))
+
+                if msg.pub_msg_id == _list[idx].pub_msg_id:
+                    self._delete(pos, idx)
+                    return
+
+            pos += 1
 
-        self._delete(pos, idx)
+        raise ValueError('{0!r} not in list'.format(msg))
 
 # ################################################################################################################################
 
@@ -100,6 +113,13 @@ class DeliveryTask(object):
         # This is a lock used for micro-operations such as changing or consulting the contents of self.delete_requested.
         self.interrupt_lock = RLock()
 
+        # Set each time new messages are added to self.delivery_list so that the task does not need to poll for them
+        self.wakeup = Event()
+
+        # How long to wait, in seconds, if there are no messages at all - new ones always wake the task up immediately
+        # so this is only to check periodically if the task should still be running or if its configuration changed.
+        self.idle_wait_time = 5
+
         # If self.wrap_in_list is True, messages will be always wrapped in a list,
         # even if there is only one message to send. Note that self.wrap_in_list will be False
         # only if both batch_size is 1 and wrap_one_msg_in_list is True.
@@ -299,10 +319,8 @@ class DeliveryTask(object):
         else:
             # On successful delivery, remove these messages from SQL and our own delivery_list
             try:
-                # All message IDs that we have delivered
-                delivered_msg_id_list = [msg.pub_msg_id for msg in to_deliver]
                 with self.delivery_lock:
-                    self.confirm_pubsub_msg_delivered_cb(self.sub_key, delivered_msg_id_list)
+                    self.confirm_pubsub_msg_delivered_cb(self.sub_key, to_deliver)
 
             except Exception:
                 e = format_exc()
@@ -315,10 +333,10 @@ class DeliveryTask(object):
                         self.delivery_list.remove_pubsub_msg(msg)
 
                 # Status of messages is updated in both SQL and RAM so we can now log success
-                len_delivered = len(delivered_msg_id_list)
+                len_delivered = len(to_deliver)
                 suffix = ' ' if len_delivered == 1 else 's '
                 logger.info('Successfully delivered %s message%s%s to %s (%s -> %s) [dlvc:%d]',
-                    len_delivered, suffix, delivered_msg_id_list, self.sub_key, self.topic_name, self.sub_config.endpoint_name,
+                    len_delivered, suffix, [msg.pub_msg_id for msg in to_deliver], self.sub_key, self.topic_name, self.sub_config.endpoint_name,
                     self.delivery_counter)
 
                 self.delivery_counter += 1
@@ -342,6 +360,23 @@ class DeliveryTask(object):
                     self.sub_key, now, self.last_run, diff, self.delivery_interval, len(self.delivery_list))
                 return True
 
+# ################################################################################################################################
+
+    def _get_wait_time(self, _now=utcnow_as_ms):
+        """ Returns for how long the task should wait for new messages before checking again if it should run.
+        """
+        if self.delivery_list:
+            return max(self.delivery_interval - (_now() - self.last_run), 0)
+        else:
+            return self.idle_wait_time
+
+# ################################################################################################################################
+
+    def wake_up(self):
+        """ Lets the task know that there are new messages in its delivery list.
+        """
+        self.wakeup.set()
+
 # ################################################################################################################################
 
     def run(self, default_sleep_time=0.1, _status=PUBSUB.RUN_DELIVERY_STATUS, _notify_methods=_notify_methods):
@@ -367,6 +402,9 @@ class DeliveryTask(object):
         try:
             while self.keep_running:
 
+                # Anything that is added to self.delivery_list from now on will wake us up
+                self.wakeup.clear()
+
                 # We are a task that does not notify endpoints of nothing - they will query us themselves
                 # so in such a case we can sleep for a while and repeat the loop - perhaps in the meantime
                 # someone will change delivery_method to one that allows for notifications to be sent.
@@ -419,8 +457,8 @@ class DeliveryTask(object):
 
                 else:
 
-                    # Wait for our turn
-                    sleep(default_sleep_time)
+                    # Wait for our turn or until there are new messages for us
+                    self.wakeup.wait(self._get_wait_time())
 
 # ################################################################################################################################
 
@@ -436,6 +474,7 @@ class DeliveryTask(object):
         if self.keep_running:
             logger.info('Stopping delivery task for sub_key:`%s`', self.sub_key)
             self.keep_running = False
+            self.wakeup.set()
 
 # ################################################################################################################################
 
@@ -473,8 +512,18 @@ class DeliveryTask(object):
 
 class Message(PubSubMessage):
     """ Wrapper for messages adding __cmp__ which uses a custom comparison protocol,
-    by priority, then ext_pub_time, then pub_time.
+    by priority, then ext_pub_time, then pub_time. The protocol is precomputed into self.sort_key
+    which is what SortedList instances order messages by.
     """
+    # All the attributes that each message has are kept in slots rather than in an instance dict. The dict still exists
+    # because PubSubMessage does not declare __slots__ but it is created only if opaque attributes are set.
+    __slots__ = ('recv_time', 'server_name', 'server_pid', 'topic', 'sub_key', 'pub_msg_id', 'pub_correl_id', 'in_reply_to',
+        'ext_client_id', 'group_id', 'position_in_group', 'pub_time', 'ext_pub_time', 'data', 'data_prefix',
+        'data_prefix_short', 'mime_type', 'priority', 'expiration', 'expiration_time', 'has_gd', 'delivery_status',
+        'pub_pattern_matched', 'sub_pattern_matched', 'size', 'published_by_id', 'topic_id', 'is_in_sub_queue',
+        'topic_name', 'cluster_id', 'delivery_count', 'pub_time_iso', 'ext_pub_time_iso', 'expiration_time_iso',
+        'reply_to_sk', 'deliver_to_sk', 'serialized', GENERIC.ATTR_NAME, 'endp_msg_queue_id', 'sort_key')
+
     def __init__(self):
         super(Message, self).__init__()
         self.sub_key = None
@@ -492,6 +541,8 @@ class Message(PubSubMessage):
         self.expiration = None
         self.expiration_time = None
         self.has_gd = None
+        self.endp_msg_queue_id = None
+        self.sort_key = None
 
         self.pub_time_iso = None
         self.ext_pub_time_iso = None
@@ -499,11 +550,15 @@ class Message(PubSubMessage):
 
 # ################################################################################################################################
 
-    def __cmp__(self, other, max_pri=9):
-        return cmp(
-            (max_pri - self.priority, self.ext_pub_time, self.pub_time),
-            (max_pri - other.priority, other.ext_pub_time, other.pub_time)
-        )
+    def __cmp__(self, other):
+        return cmp(self.sort_key, other.sort_key)
+
+# ################################################################################################################################
+
+    def set_sort_key(self, max_pri=PUBSUB.PRIORITY.MAX):
+        """ Precomputes the key that messages are sorted by - must be called each time priority or publication times change.
+        """
+        self.sort_key = (max_pri - self.priority, self.ext_pub_time, self.pub_time)
 
 # ################################################################################################################################
 
@@ -556,6 +611,7 @@ class GDMessage(Message):
         self.topic_name = topic_name
         self.size = msg.size
         self.sub_pattern_matched = msg.sub_pattern_matched
+        self.set_sort_key()
 
         # Load opaque attributes, if any were provided on input
         opaque = getattr(msg, _gen_attr, None)
@@ -610,6 +666,7 @@ class NonGDMessage(Message):
         # so as not to keep this dictionary's contents for no particular reason. Since there can be only
         # one delivery task for each sub_key, we can .pop rightaway.
         self.sub_pattern_matched = msg['sub_pattern_matched'].pop(self.sub_key)
+        self.set_sort_key()
 
         # Add times in ISO-8601 for external subscribers
         self.add_iso_times()
@@ -776,6 +833,16 @@ class PubSubTool(object):
         for sub_key in sub_keys:
             self.remove_sub_key(sub_key)
 
+# ################################################################################################################################
+
+    def _wake_up_delivery_task(self, sub_key):
+        """ Wakes up a delivery task after new messages were added to its delivery list. Note that the task may not be
+        registered yet if the messages are its initial ones, enqueued by the task itself before it starts to wait for new ones.
+        """
+        delivery_task = self.delivery_tasks.get(sub_key)
+        if delivery_task:
+            delivery_task.wake_up()
+
 # ################################################################################################################################
 
     def _add_non_gd_messages_by_sub_key(self, sub_key, messages):
@@ -784,6 +851,8 @@ class PubSubTool(object):
         for msg in messages:
             self.delivery_lists[sub_key].add(NonGDMessage(sub_key, self.server_name, self.server_pid, msg))
 
+        self._wake_up_delivery_task(sub_key)
+
 # ################################################################################################################################
 
     def add_non_gd_messages_by_sub_key(self, sub_key, messages):
@@ -891,6 +960,9 @@ class PubSubTool(object):
         for sub_key in sub_key_list:
             ignore_list.update([msg.endp_msg_queue_id for msg in self.delivery_lists[sub_key] if msg.has_gd])
 
+            # The same goes for messages already delivered whose confirmations have not been flushed to SQL yet
+            ignore_list.update(self.pubsub.get_pending_confirmations(sub_key))
+
         logger.info('Fetching GD messages by sk_list:`%s`, ignore:`%s`', sub_key_list, ignore_list)
 
         if self.last_gd_run:
@@ -923,6 +995,9 @@ class PubSubTool(object):
             self.delivery_lists[sub_key].add(GDMessage(sub_key, topic_name, msg))
             count += 1
 
+        if count:
+            self._wake_up_delivery_task(sub_key)
+
         logger.info('Pushing %d GD message{}to task:%s msg_ids:%s'.format(
             ' ' if count==1 else 's '), count, sub_key, msg_ids)
 
@@ -995,7 +1070,11 @@ class PubSubTool(object):
 # ################################################################################################################################
 
     def confirm_pubsub_msg_delivered(self, sub_key, delivered_list):
-        self.pubsub.confirm_pubsub_msg_delivered(sub_key, delivered_list)
+        """ Confirms delivery of GD messages from delivered_list - non-GD ones are not in SQL so there is nothing to confirm.
+        """
+        gd_msg_list = [msg for msg in delivered_list if msg.has_gd]
+        if gd_msg_list:
+            self.pubsub.confirm_pubsub_msg_delivered(sub_key, gd_msg_list)
 
 # ################################################################################################################################
 
@@ -1056,3 +1135,65 @@ class PubSubTool(object):
             return self.delivery_tasks[sub_key].get_message(msg_id)
 
 # ################################################################################################################################
+
+def run(messages=100000, batch_size=100):
+    """ Measures how long it takes to build non-GD messages and to add them to a SortedList,
+    then to remove them in batches, as though they were delivered, as well as how much memory each message takes.
+    """
+    # stdlib
+    from gc import get_referents
+    from random import randint
+    from sys import getsizeof
+    from time import time
+
+    sub_key = 'zpsk.bench'
+    now = utcnow_as_ms()
+
+    msg_list = []
+    for idx in xrange(messages):
+        msg_list.append({
+            'pub_msg_id': 'zpsm.{}'.format(idx), 'pub_time': now + idx / 1000.0, 'data': '', 'priority': randint(1, 9),
+            'expiration': 3600, 'expiration_time': now + 3600, 'topic_name': '/bench', 'size': 0, 'published_by_id': 1,
+            'pub_pattern_matched': None, 'reply_to_sk': [], 'deliver_to_sk': [], 'sub_pattern_matched': {sub_key: None},
+        })
+
+    # Keep it quiet, otherwise each message would be logged
+    logger.disabled = True
+
+    try:
+        start = time()
+        msg_list = [NonGDMessage(sub_key, 'bench', 1, msg) for msg in msg_list]
+        build_time = time() - start
+
+        delivery_list = SortedList()
+
+        start = time()
+        for msg in msg_list:
+            delivery_list.add(msg)
+        add_time = time() - start
+
+        start = time()
+        while delivery_list:
+            for msg in delivery_list[:batch_size]:
+                delivery_list.remove_pubsub_msg(msg)
+        remove_time = time() - start
+
+    finally:
+        logger.disabled = False
+
+    # Accessing msg.__dict__ directly would create it so we look it up through the garbage collector instead
+    msg = msg_list[0]
+    msg_size = getsizeof(msg) + sum(getsizeof(elem) for elem in get_referents(msg) if type(elem) is dict)
+
+    print('Messages:', messages)
+    print('Bytes per message: {}'.format(msg_size))
+    print('Build: {:.3f}s ({:.2f} us per message)'.format(build_time, build_time / messages * 1000000))
+    print('Add: {:.3f}s ({:.2f} us per message)'.format(add_time, add_time / messages * 1000000))
+    print('Remove: {:.3f}s ({:.2f} us per message)'.format(remove_time, remove_time / messages * 1000000))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    run()
+
+# ################################################################################################################################
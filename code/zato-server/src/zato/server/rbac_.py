@@ -18,7 +18,7 @@ from rbac.acl import Registry as _Registry
 from gevent.lock import RLock
 
 # Zato
-from zato.common import ZATO_NONE
+from zato.common import MISC, ZATO_NONE
 from zato.common.util import make_repr
 
 # ################################################################################################################################
@@ -88,6 +88,50 @@ class RBAC(object):
         self.client_def_to_role_id = {}
         self.role_id_to_client_def = {}
 
+        # (perm_id, resource) -> [(sec_type, [(sec_name, client_def), ...]), ...], built lazily after each change
+        self.client_def_index = None
+
+        # (client_def, http_verb, resource) -> is_allowed, cleared after each change
+        self.http_decisions = {}
+
+# ################################################################################################################################
+
+    def _on_changed(self):
+        """ Invalidates the client definition index and all the memoized decisions. Must be called with self.update_lock held.
+        """
+        self.client_def_index = None
+        self.http_decisions = {}
+
+    def _build_client_def_index(self, sep=MISC.SEPARATOR):
+        """ Maps each permission and resource to client definitions whose roles are allowed to access the resource
+        with that permission, grouped and sorted by security definition type.
+        """
+        by_sec_type = {}
+
+        for role_id, perm_id, resource in self.registry._allowed.iterkeys():
+            for client_def in self.role_id_to_client_def.get(role_id, ()):
+                _, sec_type, sec_name = client_def.split(sep)
+                by_sec_type.setdefault((perm_id, resource), {}).setdefault(sec_type, set()).add((sec_name, client_def))
+
+        index = {}
+
+        for key, sec_types in by_sec_type.iteritems():
+            index[key] = [(sec_type, sorted(sec_types[sec_type])) for sec_type in sorted(sec_types)]
+
+        return index
+
+    def get_client_defs(self, perm_id, resource):
+        """ Returns client definitions whose roles are explicitly allowed to access a resource with a given permission,
+        as a list of (sec_type, [(sec_name, client_def), ...]) elements sorted by sec_type.
+        """
+        index = self.client_def_index
+
+        if index is None:
+            with self.update_lock:
+                index = self.client_def_index = self._build_client_def_index()
+
+        return index.get((perm_id, resource), [])
+
 # ################################################################################################################################
 
     def __repr__(self):
@@ -97,6 +141,7 @@ class RBAC(object):
 
     def create_permission(self, id, name):
         with self.update_lock:
+            self._on_changed()
             self.permissions[id] = name
 
     def edit_permission(self, id, new_name):
@@ -107,6 +152,7 @@ class RBAC(object):
 
     def delete_permission(self, id):
         with self.update_lock:
+            self._on_changed()
             del self.permissions[id]
             self.registry.delete_from_permissions('operation', id)
 
@@ -127,6 +173,8 @@ class RBAC(object):
                     self.http_permissions[verb] = perm_id
                     break
 
+        self.http_decisions = {}
+
 # ################################################################################################################################
 
     def _rbac_create_role(self, id, name, parent_id):
@@ -143,16 +191,19 @@ class RBAC(object):
 
     def create_role(self, id, name, parent_id):
         with self.update_lock:
+            self._on_changed()
             self._rbac_create_role(id, name, parent_id)
 
     def edit_role(self, id, old_name, name, parent_id):
         with self.update_lock:
+            self._on_changed()
             self._rbac_delete_role(id, old_name)
             self.registry._roles[id].clear() # Roles can have one parent only
             self._rbac_create_role(id, name, parent_id)
 
     def delete_role(self, id, name):
         with self.update_lock:
+            self._on_changed()
             self.registry.delete_role(id)
 
 # ################################################################################################################################
@@ -165,9 +216,11 @@ class RBAC(object):
 
             self.client_def_to_role_id.setdefault(client_def, set()).add(role_id)
             self.role_id_to_client_def.setdefault(role_id, set()).add(client_def)
+            self._on_changed()
 
     def delete_client_role(self, client_def, role_id):
         with self.update_lock:
+            self._on_changed()
             self.client_def_to_role_id[client_def].remove(role_id)
             self.role_id_to_client_def[role_id].remove(client_def)
 
@@ -175,28 +228,34 @@ class RBAC(object):
 
     def create_resource(self, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.add_resource(resource)
 
     def delete_resource(self, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.delete_resource(resource)
 
 # ################################################################################################################################
 
     def create_role_permission_allow(self, role_id, perm_id, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.allow(role_id, perm_id, resource)
 
     def create_role_permission_deny(self, role_id, perm_id, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.deny(role_id, perm_id, resource)
 
     def delete_role_permission_allow(self, role_id, perm_id, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.delete_allow((role_id, perm_id, resource))
 
     def delete_role_permission_deny(self, role_id, perm_id, resource):
         with self.update_lock:
+            self._on_changed()
             self.registry.delete_deny((role_id, perm_id, resource))
 
 # ################################################################################################################################
@@ -214,8 +273,15 @@ class RBAC(object):
         return self.registry.is_any_allowed(roles, perm_id, resource) if roles != ZATO_NONE else False
 
     def is_http_client_allowed(self, client_def, http_verb, resource):
-        """ Same as is_client_allowed but accepts a HTTP verb rather than a permission ID.
+        """ Same as is_client_allowed but accepts a HTTP verb rather than a permission ID. Decisions are memoized
+        until anything in RBAC configuration changes.
         """
-        return self.is_client_allowed(client_def, self.http_permissions[http_verb], resource)
+        key = (client_def, http_verb, resource)
+        is_allowed = self.http_decisions.get(key, ZATO_NONE)
+
+        if is_allowed is ZATO_NONE:
+            is_allowed = self.http_decisions[key] = self.is_client_allowed(client_def, self.http_permissions[http_verb], resource)
+
+        return is_allowed
 
 # ################################################################################################################################
@@ -105,6 +105,39 @@ def call_hook_with_service(hook, service):
 
 # ################################################################################################################################
 
+_service_loggers = {}
+
+def get_service_logger(name, _get_logger=logging.getLogger, _service_loggers=_service_loggers):
+    """ Same as logging.getLogger but does not acquire the logging module's lock each time a service is instantiated.
+    """
+    try:
+        return _service_loggers[name]
+    except KeyError:
+        service_logger = _service_loggers[name] = _get_logger(name)
+        return service_logger
+
+# ################################################################################################################################
+
+class _LazyFacade(object):
+    """ Creates an object on first access to a service's attribute and stores it in the instance under all the names given
+    so that subsequent accesses are regular attribute lookups. Objects never used by a given invocation are never created.
+    """
+    def __init__(self, func, *names):
+        self.func = func
+        self.names = names
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self.func(instance)
+        for name in self.names:
+            instance.__dict__[name] = value
+
+        return value
+
+# ################################################################################################################################
+
 class ChannelInfo(object):
     """ Conveys information abouts the channel that a service is invoked through.
     Available in services as self.channel or self.chan.
@@ -198,6 +231,7 @@ class Service(object):
     _out_plain_http = None
 
     _req_resp_freq = 0
+    _sio_plan = None
     _has_before_job_hooks = None
     _has_after_job_hooks = None
     _before_job_hooks = []
@@ -215,41 +249,44 @@ class Service(object):
     # For invoking other servers directly
     servers = None
 
-    def __init__(self, _get_logger=logging.getLogger, _Bunch=Bunch, _Request=Request, _Response=Response,
-            _DictNav=DictNav, _ListNav=ListNav, _Outgoing=Outgoing, _WMQFacade=WMQFacade, _ZMQFacade=ZMQFacade,
+    # Per-invocation attributes - their defaults are kept here so that each new instance
+    # does not need to assign them all only to overwrite most of them in self.update.
+    server = None
+    broker_client = None
+    channel = None
+    cid = None
+    in_reply_to = None
+    data_format = None
+    transport = None
+    wsgi_environ = None
+    job_type = None
+    invocation_time = None # When was the service invoked
+    handle_return_time = None # When did its 'handle' method finished processing the request
+    processing_time_raw = None # A timedelta object with the processing time up to microseconds
+    processing_time = None # Processing time in milliseconds
+    usage = 0 # How many times the service has been invoked
+    slow_threshold = maxint # After how many ms to consider the response came too late
+    time = None
+    user_config = None
+    dictnav = DictNav
+    listnav = ListNav
+    has_validate_input = False
+    has_validate_output = False
+    cache = None
+
+    def __init__(self, _get_logger=get_service_logger, _Bunch=Bunch, _Request=Request, _Response=Response,
             *ignored_args, **ignored_kwargs):
         self.name = self.__class__.__service_name # Will be set through .get_name by Service Store
         self.impl_name = self.__class__.__service_impl_name # Ditto
         self.logger = _get_logger(self.name)
-        self.server = None
-        self.broker_client = None
-        self.channel = None
-        self.cid = None
-        self.in_reply_to = None
-        self.data_format = None
-        self.transport = None
-        self.wsgi_environ = None
-        self.job_type = None
         self.environ = _Bunch()
         self.request = _Request(self.logger)
         self.response = _Response(self.logger)
-        self.invocation_time = None # When was the service invoked
-        self.handle_return_time = None # When did its 'handle' method finished processing the request
-        self.processing_time_raw = None # A timedelta object with the processing time up to microseconds
-        self.processing_time = None # Processing time in milliseconds
-        self.usage = 0 # How many times the service has been invoked
-        self.slow_threshold = maxint # After how many ms to consider the response came too late
-        self.msg = None
-        self.time = None
-        self.patterns = None
-        self.user_config = None
-        self.dictnav = _DictNav
-        self.listnav = _ListNav
-        self.has_validate_input = False
-        self.has_validate_output = False
-        self.cache = None
-
-        self.out = self.outgoing = _Outgoing(
+
+# ################################################################################################################################
+
+    def _get_outgoing(self, _Outgoing=Outgoing, _WMQFacade=WMQFacade, _ZMQFacade=ZMQFacade, _SMSAPI=SMSAPI):
+        return _Outgoing(
             self.amqp,
             self._out_ftp,
             _WMQFacade(self) if self.component_enabled_ibm_mq else None,
@@ -258,13 +295,29 @@ class Service(object):
             self._worker_config.out_soap,
             self._worker_store.sql_pool_store,
             self._worker_store.stomp_outconn_api,
-            ZMQFacade(self.server) if self.component_enabled_zeromq else None,
+            _ZMQFacade(self.server) if self.component_enabled_zeromq else None,
             self._worker_store.outconn_wsx,
             self._worker_store.vault_conn_api,
-            SMSAPI(self._worker_store.sms_twilio_api) if self.component_enabled_sms else None,
+            _SMSAPI(self._worker_store.sms_twilio_api) if self.component_enabled_sms else None,
             self._worker_config.out_sap,
         )
 
+    def _get_msg(self, _MessageFacade=MessageFacade):
+        if self.component_enabled_msg_path:
+            return _MessageFacade(self._json_pointer_store, self._xpath_store, self._msg_ns_store, self.request.payload,
+                self.time)
+
+    def _get_patterns(self, _PatternsFacade=PatternsFacade):
+        if self.component_enabled_patterns:
+            return _PatternsFacade(self)
+
+    # Facades are created only if a service actually uses them
+    out = outgoing = _LazyFacade(_get_outgoing, 'out', 'outgoing')
+    msg = _LazyFacade(_get_msg, 'msg')
+    patterns = _LazyFacade(_get_patterns, 'patterns')
+
+# ################################################################################################################################
+
     @staticmethod
     def get_name_static(class_):
         return Service.get_name(class_)
@@ -338,12 +391,6 @@ class Service(object):
         if self.component_enabled_search:
             if not Service.search:
                 Service.search = SearchAPI(self._worker_store.search_es_api, self._worker_store.search_solr_api)
-        if self.component_enabled_msg_path:
-            self.msg = MessageFacade(
-                self._json_pointer_store, self._xpath_store, self._msg_ns_store, self.request.payload, self.time)
-
-        if self.component_enabled_patterns:
-            self.patterns = PatternsFacade(self)
 
         if may_have_wsgi_environ:
             self.request.http.init(self.wsgi_environ)
@@ -351,8 +398,8 @@ class Service(object):
         # self.is_sio attribute is set by ServiceStore during deployment
         if self.has_sio:
             self.request.init(True, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ,
-                self.server.encrypt)
-            self.response.init(self.cid, self.SimpleIO, self.data_format)
+                self.server.encrypt, self._sio_plan)
+            self.response.init(self.cid, self.SimpleIO, self.data_format, self._sio_plan)
 
         # Cache is always enabled
         self.cache = self._worker_store.cache_api
@@ -454,7 +501,7 @@ class Service(object):
             try:
 
                 if service.server.component_enabled.stats:
-                    service.usage = service.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, service.name))
+                    service.usage = service._worker_store.stats_aggregator.incr_usage(service.name)
                 service.invocation_time = _utcnow()
 
                 # All hooks are optional so we check if they have not been replaced with None by ServiceStore.
@@ -667,8 +714,7 @@ class Service(object):
         return cid
 
     def post_handle(self, _get_response_value=get_response_value, _utcnow=datetime.utcnow,
-        _service_time_basic=KVDB.SERVICE_TIME_BASIC, _service_time_raw=KVDB.SERVICE_TIME_RAW,
-        _service_time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE):
+        _req_resp_sample=KVDB.REQ_RESP_SAMPLE):
         """ An internal method executed after the service has completed and has
         a response ready to return. Updates its statistics and, optionally, stores
         a sample request/response pair.
@@ -688,21 +734,8 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
-
-                pipe.hset('%s%s' % (_service_time_basic, self.name), 'last', self.processing_time)
-                pipe.rpush('%s%s' % (_service_time_raw, self.name), self.processing_time)
-
-                key = '%s%s:%s' % (_service_time_raw_by_minute,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
-
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
-
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
-                pipe.execute()
+            # Statistics are written to KVDB in background, in bulk for all services invoked in this process
+            self._worker_store.stats_aggregator.add_time(self.name, self.processing_time, self.handle_return_time)
 
         #
         # Sample requests/responses
@@ -727,7 +760,7 @@ class Service(object):
                 'req': req,
                 'resp':_get_response_value(self.response), # TODO: Don't parse it here and a moment later below
             }
-            self.kvdb.conn.hmset(key, data)
+            self.kvdb.conn.hmset('%s%s' % (_req_resp_sample, self.name), data)
 
         #
         # Slow responses
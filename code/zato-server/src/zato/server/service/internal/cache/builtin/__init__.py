@@ -16,6 +16,7 @@ from zato.common import CACHE as _COMMON_CACHE
 from zato.common.broker_message import CACHE
 from zato.common.odb.model import CacheBuiltin
 from zato.common.odb.query import cache_builtin_list
+from zato.common.util.sql import ElemsWithOpaqueMaker
 from zato.server.service import Bool, Int
 from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.internal.cache import common_instance_hook
@@ -28,7 +29,10 @@ get_list_docs = 'built-in cache definitions'
 broker_message = CACHE
 broker_message_prefix = 'BUILTIN_'
 list_func = cache_builtin_list
-output_optional_extra = ['current_size', 'cache_id']
+input_optional_extra = [Int('delete_expired_interval'), Bool('needs_key_index'), Int('sync_batch_max_size'),
+    Int('sync_batch_max_wait'), Int('max_size_bytes')]
+output_optional_extra = ['current_size', Int('current_size_bytes'), 'cache_id', Int('delete_expired_interval'),
+    Bool('needs_key_index'), Int('sync_batch_max_size'), Int('sync_batch_max_wait'), Int('max_size_bytes')]
 
 # ################################################################################################################################
 
@@ -44,6 +48,7 @@ def response_hook(self, input, _ignored, attrs, service_type):
     elif service_type == 'get_list':
         for item in self.response.payload:
             item.current_size = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, item.name)
+            item.current_size_bytes = self.cache.get_size_bytes(_COMMON_CACHE.TYPE.BUILTIN, item.name)
 
 # ################################################################################################################################
 
@@ -60,11 +65,17 @@ class Get(AdminService):
         input_required = ('cluster_id', 'cache_id')
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
-            Int('current_size'))
+            Int('current_size'), Int('current_size_bytes'))
+        output_optional = (Int('delete_expired_interval'), Bool('needs_key_index'), Int('sync_batch_max_size'),
+            Int('sync_batch_max_wait'), Int('max_size_bytes'))
 
     def handle(self):
         response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
         response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        response['current_size_bytes'] = self.cache.get_size_bytes(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+
+        # Opaque attributes, such as delete_expired_interval or needs_key_index, are returned on the same level as regular ones
+        ElemsWithOpaqueMaker.process_config_dict(response)
 
         self.response.payload = response
 
@@ -24,10 +24,7 @@ from gevent import spawn
 # Zato
 from zato.common import DATA_FORMAT, PUBSUB, ZATO_NONE
 from zato.common.exception import Forbidden, NotFound, ServiceUnavailable
-from zato.common.odb.query.pubsub.cleanup import delete_enq_delivered, delete_enq_marked_deleted, delete_msg_delivered, \
-     delete_msg_expired
 from zato.common.odb.query.pubsub.publish import sql_publish_with_retry
-from zato.common.odb.query.pubsub.topic import get_gd_depth_topic
 from zato.common.pubsub import PubSubMessage
 from zato.common.pubsub import new_msg_id
 from zato.common.util.sql import set_instance_opaque_attrs
@@ -383,11 +380,22 @@ class Publish(AdminService):
 
 # ################################################################################################################################
 
-    def _cleanup_sql_data(self, session, cluster_id, topic_id, now):
-        delete_msg_delivered(session, cluster_id, topic_id)
-        delete_msg_expired(session, cluster_id, topic_id, now)
-        delete_enq_delivered(session, cluster_id, topic_id)
-        delete_enq_marked_deleted(session, cluster_id, topic_id)
+    def _sql_publish(self, ctx):
+        # Type: PubCtx
+        """ Publishes GD messages from a single publication in an SQL transaction of their own.
+        """
+        with closing(self.odb.session()) as session:
+
+            logger_pubsub.info('Inserting GD messages for topic `%s` `%s` published by `%s` (ext:%s) (cid:%s)',
+                ctx.topic.name, [elem['pub_msg_id'] for elem in ctx.gd_msg_list], ctx.endpoint_name,
+                ctx.ext_client_id, self.cid)
+
+            # This is the call that runs SQL INSERT statements with messages for topics and subscriber queues
+            sql_publish_with_retry(session, self.cid, ctx.cluster_id, ctx.topic.id, ctx.subscriptions_by_topic,
+                ctx.gd_msg_list, ctx.now)
+
+            # Run an SQL commit for all queries above ..
+            session.commit()
 
 # ################################################################################################################################
 
@@ -427,36 +435,22 @@ class Publish(AdminService):
         # We don't always have GD messages on input so there is no point in running an SQL transaction otherwise.
         if has_gd_msg_list:
 
-            with closing(self.odb.session()) as session:
-
-                # No matter if we can publish or not, we may possibly cleanup old messages first.
-                if ctx.topic.needs_msg_cleanup():
-                    self._cleanup_sql_data(session, ctx.cluster_id, ctx.topic.id, ctx.now)
+            # Abort if max depth would be exceeded - the topic's depth is kept in RAM and refreshed in background
+            # so that publications do not need to query SQL for it.
+            if ctx.topic.gd_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
+                self.reject_publication(ctx.topic.name, True)
 
-                # .. test first if we should check the depth in this iteration.
-                if ctx.topic.needs_depth_check():
+            # Messages may be committed to SQL along with other publications to the same topic ..
+            if ctx.pubsub.gd_pub_batcher:
+                ctx.pubsub.gd_pub_batcher.publish(self.cid, ctx)
 
-                    # Get current depth of this topic ..
-                    ctx.current_depth = get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id)
-
-                    # .. and abort if max depth is already reached.
-                    if ctx.current_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
-                        self.reject_publication(ctx.topic.name, True)
-                    else:
-
-                        # This only updates the local ctx variable
-                        ctx.current_depth = ctx.current_depth + len_gd_msg_list
-
-                logger_pubsub.info('Inserting GD messages for topic `%s` `%s` published by `%s` (ext:%s) (cid:%s)',
-                    ctx.topic.name, [elem['pub_msg_id'] for elem in ctx.gd_msg_list], ctx.endpoint_name,
-                    ctx.ext_client_id, self.cid)
-
-                # This is the call that runs SQL INSERT statements with messages for topics and subscriber queues
-                sql_publish_with_retry(session, self.cid, ctx.cluster_id, ctx.topic.id, ctx.subscriptions_by_topic,
-                    ctx.gd_msg_list, ctx.now)
+            # .. or in a transaction of their own.
+            else:
+                self._sql_publish(ctx)
 
-                # Run an SQL commit for all queries above ..
-                session.commit()
+            # Messages are in SQL now so the depth can be updated ..
+            ctx.pubsub.incr_gd_depth(ctx.topic, ctx.subscriptions_by_topic, len_gd_msg_list)
+            ctx.current_depth = ctx.topic.gd_depth
 
             # .. and set a flag to signal that there are some GD messages available
             ctx.pubsub.set_sync_has_msg(ctx.topic.id, True, True, ctx.now)
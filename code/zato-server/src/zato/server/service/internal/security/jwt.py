@@ -23,7 +23,6 @@ from zato.common.broker_message import SECURITY
 from zato.common.odb.model import Cluster, JWT
 from zato.common.odb.query import jwt_list
 from zato.server.connection.http_soap import Unauthorized
-from zato.server.jwt import JWT as JWTBackend
 from zato.server.service import Integer, Service
 from zato.server.service.internal import AdminService, AdminSIO, ChangePasswordBase, GetListAdminSIO
 
@@ -207,7 +206,7 @@ class LogIn(Service):
         output_optional = ('token',)
 
     def handle(self):
-        token = JWTBackend(self.kvdb, self.odb, self.server.fs_server_config.misc.jwt_secret).authenticate(
+        token = self.server.worker_store.request_dispatcher.url_data.jwt.authenticate(
             self.request.input.username, self.request.input.password)
 
         if token:
@@ -234,7 +233,7 @@ class LogOut(AdminService):
             self.response.payload.result = 'No JWT found'
 
         try:
-            JWTBackend(self.kvdb, self.odb, self.server.fs_server_config.misc.jwt_secret).delete(token)
+            self.server.worker_store.request_dispatcher.url_data.jwt.delete(token)
         except Exception, e:
             self.logger.warn(format_exc(e))
             self.response.status_code = BAD_REQUEST
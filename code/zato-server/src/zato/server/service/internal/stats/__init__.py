@@ -34,6 +34,7 @@ from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import parse_raw_time_elem, score_at_percentile, trimmed_mean
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
@@ -66,11 +67,12 @@ class BaseAggregatingService(AdminService):
     def stats_enabled(self):
         return self.server.component_enabled.stats
 
-    def aggregate_raw_times(self, key, service_name, max_batch_size=None):
+    def aggregate_raw_times(self, key, service_name, max_batch_size=None, _parse_raw_time_elem=parse_raw_time_elem):
         """ Aggregates values from a list living under a given key. Returns its
-        min, max, mean and an overall usage count. 'max_batch_size' controls how
-        many items will be fetched from the list so it's possible to fetch less
-        items than its LLEN returns.
+        min, max, mean, an overall usage count and how many list items were processed.
+        'max_batch_size' controls how many items will be fetched from the list
+        so it's possible to fetch less items than its LLEN returns. Each item is either
+        a single processing time or a time:count pair, as written by ServiceStatsAggregator.
         """
         key_len = self.server.kvdb.conn.llen(key)
         if max_batch_size:
@@ -82,15 +84,17 @@ class BaseAggregatingService(AdminService):
         else:
             batch_size = key_len
 
-        times = [int(elem) for elem in self.server.kvdb.conn.lrange(key, 0, batch_size)]
+        elems = self.server.kvdb.conn.lrange(key, 0, batch_size)
 
-        if times:
+        if elems:
+            times = sorted(_parse_raw_time_elem(elem) for elem in elems)
             mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
-            max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
+            max_score = int(score_at_percentile(times, mean_percentile))
+            usage = sum(count for _, count in times)
 
-            return min(times), max(times), (sp_stats.tmean(times, (None, max_score)) or 0), len(times)
+            return times[0][0], times[-1][0], (trimmed_mean(times, max_score) or 0), usage, len(elems)
         else:
-            return 0, 0, 0, 0
+            return 0, 0, 0, 0, 0
 
     def collect_service_stats(self, keys_pattern, key_prefix, key_suffix, total_seconds,
                               suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
@@ -211,7 +215,7 @@ class ProcessRawTimes(BaseAggregatingService):
             current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
             current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
+            batch_min, batch_max, batch_mean, _, batch_total = self.aggregate_raw_times(
                 key, service_name, config.max_batch_size)
 
             self.server.kvdb.conn.hset(
@@ -248,7 +252,7 @@ class AggregateByMinute(BaseAggregatingService):
             service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            batch_min, batch_max, batch_mean, batch_total, _ = self.aggregate_raw_times(key, service_name)
 
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
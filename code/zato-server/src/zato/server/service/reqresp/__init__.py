@@ -12,8 +12,11 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 from copy import deepcopy
 from httplib import OK
-from itertools import chain
+from itertools import chain, izip
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter, itemgetter
 from traceback import format_exc
+from types import NoneType
 
 # anyjson
 from anyjson import dumps, loads
@@ -30,11 +33,11 @@ from lxml.objectify import deannotate, Element, ElementMaker, ObjectifiedElement
 from sqlalchemy.util import KeyedTuple
 
 # Zato
-from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, TRACE1, ZatoException, \
-     ZATO_OK
+from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, ZatoException, ZATO_OK
 from zato.common.odb.api import WritableKeyedTuple
 from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.server.service.reqresp.sio import convert_param, convert_param_plan, convert_sio_plan, ServiceInput, SIOConverter, \
+     SIOParamPlan
 
 logger = logging.getLogger(__name__)
 
@@ -42,11 +45,23 @@ NOT_GIVEN = 'ZATO_NOT_GIVEN'
 
 direct_payload = simple_types + (EtreeElement, ObjectifiedElement)
 
+# How to serialize to JSON values of the most common types, by their exact type - anything else is given to dumps as is
+json_encoders = {
+    unicode: encode_basestring_ascii,
+    str: encode_basestring_ascii,
+    int: str,
+    long: str,
+    bool: lambda value: b'true' if value else b'false',
+    NoneType: lambda value: b'null',
+}
+
 # ################################################################################################################################
 
 class HTTPRequestData(object):
     """ Data regarding an HTTP request.
     """
+    __slots__ = ('method', 'GET', 'POST', 'path', 'params')
+
     def __init__(self, _Bunch=Bunch):
         self.method = None
         self.GET = _Bunch()
@@ -129,13 +144,19 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func):
+    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func, sio_plan=None):
         """ Initializes the object with an invocation-specific data.
         """
         self.input = ServiceInput()
         self.encrypt_func = encrypt_func
 
         if is_sio:
+
+            # Use the plan compiled when the service was deployed, unless it was compiled for other input
+            if sio_plan and sio_plan.is_valid_for(sio, self.simple_io_config):
+                self.init_flat_sio_plan(cid, sio_plan, data_format, transport, wsgi_environ)
+                return
+
             required_list = getattr(sio, 'input_required', [])
             required_list = [required_list] if isinstance(required_list, basestring) else required_list
             self.init_flat_sio(cid, sio, data_format, transport, wsgi_environ, required_list)
@@ -198,6 +219,63 @@ class Request(SIOConverter):
             if param not in self.input:
                 self.input[param] = value
 
+# ################################################################################################################################
+
+    def init_flat_sio_plan(self, cid, sio_plan, data_format, transport, wsgi_environ):
+        """ Same as init_flat_sio but uses a SimpleIO definition compiled upfront.
+        """
+        self.is_xml = data_format == SIMPLE_IO.FORMAT.XML
+        self.data_format = data_format
+        self.transport = transport
+        self._wsgi_environ = wsgi_environ
+        self.encrypt_secrets = sio_plan.encrypt_secrets
+
+        if sio_plan.has_simple_io_config:
+            self.has_simple_io_config = True
+            self.bool_parameter_prefixes = sio_plan.bool_parameter_prefixes
+            self.int_parameters = sio_plan.int_parameters
+            self.int_parameter_suffixes = sio_plan.int_parameter_suffixes
+        else:
+            self.payload = self.raw_request
+
+        if sio_plan.input_required:
+
+            # Needs to check for this exact default value to prevent a FutureWarning in 'if not self.payload'
+            if self.payload == '' and not self.channel_params:
+                raise ZatoException(cid, 'Missing input')
+
+            self.input.update(self.get_params_plan(sio_plan, sio_plan.input_required))
+
+        if sio_plan.input_optional:
+            self.input.update(self.get_params_plan(sio_plan, sio_plan.input_optional))
+
+        for param, value in self.channel_params.iteritems():
+            if param not in self.input:
+                self.input[param] = value
+
+# ################################################################################################################################
+
+    def get_params_plan(self, sio_plan, params_to_visit, _convert_param_plan=convert_param_plan):
+        """ Same as get_params but for parameters of a compiled SimpleIO definition.
+        """
+        params = {}
+        payload = '' if sio_plan.use_channel_params_only else self.payload
+
+        for item in params_to_visit:
+            try:
+                params[item.name] = _convert_param_plan(
+                    self.cid, payload, item, self.data_format, sio_plan.default_value, sio_plan.path_prefix,
+                    sio_plan.use_text, self.channel_params, self.has_simple_io_config, True, self.encrypt_func,
+                    self.encrypt_secrets, self.params_priority)
+
+            except Exception, e:
+                msg = 'Caught an exception, param:`{}`, params_to_visit:`{}`, has_simple_io_config:`{}`, e:`{}`'.format(
+                    item.param, [elem.param for elem in params_to_visit], self.has_simple_io_config, format_exc(e))
+                self.logger.error(msg)
+                raise ParsingException(msg)
+
+        return params
+
 # ################################################################################################################################
 
     def get_params(self, params_to_visit, use_channel_params_only, path_prefix='', default_value=NO_DEFAULT_VALUE,
@@ -259,7 +337,7 @@ class SimpleIOPayload(SIOConverter):
     All of the attributes are prefixed with zato_ so that they don't conflict with non-Zato data..
     """
     def __init__(self, zato_cid, data_format, required_list, optional_list, simple_io_config, response_elem, namespace,
-            output_repeated, skip_empty, ignore_skip_empty, allow_empty_required, _sio_container=(tuple, list)):
+            output_repeated, skip_empty, ignore_skip_empty, allow_empty_required, sio_plan=None, _sio_container=(tuple, list)):
         self.zato_cid = zato_cid
         self.zato_data_format = data_format
         self.zato_is_xml = self.zato_data_format == SIMPLE_IO.FORMAT.XML
@@ -283,13 +361,19 @@ class SimpleIOPayload(SIOConverter):
         self.response_elem = response_elem
         self.namespace = namespace
 
-        self.zato_all_attrs = set()
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
-            self.zato_all_attrs.add(name)
+        # Output parameters were compiled when the service was deployed ..
+        if sio_plan:
+            self.zato_output_params = sio_plan.output_list
+            self.zato_all_attrs = sio_plan.output_names
 
-        self.set_expected_attrs(required_list, optional_list)
+        # .. or we need to establish their data types ourselves.
+        else:
+            self.zato_output_params = tuple(SIOParamPlan(param, is_required, '', self.bool_parameter_prefixes,
+                self.int_parameters, self.int_parameter_suffixes) for is_required, param in chain(
+                    self.zato_required, self.zato_optional))
+            self.zato_all_attrs = frozenset(item.name for item in self.zato_output_params)
+
+        self.set_expected_attrs()
 
     def __setslice__(self, i, j, seq):
         """ Assigns a list of output elements to self.zato_output, so that they
@@ -308,13 +392,11 @@ class SimpleIOPayload(SIOConverter):
     def _is_sqlalchemy(self, item):
         return hasattr(item, '_sa_class_manager')
 
-    def set_expected_attrs(self, required_list, optional_list):
+    def set_expected_attrs(self):
         """ Dynamically assigns all the expected attributes to self. Setting a value
         of an attribute will actually add data to self.zato_output.
         """
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
+        for name in self.zato_all_attrs:
             setattr(self, name, '')
 
     def set_payload_attrs(self, attrs, _keyed=(dict, WritableKeyedTuple, KeyedTuple)):
@@ -340,31 +422,28 @@ class SimpleIOPayload(SIOConverter):
         self.zato_output.append(item)
         self.zato_output_repeated = True
 
-    def _getvalue(self, name, item, is_sa_namedtuple, is_required, leave_as_is, _DEBUG=logging.DEBUG, _TRACE1=TRACE1):
+    def _getvalue(self, param, item, is_sa_namedtuple, _convert_sio_plan=convert_sio_plan):
         """ Returns an element's value if any has been provided while taking
         into account the differences between dictionaries and other formats
         as well as the type conversions.
         """
-        lookup_name = name.name if isinstance(name, ForceType) else name
-
         if is_sa_namedtuple or self._is_sqlalchemy(item):
-            elem_value = getattr(item, lookup_name, '')
+            elem_value = getattr(item, param.name, '')
         else:
-            elem_value = item.get(lookup_name, '')
+            elem_value = item.get(param.name, '')
 
         if isinstance(elem_value, basestring) and not elem_value:
             if elem_value == '' and self.zato_allow_empty_required:
                 return ''
-            msg = self._missing_value_log_msg(name, item, is_sa_namedtuple, is_required)
-            if is_required:
-                raise ZatoException(self.zato_cid, msg)
+            if param.is_required:
+                raise ZatoException(self.zato_cid, self._missing_value_log_msg(
+                    param.param, item, is_sa_namedtuple, param.is_required))
 
-        if leave_as_is:
+        if param.is_as_is:
             return elem_value
         else:
-            return self.convert(self.zato_cid, name, lookup_name, elem_value, True, self.zato_is_xml,
-                self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes, self.zato_skip_empty_keys,
-                None, None, None, self.zato_data_format, True)
+            return _convert_sio_plan(self.zato_cid, param, elem_value, True, self.zato_skip_empty_keys, None, None,
+                self.zato_data_format, True)
 
     def _missing_value_log_msg(self, name, item, is_sa_namedtuple, is_required):
         """ Returns a log message indicating that an element was missing.
@@ -376,6 +455,99 @@ class SimpleIOPayload(SIOConverter):
         return '{} elem:`{}` not found in item:`{!r}`'.format(
             'Expected' if is_required else 'Optional', name, msg_item)
 
+    def _get_row_values(self, output, _keyed_tuple=(WritableKeyedTuple, KeyedTuple)):
+        """ Yields each element of output along with values of all of its output parameters, in the same order as parameters.
+        """
+        names = [param.name for param in self.zato_output_params]
+        has_one_name = len(names) == 1
+
+        get_attrs = attrgetter(*names)
+        get_items = itemgetter(*names)
+
+        # All elements must be of the same type so it's OK to do it
+        is_sa_namedtuple = isinstance(output[0], _keyed_tuple) if output else False
+
+        for item in output:
+
+            # Optional parameters may be missing in which case their values are empty strings
+            if is_sa_namedtuple or self._is_sqlalchemy(item):
+                try:
+                    values = get_attrs(item)
+                except AttributeError:
+                    values = [getattr(item, name, '') for name in names]
+                    has_all = False
+                else:
+                    has_all = True
+            else:
+                try:
+                    values = get_items(item)
+                except KeyError:
+                    values = [item.get(name, '') for name in names]
+                    has_all = False
+                else:
+                    has_all = True
+
+            yield item, is_sa_namedtuple, (values,) if (has_one_name and has_all) else values
+
+# ################################################################################################################################
+
+    def _get_json_list(self, output, _encoders=json_encoders, _dumps=dumps, _basestring=basestring,
+        _convert_sio_plan=convert_sio_plan):
+        """ Serializes a list of output elements to JSON without building intermediate dicts for each element.
+        """
+        cid = self.zato_cid
+        data_format = self.zato_data_format
+        skip_empty_keys = self.zato_skip_empty_keys
+        allow_empty_required = self.zato_allow_empty_required
+
+        # Everything about output parameters that does not depend on any particular element
+        fields = []
+        for param in self.zato_output_params:
+            needs_convert = (param.is_bool or param.is_force_type or param.is_int) and not param.is_as_is
+            may_skip = skip_empty_keys and param.name not in self.zato_force_empty_keys
+            fields.append((param, b'{}: '.format(encode_basestring_ascii(param.name)), needs_convert, may_skip))
+
+        out = []
+
+        for item, is_sa_namedtuple, values in self._get_row_values(output):
+            elems = []
+
+            for (param, key, needs_convert, may_skip), value in izip(fields, values):
+
+                if isinstance(value, _basestring) and not value:
+                    if value == '' and allow_empty_required:
+                        pass
+                    else:
+                        if param.is_required:
+                            raise ZatoException(cid, self._missing_value_log_msg(param.param, item, is_sa_namedtuple, True))
+                        if needs_convert:
+                            value = _convert_sio_plan(cid, param, value, True, skip_empty_keys, None, None, data_format, True)
+
+                elif needs_convert:
+                    value = _convert_sio_plan(cid, param, value, True, skip_empty_keys, None, None, data_format, True)
+
+                if not value and value != 0:
+                    if may_skip:
+                        continue
+
+                encoder = _encoders.get(value.__class__)
+                elems.append(key + (encoder(value) if encoder else _dumps(value)))
+
+            out.append(b'{' + b', '.join(elems) + b'}')
+
+        value = b'[' + b', '.join(out) + b']'
+
+        if self.response_elem is not None:
+            top = [encode_basestring_ascii(self.response_elem), b': ', value]
+            search = self.zato_meta.get('search')
+            if search:
+                top.extend((b', "_meta": ', _dumps(search)))
+            return b'{' + b''.join(top) + b'}'
+
+        return value
+
+# ################################################################################################################################
+
     def getvalue(self, serialize=True, _keyed_tuple=(WritableKeyedTuple, KeyedTuple)):
         """ Gets the actual payload's value converted to a string representing either XML or JSON.
         """
@@ -392,9 +564,13 @@ class SimpleIOPayload(SIOConverter):
 
         if self.zato_output_repeated:
             output = self.zato_output
+
+            # Lists of elements are serialized to JSON directly
+            if serialize and not self.zato_is_xml:
+                return self._get_json_list(output)
+
         else:
-            output = set(dir(self)) & self.zato_all_attrs
-            output = [dict((name, getattr(self, name)) for name in output)]
+            output = [dict((name, getattr(self, name)) for name in self.zato_all_attrs if hasattr(self, name))]
 
         if output:
 
@@ -407,18 +583,15 @@ class SimpleIOPayload(SIOConverter):
                     out_item = Element('item')
                 else:
                     out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
+                for param in self.zato_output_params:
+                    name = param.name
+                    elem_value = self._getvalue(param, item, is_sa_namedtuple)
 
                     if not elem_value and elem_value != 0:
                         if self.zato_skip_empty_keys:
                             if name not in self.zato_force_empty_keys:
                                 continue
 
-                    if isinstance(name, ForceType):
-                        name = name.name
-
                     if isinstance(elem_value, basestring):
                         elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
 
@@ -560,9 +733,20 @@ class Response(object):
 
     payload = property(_get_payload, _set_payload)
 
-    def init(self, cid, io, data_format, _not_given=NOT_GIVEN):
+    def init(self, cid, io, data_format, sio_plan=None, _not_given=NOT_GIVEN):
         self.data_format = data_format
 
+        # Use the plan compiled when the service was deployed, unless it was compiled for other output
+        if sio_plan and sio_plan.is_valid_for(io, self.simple_io_config):
+            self.outgoing_declared = True if sio_plan.output_list else False
+
+            if self.outgoing_declared:
+                self._payload = SimpleIOPayload(cid, data_format, [item.param for item in sio_plan.output_required],
+                    [item.param for item in sio_plan.output_optional], self.simple_io_config, sio_plan.response_elem,
+                    sio_plan.namespace, sio_plan.output_repeated, sio_plan.skip_empty_keys, sio_plan.force_empty_keys,
+                    sio_plan.allow_empty_required, sio_plan)
+            return
+
         required_list = getattr(io, 'output_required', [])
         required_list = [required_list] if isinstance(required_list, basestring) else required_list
 
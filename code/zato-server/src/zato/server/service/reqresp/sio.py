@@ -582,6 +582,203 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
 # ################################################################################################################################
 
+class SIOParamPlan(object):
+    """ Everything about a single SimpleIO parameter that can be established once, at deployment time,
+    rather than each time a request or response is converted.
+    """
+    __slots__ = ('param', 'name', 'is_required', 'is_force_type', 'is_complex', 'is_as_is', 'is_opaque', 'is_bool', 'is_int',
+        'is_secret', 'input_default', 'output_default')
+
+    def __init__(self, param, is_required, default_value, bool_parameter_prefixes, int_parameters, int_parameter_suffixes):
+        self.param = param
+        self.name = param.name if isinstance(param, ForceType) else param
+        self.is_required = is_required
+        self.is_force_type = isinstance(param, ForceType)
+        self.is_complex = isinstance(param, COMPLEX_VALUE)
+        self.is_as_is = isinstance(param, AsIs)
+        self.is_opaque = isinstance(param, (AsIs, Opaque))
+        self.is_bool = is_bool(param, self.name, bool_parameter_prefixes)
+        self.is_int = bool(is_int(self.name, int_parameters, int_parameter_suffixes))
+        self.is_secret = is_secret(self.name)
+
+        # Used if an optional input parameter is not given on input
+        self.input_default = resolve_default_value(param, default_value)
+
+        # Used if a value is an empty string and empty keys are not forced on output
+        self.output_default = resolve_default_value(param, '')
+
+    def __repr__(self):
+        return '<{} at {} name:`{}`, is_required:`{}`>'.format(self.__class__.__name__, hex(id(self)), self.name,
+            self.is_required)
+
+# ################################################################################################################################
+
+class SIOPlan(object):
+    """ A SimpleIO definition compiled for a given SimpleIO configuration. Built by ServiceStore when a service is deployed,
+    it lets requests and responses iterate over ready plans of parameters instead of re-establishing, for each parameter
+    and each invocation, what data type it is of or how to find its default value.
+    """
+    __slots__ = ('sio', 'simple_io_config', 'has_simple_io_config', 'bool_parameter_prefixes', 'int_parameters',
+        'int_parameter_suffixes', 'input_required', 'input_optional', 'output_required', 'output_optional', 'output_list',
+        'output_names', 'path_prefix', 'default_value', 'use_text', 'use_channel_params_only', 'encrypt_secrets',
+        'response_elem', 'namespace', 'output_repeated', 'skip_empty_keys', 'force_empty_keys', 'allow_empty_required')
+
+    def __init__(self, sio, simple_io_config, _not_given=NOT_GIVEN):
+        self.sio = sio
+        self.simple_io_config = simple_io_config
+        self.has_simple_io_config = bool(simple_io_config)
+
+        simple_io_config = simple_io_config or {}
+        self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
+        self.int_parameters = simple_io_config.get('int_parameters', [])
+        self.int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', [])
+
+        # Input
+        self.path_prefix = getattr(sio, 'request_elem', 'request')
+        self.default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
+        self.use_text = getattr(sio, 'use_text', True)
+        self.use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
+        self.encrypt_secrets = getattr(sio, 'encrypt_secrets', True)
+
+        self.input_required = self._get_params(sio, 'input_required', True, self.default_value)
+        self.input_optional = self._get_params(sio, 'input_optional', False, self.default_value)
+
+        # Output
+        response_elem = getattr(sio, 'response_elem', _not_given)
+        self.response_elem = response_elem if response_elem != _not_given else 'response'
+        self.namespace = getattr(sio, 'namespace', '')
+        self.output_repeated = getattr(sio, 'output_repeated', False)
+        self.skip_empty_keys = getattr(sio, 'skip_empty_keys', False)
+        self.force_empty_keys = getattr(sio, 'force_empty_keys', [])
+        self.allow_empty_required = getattr(sio, 'allow_empty_required', False)
+
+        self.output_required = self._get_params(sio, 'output_required', True, '')
+        self.output_optional = self._get_params(sio, 'output_optional', False, '')
+
+        # All output parameters, in the order they are serialized in, and their names
+        self.output_list = self.output_required + self.output_optional
+        self.output_names = frozenset(item.name for item in self.output_list)
+
+    def _get_params(self, sio, attr_name, is_required, default_value, _sio_container=(tuple, list)):
+        params = getattr(sio, attr_name, None) or []
+        params = params if isinstance(params, _sio_container) else [params]
+
+        return tuple(SIOParamPlan(param, is_required, default_value, self.bool_parameter_prefixes, self.int_parameters,
+            self.int_parameter_suffixes) for param in params)
+
+    def is_valid_for(self, sio, simple_io_config):
+        """ Returns True if the plan can be used for a given SimpleIO definition and configuration, e.g. it cannot be
+        if the definition was inherited from a base class compiled for another service or if a configuration
+        other than the server-wide one is in use.
+        """
+        return self.sio is sio and self.simple_io_config is simple_io_config
+
+# ################################################################################################################################
+
+def convert_sio_plan(cid, item, value, has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets,
+    data_format=ZATO_NONE, from_sio_to_external=False, special_values=(str(ZATO_NONE), str(ZATO_SEC_USE_RBAC))):
+    """ Same as convert_sio but uses a SIOParamPlan instead of looking up data types of parameters.
+    """
+    try:
+
+        if item.is_bool:
+            if value == '':
+                value = None if force_empty_keys else item.output_default
+            else:
+                value = asbool(value or None) # value can be an empty string and asbool chokes on that
+            return value
+
+        if value is not None:
+            if item.is_force_type:
+                if value == '':
+                    value = None if force_empty_keys else item.output_default
+                else:
+                    value = item.param.convert(value, item.name, data_format, from_sio_to_external)
+            else:
+                # Empty string sent in lieu of integers are equivalent to None,
+                # as though they were never sent - this is needed for internal metaclasses
+                if value == b'':
+                    if item.is_int:
+                        value = None
+
+                if value:
+                    if (value not in special_values) and has_simple_io_config:
+                        if item.is_int:
+                            value = int(value)
+                        elif encrypt_secrets and item.is_secret:
+                            # It will be None in SIO responses
+                            if encrypt_func:
+                                value = encrypt_func(value)
+
+        return value
+
+    except Exception, e:
+        if isinstance(e, Reportable):
+            e.cid = cid
+            raise
+        else:
+            msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
+                item.param, item.name, repr(value), type(value), format_exc(e))
+            logger.error(msg)
+
+            raise ZatoException(msg=msg)
+
+# ################################################################################################################################
+
+def convert_param_plan(cid, payload, item, data_format, default_value, path_prefix, use_text, channel_params,
+    has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets, params_priority, _convert_impl=convert_impl,
+    _channel_over_msg=PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG, _xml=DATA_FORMAT.XML):
+    """ Same as convert_param but uses a SIOParamPlan. Returns a value only, without the parameter's name.
+    """
+    # We've got a value from the channel, i.e. in GET parameters
+    channel_value = channel_params.get(item.name, ZATO_NONE)
+
+    # Convert it to a native Python data type
+    if channel_value != ZATO_NONE:
+        channel_value = convert_sio_plan(cid, item, channel_value, has_simple_io_config, force_empty_keys, encrypt_func,
+            encrypt_secrets, data_format, False)
+
+    # Return the value immediately if we already know channel_params are of higer priority
+    if params_priority == _channel_over_msg and channel_value != ZATO_NONE:
+        return channel_value
+
+    if payload is not None:
+        value = _convert_impl[data_format](payload, item.name, cid, item.is_required, item.is_complex, default_value,
+            path_prefix, use_text)
+    else:
+        value = NOT_GIVEN
+
+    if (not isinstance(value, PubSubMessage)) and value == NOT_GIVEN:
+        if default_value != NO_DEFAULT_VALUE:
+            value = default_value
+        else:
+            if item.is_required:
+
+                # Ok, we don't have anything in payload but it still may be in channel_params.
+                value = channel_value if (channel_value is not None and channel_value != ZATO_NONE) else ZATO_NONE
+
+                if value == ZATO_NONE:
+                    msg = 'Required input element:`{}` not found, value:`{}`, data_format:`{}`, payload:`{}`'\
+                        ', channel_params:`{}`'.format(item.param, value, data_format, payload, channel_params)
+                    raise ParsingException(cid, msg)
+            else:
+                value = item.input_default
+
+    else:
+        if value is not None and not item.is_complex:
+            if isinstance(value, str):
+                value = value.decode('utf-8')
+            else:
+                value = unicode(value)
+
+        if not item.is_opaque:
+            return convert_sio_plan(cid, item, value, has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets,
+                data_format, False)
+
+    return value
+
+# ################################################################################################################################
+
 class SIO_TYPE_MAP:
 
 # ################################################################################################################################
@@ -661,3 +858,71 @@ class SIO_TYPE_MAP:
             return iter((self.OPEN_API_V3, self.SOAP_12, self.ZATO))
 
 # ################################################################################################################################
+
+def run(param_counts=(5, 50, 500), iters=1000):
+    """ Compares parsing of JSON input with and without SimpleIO definitions compiled upfront.
+    """
+    simple_io_config = {
+        'bool_parameter_prefixes': ['by_', 'has_', 'is_', 'may_', 'needs_', 'should_'],
+        'int_parameters': ['current_app', 'id', 'inactivity_timeout', 'parent_id', 'pool_size', 'port', 'timeout'],
+        'int_parameter_suffixes': ['_count', '_id', '_size', '_timeout'],
+    }
+
+    for count in param_counts:
+
+        class SimpleIO:
+            input_required = []
+            input_optional = []
+
+        payload = {}
+
+        for idx in xrange(count):
+            kind = idx % 5
+            if kind == 0:
+                param, value = 'is_active_{}'.format(idx), 'true'
+            elif kind == 1:
+                param, value = 'elem_{}_id'.format(idx), '{}'.format(idx)
+            elif kind == 2:
+                param, value = Integer('elem_{}'.format(idx)), '{}'.format(idx)
+            else:
+                param, value = 'elem_{}'.format(idx), 'value_{}'.format(idx)
+
+            # Every other parameter is optional and every fourth one is not given on input
+            if idx % 2:
+                SimpleIO.input_optional.append(param)
+                if idx % 4 == 1:
+                    continue
+            else:
+                SimpleIO.input_required.append(param)
+
+            payload[param.name if isinstance(param, ForceType) else param] = value
+
+        start = datetime.datetime.utcnow()
+
+        for x in xrange(iters):
+            for is_required, params in ((True, SimpleIO.input_required), (False, SimpleIO.input_optional)):
+                for param in params:
+                    convert_param(None, payload, param, DATA_FORMAT.JSON, is_required, NO_DEFAULT_VALUE, 'request', True, {},
+                        True, simple_io_config['bool_parameter_prefixes'], simple_io_config['int_parameters'],
+                        simple_io_config['int_parameter_suffixes'], True, None, True, PARAMS_PRIORITY.DEFAULT)
+
+        print('{} params, {} iters, not compiled: {}'.format(count, iters, datetime.datetime.utcnow() - start))
+
+        start = datetime.datetime.utcnow()
+        sio_plan = SIOPlan(SimpleIO, simple_io_config)
+        print('{} params, compiled in: {}'.format(count, datetime.datetime.utcnow() - start))
+
+        start = datetime.datetime.utcnow()
+
+        for x in xrange(iters):
+            for params in (sio_plan.input_required, sio_plan.input_optional):
+                for item in params:
+                    convert_param_plan(None, payload, item, DATA_FORMAT.JSON, NO_DEFAULT_VALUE, 'request', True, {}, True,
+                        True, None, True, PARAMS_PRIORITY.DEFAULT)
+
+        print('{} params, {} iters, compiled: {}'.format(count, iters, datetime.datetime.utcnow() - start))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    run()
@@ -12,15 +12,18 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import inspect
 import logging
 import os
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from hashlib import sha256
 from importlib import import_module
 from inspect import isclass
 from json import dumps
+from time import time
 from traceback import format_exc
 
 # Bunch
-from bunch import bunchify
+from bunch import Bunch, bunchify
 
 # dill
 from dill import dumps as dill_dumps, load as dill_load
@@ -46,6 +49,7 @@ from zato.common.odb.model.base import Base as ModelBase
 from zato.common.util import deployment_info, import_module_from_path, is_func_overridden, is_python_file, visit_py_source
 from zato.server.service import after_handle_hooks, after_job_hooks, before_handle_hooks, before_job_hooks, PubSubHook, Service
 from zato.server.service.internal import AdminService
+from zato.server.service.reqresp.sio import SIOPlan
 
 # ################################################################################################################################
 
@@ -99,6 +103,10 @@ def set_up_class_attributes(class_, service_store=None, name=None):
         _req_resp_freq_key = '%s%s' % (KVDB.REQ_RESP_SAMPLE, name)
         class_._req_resp_freq = int(service_store.server.kvdb.conn.hget(_req_resp_freq_key, 'freq') or 0)
 
+        # Compile SimpleIO definitions upfront so that requests and responses do not need to do it each time
+        if class_.has_sio:
+            class_._sio_plan = get_sio_plan(class_, service_store.server.worker_store.worker_config.simple_io)
+
         class_.component_enabled_cassandra = service_store.server.fs_server_config.component_enabled.cassandra
         class_.component_enabled_email = service_store.server.fs_server_config.component_enabled.email
         class_.component_enabled_search = service_store.server.fs_server_config.component_enabled.search
@@ -146,6 +154,17 @@ def set_up_class_attributes(class_, service_store=None, name=None):
 
 # ################################################################################################################################
 
+def get_sio_plan(class_, simple_io_config):
+    """ Returns a SimpleIO definition of a service compiled for a given SimpleIO configuration or None if it cannot be compiled,
+    in which case the service will establish data types of its parameters each time it is invoked.
+    """
+    try:
+        return SIOPlan(class_.SimpleIO, simple_io_config)
+    except Exception, e:
+        logger.warn('Could not compile SimpleIO of `%s`, e:`%s`', class_, format_exc(e))
+
+# ################################################################################################################################
+
 def get_service_name(class_obj):
     """ Return the name of a service which will be either given us explicitly
     via the 'name' attribute or it will be a concatenation of the name of the
@@ -169,6 +188,9 @@ class ServiceStore(InitializingObject):
         self.update_lock = RLock()
         self.patterns_matcher = Matcher()
 
+        # A list of services awaiting to be added to the ODB in bulk, None if not in bulk mode
+        self._bulk_items = None
+
 # ################################################################################################################################
 
     def get_service_class_by_id(self, service_id):
@@ -269,7 +291,8 @@ class ServiceStore(InitializingObject):
             }
 
             logger.info('Deploying and caching internal services (%s)', self.server.name)
-            deployed = self.import_services_from_anywhere(items, base_dir)
+            with self.bulk_deployment('internal'):
+                deployed = self.import_services_from_anywhere(items, base_dir)
 
             for class_ in deployed:
                 impl_name = class_.get_impl_name()
@@ -304,8 +327,9 @@ class ServiceStore(InitializingObject):
 
             logger.info('Deploying %d cached internal services (%s)', len_si, self.server.name)
 
-            for idx, item in enumerate(items.service_info, 1):
-                self._visit_class(item.mod, deployed, item.class_, item.fs_location, True, sql_services.get(item.impl_name))
+            with self.bulk_deployment('cached internal'):
+                for idx, item in enumerate(items.service_info, 1):
+                    self._visit_class(item.mod, deployed, item.class_, item.fs_location, True, sql_services.get(item.impl_name))
 
             logger.info('Deployed %d cached internal services (%s)', len_si, self.server.name)
 
@@ -459,19 +483,42 @@ class ServiceStore(InitializingObject):
 
         si = self._get_source_code_info(mod)
 
-        if service_info:
-            service_id = service_info['id']
-            is_active = service_info['is_active']
-            slow_threshold = service_info['slow_threshold']
+        # In bulk mode, the ODB will be updated with all the services at once when the deployment is finished ..
+        if self._bulk_items is not None:
+            self._bulk_items.append(Bunch(name=name, impl_name=impl_name, is_internal=is_internal, deployment_time=now,
+                details=dumps(str(depl_info)), source_info=si, service_info=service_info, class_=class_))
 
-            self.odb.add_service(name, impl_name, is_internal, now, dumps(str(depl_info)), si, service_info)
+            deployed.append(class_)
 
-        else:
-            service_id, is_active, slow_threshold = self.odb.add_service(
-                name, impl_name, is_internal, now, dumps(str(depl_info)), si, service_info)
+            if has_debug:
+                logger.debug('Imported service:`%s` (bulk)', name)
+
+            return
+
+        # .. otherwise, it is done for each service separately.
+        service_id, is_active, slow_threshold = self._add_service_to_odb(
+            name, impl_name, is_internal, now, dumps(str(depl_info)), si, service_info)
 
         deployed.append(class_)
+        self._set_service_odb_data(class_, name, impl_name, service_id, is_active, slow_threshold)
+
+# ################################################################################################################################
+
+    def _add_service_to_odb(self, name, impl_name, is_internal, now, details, si, service_info):
+        """ Adds a single service to the ODB, returning its ID, is_active flag and slow_threshold.
+        """
+        if service_info:
+            self.odb.add_service(name, impl_name, is_internal, now, details, si, service_info)
+            return service_info['id'], service_info['is_active'], service_info['slow_threshold']
+
+        else:
+            return self.odb.add_service(name, impl_name, is_internal, now, details, si, service_info)
 
+# ################################################################################################################################
+
+    def _set_service_odb_data(self, class_, name, impl_name, service_id, is_active, slow_threshold):
+        """ Makes the store aware of what the ODB holds for a service that has just been deployed.
+        """
         self.services[impl_name]['is_active'] = is_active
         self.services[impl_name]['slow_threshold'] = slow_threshold
 
@@ -484,6 +531,47 @@ class ServiceStore(InitializingObject):
 
         class_.after_add_to_store(logger)
 
+# ################################################################################################################################
+
+    @contextmanager
+    def bulk_deployment(self, label, _time=time):
+        """ All services deployed in the body of this context manager are added to the ODB in one transaction
+        when it exits, rather than each in a separate one. Logs how long each phase of the deployment took.
+        """
+        self._bulk_items = items = []
+        start = _time()
+
+        try:
+            yield
+        finally:
+            self._bulk_items = None
+
+        timings = OrderedDict()
+        timings['import'] = _time() - start
+
+        odb_start = _time()
+        result = self.odb.add_services(items, timings) if items else {}
+
+        # Could not add services in bulk, fall back to doing it one by one
+        if result is None:
+            for item in items:
+                service_id, is_active, slow_threshold = self._add_service_to_odb(item.name, item.impl_name, item.is_internal,
+                    item.deployment_time, item.details, item.source_info, item.service_info)
+                self._set_service_odb_data(item.class_, item.name, item.impl_name, service_id, is_active, slow_threshold)
+
+            timings['odb_fallback'] = _time() - odb_start
+
+        else:
+            for item in items:
+                service_id, is_active, slow_threshold = result[item.name]
+                self._set_service_odb_data(item.class_, item.name, item.impl_name, service_id, is_active, slow_threshold)
+
+        timings['total'] = _time() - start
+
+        logger.info('Deployed %d %s service%s in %.3fs (%s) (%s)', len(items), label, '' if len(items) == 1 else 's',
+            timings['total'], ', '.join('{}:{:.3f}s'.format(key, value) for key, value in timings.items() if key != 'total'),
+            self.server.name)
+
 # ################################################################################################################################
 
     def on_worker_initialized(self):
@@ -10,15 +10,202 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from traceback import format_exc
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep
+
 # Zato
 from zato.common import KVDB
 
 logger = logging.getLogger(__name__)
 
+# How often, in seconds, statistics collected by workers are flushed to KVDB
+DEFAULT_FLUSH_INTERVAL = 5
+
+# How long, in seconds, raw per-minute processing times are kept in KVDB before they expire
+RAW_BY_MINUTE_EXPIRY = 300
+
+# ################################################################################################################################
+
+def get_time_bucket(value):
+    """ Rounds a processing time in milliseconds so that histograms of such times use a fixed amount of memory.
+    Times below 1000 ms are kept as they are while larger ones are rounded down to three significant digits.
+    """
+    if value < 1000:
+        return value
+
+    factor = 10 ** (len(str(value)) - 3)
+    return value // factor * factor
+
+# ################################################################################################################################
+
+def get_raw_time_elems(histogram):
+    """ Turns a histogram of processing times into elements of raw times lists in KVDB - times that were seen once are stored
+    as they are and all the other ones as time:count pairs.
+    """
+    return [(str(value) if count == 1 else '{}:{}'.format(value, count)) for value, count in sorted(histogram.iteritems())]
+
+# ################################################################################################################################
+
+def parse_raw_time_elem(elem):
+    """ Returns a (time, count) tuple out of an element of a raw times list in KVDB.
+    """
+    if ':' in elem:
+        value, count = elem.split(':')
+        return int(value), int(count)
+    else:
+        return int(elem), 1
+
+# ################################################################################################################################
+
+def score_at_percentile(times, percentile):
+    """ Same as scipy.stats.scoreatpercentile but for sorted (time, count) pairs.
+    """
+    idx = percentile / 100.0 * (sum(count for _, count in times) - 1)
+    low_idx = int(idx)
+
+    low = high = None
+    seen = 0
+
+    for value, count in times:
+        seen += count
+        if low is None and seen > low_idx:
+            low = value
+        if seen > low_idx + 1:
+            high = value
+            break
+
+    if high is None or idx == low_idx:
+        return low
+
+    return low + (high - low) * (idx - low_idx)
+
+# ################################################################################################################################
+
+def trimmed_mean(times, upper_limit):
+    """ Same as scipy.stats.tmean with an inclusive upper limit but for (time, count) pairs.
+    """
+    total = usage = 0
+
+    for value, count in times:
+        if value <= upper_limit:
+            total += value * count
+            usage += count
+
+    return total / usage if usage else 0
+
+# ################################################################################################################################
+
+class ServiceStatsAggregator(object):
+    """ Collects usage and processing times of services invoked in a worker process and periodically flushes them to KVDB
+    in bulk, in the format that services from zato.server.service.internal.stats expect, so that the number of KVDB
+    operations depends on how many services were invoked rather than on how many times they were.
+    """
+    def __init__(self, kvdb, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.kvdb = kvdb
+        self.flush_interval = flush_interval
+        self.keep_running = True
+
+        # Service name -> how many times it was invoked in this process since it started
+        self.usage_total = {}
+
+        self._reset()
+
+    def _reset(self):
+
+        # Service name -> how many times it was invoked since the last flush
+        self.usage = {}
+
+        # Service name -> its most recent processing time
+        self.last = {}
+
+        # Service name -> time bucket -> how many invocations took that long
+        self.times = {}
+
+        # (Service name, minute) -> time bucket -> how many invocations took that long
+        self.times_by_minute = {}
+
+    def incr_usage(self, name):
+        """ Increases usage of a given service and returns how many times it was invoked in this process so far.
+        """
+        self.usage[name] = self.usage.get(name, 0) + 1
+        usage = self.usage_total[name] = self.usage_total.get(name, 0) + 1
+
+        return usage
+
+    def add_time(self, name, proc_time, now, _get_time_bucket=get_time_bucket):
+        """ Stores processing time of a service that returned its response at a given time.
+        """
+        bucket = _get_time_bucket(proc_time)
+        self.last[name] = proc_time
+
+        try:
+            times = self.times[name]
+        except KeyError:
+            times = self.times[name] = {}
+        times[bucket] = times.get(bucket, 0) + 1
+
+        key = (name, (now.year, now.month, now.day, now.hour, now.minute))
+
+        try:
+            times = self.times_by_minute[key]
+        except KeyError:
+            times = self.times_by_minute[key] = {}
+        times[bucket] = times.get(bucket, 0) + 1
+
+    def flush(self, _usage=KVDB.SERVICE_USAGE, _time_basic=KVDB.SERVICE_TIME_BASIC, _time_raw=KVDB.SERVICE_TIME_RAW,
+        _time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE, _expiry=RAW_BY_MINUTE_EXPIRY,
+        _get_raw_time_elems=get_raw_time_elems):
+        """ Writes to KVDB everything collected since the previous flush, using a single pipeline.
+        """
+        if not (self.usage or self.last):
+            return
+
+        usage, last, times, times_by_minute = self.usage, self.last, self.times, self.times_by_minute
+        self._reset()
+
+        try:
+            with self.kvdb.conn.pipeline() as pipe:
+
+                for name, value in usage.iteritems():
+                    pipe.incr('%s%s' % (_usage, name), value)
+
+                for name, value in last.iteritems():
+                    pipe.hset('%s%s' % (_time_basic, name), 'last', value)
+
+                for name, histogram in times.iteritems():
+                    pipe.rpush('%s%s' % (_time_raw, name), *_get_raw_time_elems(histogram))
+
+                for (name, minute), histogram in times_by_minute.iteritems():
+                    key = '%s%s:%04d:%02d:%02d:%02d:%02d' % ((_time_raw_by_minute, name) + minute)
+                    pipe.rpush(key, *_get_raw_time_elems(histogram))
+
+                    # Services from zato.server.service.internal.stats have that much time
+                    # to aggregate processing times for a given minute and then the key will expire.
+                    pipe.expire(key, _expiry)
+
+                pipe.execute()
+
+        except Exception, e:
+            logger.warn('Could not flush service statistics, e:`%s`', format_exc(e))
+
+    def run(self, _sleep=sleep):
+        """ Flushes statistics in a loop until told to stop.
+        """
+        while self.keep_running:
+            _sleep(self.flush_interval)
+            self.flush()
+
+    def stop(self):
+        self.keep_running = False
+        self.flush()
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
@@ -10,12 +10,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from cStringIO import StringIO
+from gzip import GzipFile
 from httplib import OK
 from unittest import TestCase
 from uuid import uuid4
 
 # anyjson
-from anyjson import loads
+from anyjson import dumps, loads
 
 # arrow
 import arrow
@@ -23,6 +24,9 @@ import arrow
 # Bunch
 from bunch import Bunch
 
+# gevent
+from gevent import joinall, sleep, spawn
+
 # lxml
 from lxml import etree
 
@@ -556,3 +560,243 @@ class TestRequestHandler(TestCase):
 
         rh.set_content_type(response, rand_string(), rand_string(), None, FakeChannelItem())
         eq_(response.content_type, user_content_type)
+
+# ##############################################################################
+
+class TestRequestHandlerCache(TestCase):
+
+    def get_handler(self, **channel_config):
+
+        self.cache = {}
+        self.cache_expiry = {}
+        self.invocations = []
+
+        test = self
+
+        class _Service(object):
+            get_request_hash = None
+
+            def update_handle(_self, *ignored_args, **kwargs):
+                test.invocations.append(kwargs['wsgi_environ'])
+                sleep(0.01)
+
+                if test.exception:
+                    raise test.exception
+
+                return DummyResponse('payload-{}'.format(len(test.invocations)))
+
+        class _server:
+            fs_server_config = Bunch(misc=Bunch(use_soap_envelope=True))
+
+            class service_store:
+                @staticmethod
+                def new_instance(service_impl_name):
+                    return _Service(), True
+
+            @staticmethod
+            def get_from_cache(cache_type, cache_name, key):
+                return test.cache.get(key)
+
+            @staticmethod
+            def set_in_cache(cache_type, cache_name, key, value, expiry=0):
+                test.cache[key] = value
+                test.cache_expiry[key] = expiry
+
+        self.exception = None
+
+        self.channel_item = Bunch(id=1, service_impl_name='my.service', merge_url_params_req=True,
+            data_format=DATA_FORMAT.JSON, url_params_pri=None, transport=None, params_pri=None, cache_type='builtin',
+            cache_name='default', cache_expiry=0, content_encoding=None)
+        self.channel_item.update(channel_config)
+
+        return channel.RequestHandler(_server)
+
+    def handle(self, rh):
+        wsgi_environ = {'REQUEST_METHOD':'GET', 'PATH_INFO':'/my/api', 'zato.http.response.headers':{}}
+        return rh.handle(new_cid(), {}, self.channel_item, wsgi_environ, '', Bunch(broker_client=None), None, None,
+            None, None)
+
+    def test_single_flight(self):
+        rh = self.get_handler(cache_single_flight=True)
+
+        greenlets = [spawn(self.handle, rh) for _ in range(10)]
+        joinall(greenlets)
+
+        eq_(len(self.invocations), 1)
+        eq_(len(self.cache), 1)
+        eq_(rh.in_flight, {})
+
+        responses = [greenlet.value for greenlet in greenlets]
+        eq_(set(response.payload for response in responses), set(['payload-1']))
+
+        # Each caller receives its own response object
+        eq_(len(set(id(response) for response in responses)), 10)
+
+    def test_single_flight_disabled(self):
+        rh = self.get_handler()
+        joinall([spawn(self.handle, rh) for _ in range(10)])
+
+        eq_(len(self.invocations), 10)
+
+    def test_single_flight_exception(self):
+        rh = self.get_handler(cache_single_flight=True)
+        self.exception = ValueError('Test exception')
+
+        greenlets = [spawn(self.handle, rh) for _ in range(5)]
+        joinall(greenlets)
+
+        eq_(len(self.invocations), 1)
+        eq_(len(self.cache), 0)
+        eq_(rh.in_flight, {})
+
+        for greenlet in greenlets:
+            self.assertIs(greenlet.exception, self.exception)
+
+    def test_stale_while_revalidate(self):
+        rh = self.get_handler(cache_single_flight=True, cache_expiry=10, cache_stale_grace=5)
+
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-1')
+
+        cache_key = list(self.cache)[0]
+        eq_(self.cache_expiry[cache_key], 15)
+
+        # Fresh responses are served from cache
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-1')
+        self.assertFalse(response.is_stale)
+        eq_(len(self.invocations), 1)
+
+        # Make the response stale
+        meta, payload = self.cache[cache_key].split(b'\n', 1)
+        meta = loads(meta)
+        meta['fresh_until'] = 1
+        self.cache[cache_key] = b'%s\n%s' % (dumps(meta), payload)
+
+        # Stale responses are returned as they are, with only one refresh started in background
+        response1 = self.handle(rh)
+        response2 = self.handle(rh)
+
+        self.assertTrue(response1.is_stale)
+        self.assertTrue(response2.is_stale)
+        eq_(response1.payload, 'payload-1')
+        eq_(response2.payload, 'payload-1')
+        self.assertIn(cache_key, rh.in_flight)
+
+        sleep(0.05)
+
+        eq_(len(self.invocations), 2)
+        eq_(rh.in_flight, {})
+
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-2')
+        self.assertFalse(response.is_stale)
+
+
+    def test_encoded_response(self):
+        rh = self.get_handler(content_encoding='gzip')
+
+        response1 = self.handle(rh)
+        cache_key = list(self.cache)[0]
+        encoded = rh.encoded_responses[cache_key]
+
+        eq_(response1.payload, 'payload-1')
+        eq_(GzipFile(fileobj=StringIO(response1.gzipped_payload)).read(), 'payload-1')
+        self.assertTrue(response1.etag.startswith('"'))
+
+        # The same value is not decoded again ..
+        response2 = self.handle(rh)
+        self.assertIs(rh.encoded_responses[cache_key], encoded)
+        self.assertIs(response2.gzipped_payload, response1.gzipped_payload)
+        eq_(response2.etag, response1.etag)
+
+        # .. unless it has been changed, e.g. by another worker, in which case it is received as unicode.
+        value = channel._EncodedResponse.from_response(DummyResponse('payload-x'), None, False).value
+        self.cache[cache_key] = value.decode('utf-8')
+
+        response3 = self.handle(rh)
+        self.assertIsNot(rh.encoded_responses[cache_key], encoded)
+        eq_(response3.payload, 'payload-x')
+        eq_(GzipFile(fileobj=StringIO(response3.gzipped_payload)).read(), 'payload-x')
+        self.assertNotEquals(response3.etag, response1.etag)
+
+        eq_(len(self.invocations), 1)
+
+    def test_encoded_response_other_format(self):
+        rh = self.get_handler()
+        self.handle(rh)
+
+        cache_key = list(self.cache)[0]
+        self.cache[cache_key] = dumps({'payload':'abc'})
+
+        # Values in formats not recognized are treated as if there was nothing in the cache
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-2')
+
+# ##############################################################################
+
+class TestRequestDispatcherCache(TestCase):
+
+    def dispatch(self, response, content_encoding=None, **wsgi_environ):
+
+        class _RequestHandler(object):
+            def handle(*ignored_args, **ignored_kwargs):
+                return response
+
+        channel_item = Bunch(is_active=True, method='', match_target='abc', content_encoding=content_encoding)
+
+        ud = DummyURLData({}, channel_item)
+        ud.url_sec['abc'] = Bunch(sec_def=ZATO_NONE, sec_use_rbac=False)
+
+        rd = channel.RequestDispatcher(ud, request_handler=_RequestHandler())
+
+        wsgi_environ.setdefault('REQUEST_METHOD', 'GET')
+        wsgi_environ.update({
+            'PATH_INFO': '/my/api',
+            'wsgi.input': StringIO(),
+            'zato.http.response.headers': {},
+        })
+
+        return rd.dispatch(new_cid(), None, wsgi_environ, None), wsgi_environ
+
+    def get_response(self, payload='abc', etag='"123"'):
+        return channel._CachedResponse(payload, 'text/plain', {}, OK, False, etag, channel.gzip_payload(payload))
+
+    def test_etag(self):
+        payload, wsgi_environ = self.dispatch(self.get_response())
+        eq_(payload, 'abc')
+        eq_(wsgi_environ['zato.http.response.status'], '200 OK')
+        eq_(wsgi_environ['zato.http.response.headers']['ETag'], '"123"')
+
+        payload, wsgi_environ = self.dispatch(self.get_response(), HTTP_IF_NONE_MATCH='"123"')
+        eq_(payload, '')
+        eq_(wsgi_environ['zato.http.response.status'], '304 Not Modified')
+
+        payload, wsgi_environ = self.dispatch(self.get_response(), HTTP_IF_NONE_MATCH='"456"')
+        eq_(payload, 'abc')
+        eq_(wsgi_environ['zato.http.response.status'], '200 OK')
+
+        # Only GET and HEAD requests are conditional
+        payload, wsgi_environ = self.dispatch(self.get_response(), HTTP_IF_NONE_MATCH='"123"', REQUEST_METHOD='POST')
+        eq_(payload, 'abc')
+
+    def test_gzip(self):
+        response = self.get_response()
+        response.gzipped_payload = 'already-compressed'
+
+        payload, wsgi_environ = self.dispatch(response, 'gzip')
+        eq_(payload, 'already-compressed')
+        eq_(wsgi_environ['zato.http.response.headers']['Content-Encoding'], 'gzip')
+
+        # Responses not from cache are compressed each time
+        payload, wsgi_environ = self.dispatch(DummyResponse('abc'), 'gzip')
+        eq_(GzipFile(fileobj=StringIO(payload)).read(), 'abc')
+        self.assertNotIn('ETag', wsgi_environ['zato.http.response.headers'])
+
+    def test_etag_matches(self):
+        self.assertTrue(channel.etag_matches('"123"', '"123"'))
+        self.assertTrue(channel.etag_matches('*', '"123"'))
+        self.assertTrue(channel.etag_matches('"456", W/"123"', '"123"'))
+        self.assertFalse(channel.etag_matches('"456", "789"', '"123"'))
+
+# ##############################################################################
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common import CACHE
+from zato.server.connection.cache import Cache
+
+# ################################################################################################################################
+
+class CacheSyncBatchTestCase(TestCase):
+
+    def get_cache(self, sync_method=CACHE.SYNC_METHOD.IN_BACKGROUND_BATCHED.id, **config):
+        self.single = []
+        self.batches = []
+
+        config.setdefault('sync_batch_max_size', 1000)
+        config.setdefault('sync_batch_max_wait', 10000)
+
+        return Cache(Bunch({
+            'name': 'test',
+            'sync_method': sync_method,
+            'max_size': 100,
+            'max_item_size': 1000,
+            'extend_expiry_on_get': True,
+            'extend_expiry_on_set': True,
+            'after_state_changed_callback': lambda op, cache_name, data: self.single.append((op, cache_name, data)),
+            'after_state_changed_batch_callback': lambda cache_name, items: self.batches.append((cache_name, items)),
+        }, **config))
+
+    def get_ops(self, items):
+        return [(item['op'], item['data'].get('key'), item['data'].get('value')) for item in items]
+
+# ################################################################################################################################
+
+    def test_no_batch(self):
+        cache = self.get_cache(CACHE.SYNC_METHOD.IN_BACKGROUND.id)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        sleep(0)
+
+        self.assertIsNone(cache.sync_batch)
+        self.assertEquals(len(self.single), 2)
+        self.assertListEqual(self.batches, [])
+
+# ################################################################################################################################
+
+    def test_coalesce(self):
+        cache = self.get_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 3)
+        cache.delete('b')
+        cache.sync_batch.flush()
+
+        self.assertListEqual(self.single, [])
+        self.assertEquals(len(self.batches), 1)
+
+        cache_name, items = self.batches[0]
+        self.assertEquals(cache_name, 'test')
+        self.assertListEqual(self.get_ops(items), [
+            (CACHE.STATE_CHANGED.SET, 'a', 3),
+            (CACHE.STATE_CHANGED.DELETE, 'b', None),
+        ])
+
+# ################################################################################################################################
+
+    def test_no_coalesce_across_expire_and_patterns(self):
+        cache = self.get_cache()
+        cache.set('a', 1, 10)
+        cache.expire('a', 20)
+        cache.set('a', 2)
+        cache.set('b', 3)
+        cache.delete_by_prefix('b', True)
+        cache.set('b', 4)
+        cache.sync_batch.flush()
+
+        self.assertListEqual(self.get_ops(self.batches[0][1]), [
+            (CACHE.STATE_CHANGED.SET, 'a', 1),
+            (CACHE.STATE_CHANGED.EXPIRE, 'a', None),
+            (CACHE.STATE_CHANGED.SET, 'a', 2),
+            (CACHE.STATE_CHANGED.SET, 'b', 3),
+            (CACHE.STATE_CHANGED.DELETE_BY_PREFIX, 'b', None),
+            (CACHE.STATE_CHANGED.SET, 'b', 4),
+        ])
+
+# ################################################################################################################################
+
+    def test_clear(self):
+        cache = self.get_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.clear()
+        cache.set('c', 3)
+        cache.sync_batch.flush()
+
+        self.assertListEqual(self.get_ops(self.batches[0][1]), [
+            (CACHE.STATE_CHANGED.CLEAR, None, None),
+            (CACHE.STATE_CHANGED.SET, 'c', 3),
+        ])
+
+# ################################################################################################################################
+
+    def test_flush_max_size(self):
+        cache = self.get_cache(sync_batch_max_size=3)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        cache.set('b', 3)
+        sleep(0)
+
+        self.assertListEqual(self.batches, [])
+
+        cache.set('c', 4)
+        sleep(0)
+
+        self.assertEquals(len(self.batches), 1)
+        self.assertEquals(len(self.batches[0][1]), 3)
+
+# ################################################################################################################################
+
+    def test_flush_max_size_once(self):
+        cache = self.get_cache(sync_batch_max_size=3)
+
+        flushes = []
+        flush = cache.sync_batch.flush
+
+        def _flush():
+            flushes.append(True)
+            flush()
+
+        cache.sync_batch.flush = _flush
+
+        # Changes added to a full batch before it is published do not schedule any more flushes ..
+        for idx in range(10):
+            cache.set('key.{}'.format(idx), idx)
+        sleep(0)
+
+        self.assertEquals(len(flushes), 1)
+        self.assertEquals(len(self.batches), 1)
+        self.assertEquals(len(self.batches[0][1]), 10)
+
+        # .. and once it is published, the next full batch is flushed again.
+        for idx in range(3):
+            cache.set('key.{}'.format(idx), idx)
+        sleep(0)
+
+        self.assertEquals(len(flushes), 2)
+        self.assertEquals(len(self.batches), 2)
+        self.assertEquals(len(self.batches[1][1]), 3)
+
+# ################################################################################################################################
+
+    def test_flush_max_wait(self):
+        cache = self.get_cache(sync_batch_max_wait=1)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        sleep(0.05)
+
+        self.assertEquals(len(self.batches), 1)
+        self.assertEquals(len(self.batches[0][1]), 2)
+
+        cache.set('c', 3)
+        sleep(0.05)
+
+        self.assertEquals(len(self.batches), 2)
+        self.assertEquals(len(self.batches[1][1]), 1)
+
+# ################################################################################################################################
+
+    def test_update_config(self):
+        cache = self.get_cache()
+        cache.set('a', 1)
+
+        cache.update_config(Bunch(cache.config, sync_method=CACHE.SYNC_METHOD.IN_BACKGROUND.id))
+        self.assertIsNone(cache.sync_batch)
+        self.assertEquals(len(self.batches), 1)
+
+        cache.set('b', 2)
+        sleep(0)
+        self.assertEquals(len(self.single), 1)
+
+# ################################################################################################################################
+
+    def test_sync_after_batch(self):
+        source = self.get_cache()
+        source.set('a', 1)
+        source.set('b', 2)
+        source.set('c', 3)
+        source.set('a', 4)
+        source.delete('b')
+        source.expire('c', 100)
+        source.sync_batch.flush()
+        batches = self.batches
+
+        target = self.get_cache()
+        target.set('b', 20)
+        target.set('x', 30)
+
+        # Items are received as deserialized broker messages
+        items = [{'op':item['op'], 'data':dict(item['data'])} for item in batches[0][1]]
+        target.sync_after_batch(items)
+
+        self.assertEquals(target.get('a'), 4)
+        self.assertEquals(target.get('c'), 3)
+        self.assertEquals(target.get('x'), 30)
+        self.assertNotIn('b', target)
+        self.assertTrue(target.get('c', details=True).expires_at > 0)
+
+        # Synchronizing does not publish anything on its own, only the target's own changes are pending
+        self.assertListEqual([(op, data['key']) for op, data in target.sync_batch.items], [
+            (CACHE.STATE_CHANGED.SET, 'b'),
+            (CACHE.STATE_CHANGED.SET, 'x'),
+        ])
+
+# ################################################################################################################################
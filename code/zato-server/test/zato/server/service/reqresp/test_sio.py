@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import dumps, loads
+from logging import getLogger
+from unittest import TestCase
+
+# SQLAlchemy
+from sqlalchemy.util import KeyedTuple
+
+# Zato
+from zato.common import DATA_FORMAT, PARAMS_PRIORITY, ParsingException, ZatoException
+from zato.server.service.reqresp import Request, Response, SimpleIOPayload
+from zato.server.service.reqresp.sio import AsIs, Boolean, Integer, SIOPlan, Unicode
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+simple_io_config = {
+    'bool_parameter_prefixes': ['is_', 'has_'],
+    'int_parameters': ['id'],
+    'int_parameter_suffixes': ['_id', '_count'],
+}
+
+# ################################################################################################################################
+
+class MySimpleIO:
+    input_required = ('id', 'name', Boolean('active'))
+    input_optional = ('is_admin', 'parent_id', 'password', Integer('limit', default=10), AsIs('raw'), Unicode('missing'))
+    output_required = ('id', 'name')
+    output_optional = ('is_admin', 'item_count', AsIs('raw'), Unicode('missing', default='abc'))
+
+# ################################################################################################################################
+
+class SIOPlanTestCase(TestCase):
+
+    def test_compile(self):
+        sio_plan = SIOPlan(MySimpleIO, simple_io_config)
+
+        self.assertListEqual([item.name for item in sio_plan.input_required], ['id', 'name', 'active'])
+        self.assertListEqual([item.is_int for item in sio_plan.input_required], [True, False, False])
+        self.assertListEqual([item.is_bool for item in sio_plan.input_required], [False, False, True])
+
+        self.assertListEqual([item.name for item in sio_plan.input_optional],
+            ['is_admin', 'parent_id', 'password', 'limit', 'raw', 'missing'])
+        self.assertListEqual([item.is_secret for item in sio_plan.input_optional], [False, False, True, False, False, False])
+        self.assertListEqual([item.input_default for item in sio_plan.input_optional], ['', '', '', 10, '', ''])
+
+        self.assertEquals(sio_plan.output_names, {'id', 'name', 'is_admin', 'item_count', 'raw', 'missing'})
+        self.assertTrue(sio_plan.is_valid_for(MySimpleIO, simple_io_config))
+        self.assertFalse(sio_plan.is_valid_for(MySimpleIO, dict(simple_io_config)))
+
+        class MySimpleIO2(MySimpleIO):
+            pass
+
+        self.assertFalse(sio_plan.is_valid_for(MySimpleIO2, simple_io_config))
+
+# ################################################################################################################################
+
+    def get_request(self, payload, channel_params=None, params_priority=PARAMS_PRIORITY.DEFAULT, sio_plan=None):
+        request = Request(logger, simple_io_config)
+        request.payload = payload
+        request.channel_params.update(channel_params or {})
+        request.params_priority = params_priority
+        request.init(True, 'cid', MySimpleIO, DATA_FORMAT.JSON, None, {}, lambda value: 'encrypted', sio_plan)
+
+        return request
+
+    def test_request_same_as_not_compiled(self):
+        sio_plan = SIOPlan(MySimpleIO, simple_io_config)
+
+        payloads_channel_params = (
+            ({'id': '1', 'name': b'zzz', 'active': 'false'}, None),
+            ({'id': 1, 'name': 'zzz', 'active': 'on', 'is_admin': 'True', 'parent_id': '', 'password': 'abc', 'limit': '5',
+              'raw': {'a': 'b'}}, {'zzz': 'qqq'}),
+            ({'name': 'zzz', 'active': ''}, {'id': '2', 'is_admin': 'false', 'limit': ''}),
+            ({'id': '1', 'name': 'zzz', 'active': 'false'}, {'id': '2', 'missing': 'ZATO_NONE'}),
+        )
+
+        for params_priority in PARAMS_PRIORITY:
+            for payload, channel_params in payloads_channel_params:
+                expected = self.get_request(payload, channel_params, params_priority).input
+                given = self.get_request(payload, channel_params, params_priority, sio_plan).input
+                self.assertDictEqual(given, expected)
+
+        self.assertDictEqual(self.get_request(payloads_channel_params[1][0], sio_plan=sio_plan).input, {
+            'id': 1, 'name': 'zzz', 'active': True, 'is_admin': True, 'parent_id': None, 'password': 'encrypted', 'limit': 5,
+            'raw': {'a': 'b'}, 'missing': ''})
+
+    def test_request_missing_required(self):
+        sio_plan = SIOPlan(MySimpleIO, simple_io_config)
+
+        for plan in (None, sio_plan):
+            self.assertRaises(ParsingException, self.get_request, {'id': '1', 'name': 'zzz'}, None, PARAMS_PRIORITY.DEFAULT,
+                plan)
+
+# ################################################################################################################################
+
+    def get_response_value(self, output, sio_plan=None):
+        response = Response(logger, simple_io_config=simple_io_config)
+        response.init('cid', MySimpleIO, DATA_FORMAT.JSON, sio_plan)
+        response.payload[:] = output
+
+        return loads(response.payload.getvalue())
+
+    def test_response_same_as_not_compiled(self):
+        sio_plan = SIOPlan(MySimpleIO, simple_io_config)
+
+        output = [
+            {'id': '1', 'name': 'zzz', 'is_admin': 'false', 'item_count': '', 'raw': [1, 2]},
+            {'id': 2, 'name': b'\xc4\x85', 'item_count': '3', 'missing': ''},
+        ]
+
+        expected = self.get_response_value(output)
+        self.assertDictEqual(self.get_response_value(output, sio_plan), expected)
+        self.assertListEqual(expected['response'], [
+            {'id': 1, 'name': 'zzz', 'is_admin': False, 'item_count': None, 'raw': [1, 2], 'missing': 'abc'},
+            {'id': 2, 'name': 'ą', 'is_admin': '', 'item_count': 3, 'raw': '', 'missing': 'abc'},
+        ])
+
+# ################################################################################################################################
+
+class JSONListTestCase(TestCase):
+
+    def get_payload(self, output, required_list=('id', 'name'), skip_empty_keys=False, force_empty_keys=(),
+            allow_empty_required=False, response_elem='response'):
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, required_list, MySimpleIO.output_optional, simple_io_config,
+            response_elem, '', True, skip_empty_keys, force_empty_keys, allow_empty_required)
+        payload[:] = output
+        return payload
+
+    def assert_same_as_dict(self, payload):
+        value = payload.getvalue()
+        self.assertIsInstance(value, bytes)
+        self.assertEquals(loads(value), loads(dumps(payload.getvalue(False))))
+        return loads(value)
+
+    def test_rows(self):
+        dict_rows = [
+            {'id': '1', 'name': 'zzz', 'is_admin': 'false', 'item_count': '', 'raw': {'a': [1, 2.5]}},
+            {'id': 2, 'name': b'\xc4\x85', 'is_admin': True, 'item_count': '3', 'missing': 'qqq', 'zzz': 'zzz'},
+        ]
+        keyed_rows = [KeyedTuple(row.values(), row.keys()) for row in dict_rows]
+
+        for output in (dict_rows, keyed_rows, []):
+            self.assert_same_as_dict(self.get_payload(output))
+
+        self.assertListEqual(self.assert_same_as_dict(self.get_payload(dict_rows))['response'], [
+            {'id': 1, 'name': 'zzz', 'is_admin': False, 'item_count': None, 'raw': {'a': [1, 2.5]}, 'missing': 'abc'},
+            {'id': 2, 'name': 'ą', 'is_admin': True, 'item_count': 3, 'raw': '', 'missing': 'qqq'},
+        ])
+
+        # A single output parameter
+        for output in ([{'id': '1'}], [KeyedTuple(['1'], ['id'])]):
+            value = self.assert_same_as_dict(self.get_payload(output, ['id']))
+            self.assertEquals(value['response'][0]['id'], 1)
+
+    def test_empty_keys(self):
+        output = [{'id': '1', 'name': 'zzz', 'item_count': ''}]
+
+        value = self.assert_same_as_dict(self.get_payload(output, skip_empty_keys=True))
+        self.assertDictEqual(value['response'][0], {'id': 1, 'name': 'zzz'})
+
+        value = self.assert_same_as_dict(self.get_payload(output, skip_empty_keys=True, force_empty_keys=['item_count']))
+        self.assertDictEqual(value['response'][0], {'id': 1, 'name': 'zzz', 'item_count': None})
+
+        output = [{'id': '1', 'name': ''}]
+        self.assertRaises(ZatoException, self.get_payload(output).getvalue)
+
+        value = self.assert_same_as_dict(self.get_payload(output, allow_empty_required=True))
+        self.assertEquals(value['response'][0]['name'], '')
+
+    def test_response_elem_meta(self):
+        payload = self.get_payload([{'id': '1', 'name': 'zzz'}], response_elem=None)
+        self.assertEquals(len(self.assert_same_as_dict(payload)), 1)
+
+        payload = self.get_payload([{'id': '1', 'name': 'zzz'}])
+        payload.zato_meta['search'] = {'total': 1}
+        self.assertDictEqual(self.assert_same_as_dict(payload)['_meta'], {'total': 1})
+
+# ################################################################################################################################
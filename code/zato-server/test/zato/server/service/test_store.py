@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common.odb.api import bulk_insert_chunk_size, ODBManager
+from zato.common.odb.model import Base, DeployedService, Service
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+
+class _TestService(object):
+    added_to_store = []
+
+    @classmethod
+    def after_add_to_store(class_, logger):
+        class_.added_to_store.append(class_)
+
+# ################################################################################################################################
+
+class BulkDeploymentTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+
+        self.session = sessionmaker(bind=engine)
+        self.cluster_id = 1
+        self.server_id = 1
+        self.other_server_id = 2
+        self.now = datetime.utcnow()
+
+        # More than a few chunks of rows but not a multiple of their size so that the last chunk is a partial one
+        self.len_services = bulk_insert_chunk_size * 2 + 23
+
+        self.odb = ODBManager()
+        self.odb._Session = self.session
+        self.odb.cluster = Bunch(id=self.cluster_id)
+        self.odb.server = Bunch(id=self.server_id)
+
+        _TestService.added_to_store[:] = []
+
+    def get_name(self, idx):
+        return 'test.service.{}'.format(idx)
+
+    def add_existing(self):
+        """ Adds two services to the ODB before deployment - one deployed on this and another server
+        and the other one deployed on the other server only.
+        """
+        session = self.session()
+
+        for idx in range(2):
+            service_id = session.execute(Service.__table__.insert().values(name=self.get_name(idx), is_active=False,
+                impl_name='impl.old.{}'.format(idx), is_internal=False, slow_threshold=123,
+                cluster_id=self.cluster_id)).inserted_primary_key[0]
+
+            for server_id in (self.server_id, self.other_server_id) if idx == 0 else (self.other_server_id,):
+                session.add(DeployedService(self.now - timedelta(days=1), 'old-details', server_id, service_id,
+                    b'old-source', '/old/path.py', 'old-hash', 'SHA-256'))
+
+        session.commit()
+
+    def get_item(self, idx):
+        return Bunch(name=self.get_name(idx), impl_name='impl.{}'.format(idx), is_internal=False,
+            deployment_time=self.now, details='details-{}'.format(idx), service_info=None, class_=_TestService,
+            source_info=Bunch(source=b'source-{}'.format(idx), path='/path/{}.py'.format(idx), hash='hash-{}'.format(idx),
+                hash_method='SHA-256'))
+
+    def get_services(self):
+        session = self.session()
+        return dict((item.name, item) for item in session.query(Service).all())
+
+    def get_deployed(self, server_id):
+        session = self.session()
+        return dict((item.service_id, item) for item in session.query(DeployedService).\
+            filter(DeployedService.server_id==server_id).\
+            all())
+
+# ################################################################################################################################
+
+    def test_add_services(self):
+        self.add_existing()
+        existing_ids = dict((name, item.id) for name, item in self.get_services().items())
+
+        timings = {}
+        items = [self.get_item(idx) for idx in range(self.len_services)]
+        result = self.odb.add_services(items, timings)
+
+        self.assertListEqual(sorted(timings), ['odb_commit', 'odb_insert_deployed_service', 'odb_insert_service', 'odb_query'])
+
+        # Each service is in the ODB exactly once ..
+        services = self.get_services()
+        self.assertEquals(len(services), self.len_services)
+        self.assertEquals(len(result), self.len_services)
+
+        for idx in range(self.len_services):
+            name = self.get_name(idx)
+            service = services[name]
+            self.assertEquals(result[name], (service.id, service.is_active, service.slow_threshold))
+
+            # .. services already in the ODB keep their IDs and configuration ..
+            if name in existing_ids:
+                self.assertEquals(service.id, existing_ids[name])
+                self.assertEquals(service.impl_name, 'impl.old.{}'.format(idx))
+                self.assertFalse(service.is_active)
+                self.assertEquals(service.slow_threshold, 123)
+
+            # .. whereas new ones are inserted with defaults.
+            else:
+                self.assertEquals(service.impl_name, 'impl.{}'.format(idx))
+                self.assertTrue(service.is_active)
+                self.assertEquals(service.slow_threshold, 99999)
+
+        # All of the services are now deployed on this server, with deployment information replaced if it existed before ..
+        deployed = self.get_deployed(self.server_id)
+        self.assertEquals(len(deployed), self.len_services)
+
+        for idx in range(self.len_services):
+            item = deployed[services[self.get_name(idx)].id]
+            self.assertEquals(item.details, 'details-{}'.format(idx))
+            self.assertEquals(item.deployment_time, self.now)
+            self.assertEquals(item.source, b'source-{}'.format(idx))
+            self.assertEquals(item.source_path, '/path/{}.py'.format(idx))
+            self.assertEquals(item.source_hash, 'hash-{}'.format(idx))
+
+        # .. but not on the other one.
+        deployed_other = self.get_deployed(self.other_server_id)
+        self.assertListEqual(sorted(deployed_other), sorted(existing_ids.values()))
+
+        for item in deployed_other.values():
+            self.assertEquals(item.details, 'old-details')
+
+# ################################################################################################################################
+
+    def test_add_services_chunk_size(self):
+
+        # Chunks of any size, including a single row, give the same results
+        for chunk_size in (1, 7, self.len_services, self.len_services + 1):
+            self.setUp()
+            self.add_existing()
+
+            items = [self.get_item(idx) for idx in range(self.len_services)]
+            result = self.odb.add_services(items, _chunk_size=chunk_size)
+
+            self.assertEquals(len(result), self.len_services)
+            self.assertEquals(len(self.get_services()), self.len_services)
+            self.assertEquals(len(self.get_deployed(self.server_id)), self.len_services)
+
+# ################################################################################################################################
+
+    def test_bulk_deployment(self):
+        self.add_existing()
+
+        store = ServiceStore(services={}, odb=self.odb, server=Bunch(name='server1'))
+
+        # In bulk mode, services are only collected ..
+        with store.bulk_deployment('test'):
+            for idx in range(self.len_services):
+                item = self.get_item(idx)
+                store.services[item.impl_name] = {'name': item.name}
+                store._bulk_items.append(item)
+
+            self.assertEquals(len(self.get_services()), 2)
+            self.assertListEqual([item.details for item in self.get_deployed(self.server_id).values()], ['old-details'])
+
+        # .. and they are added to the ODB when the deployment is finished ..
+        services = self.get_services()
+        self.assertEquals(len(services), self.len_services)
+        self.assertEquals(len(self.get_deployed(self.server_id)), self.len_services)
+        self.assertIsNone(store._bulk_items)
+
+        # .. after which the store knows their IDs and configuration from the ODB.
+        self.assertEquals(len(store.id_to_impl_name), self.len_services)
+        self.assertEquals(len(_TestService.added_to_store), self.len_services)
+
+        for idx in range(self.len_services):
+            name = self.get_name(idx)
+            impl_name = 'impl.{}'.format(idx)
+            service = services[name]
+
+            self.assertEquals(store.get_service_id_by_name(name), service.id)
+            self.assertEquals(store.id_to_impl_name[service.id], impl_name)
+            self.assertEquals(store.services[impl_name]['is_active'], service.is_active)
+            self.assertEquals(store.services[impl_name]['slow_threshold'], service.slow_threshold)
+
+        self.assertFalse(store.services['impl.0']['is_active'])
+        self.assertEquals(store.services['impl.1']['slow_threshold'], 123)
+        self.assertTrue(store.services['impl.2']['is_active'])
+
+# ################################################################################################################################
+
+    def test_bulk_deployment_fallback(self):
+        self.add_existing()
+
+        added = []
+
+        def add_service(name, impl_name, is_internal, deployment_time, details, source_info, service_info=None):
+            added.append(name)
+            return len(added), True, 100
+
+        # If services cannot be added in bulk, they are added one by one
+        self.odb.add_services = lambda items, timings: None
+        self.odb.add_service = add_service
+
+        store = ServiceStore(services={}, odb=self.odb, server=Bunch(name='server1'))
+
+        with store.bulk_deployment('test'):
+            for idx in range(3):
+                item = self.get_item(idx)
+                store.services[item.impl_name] = {'name': item.name}
+                store._bulk_items.append(item)
+
+        self.assertListEqual(added, [self.get_name(idx) for idx in range(3)])
+        self.assertDictEqual(store.id_to_impl_name, {1: 'impl.0', 2: 'impl.1', 3: 'impl.2'})
+        self.assertEquals(store.services['impl.2']['slow_threshold'], 100)
+
+# ################################################################################################################################
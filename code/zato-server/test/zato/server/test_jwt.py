@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Cryptography
+from cryptography.fernet import Fernet
+
+# Zato
+from zato.server.jwt import JWT
+
+# ################################################################################################################################
+
+class FakeCache(object):
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.puts = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def put(self, key, value, ttl, async=True):
+        self.puts += 1
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+# ################################################################################################################################
+
+class JWTTestCase(TestCase):
+
+    def get_jwt(self, renew_interval):
+        jwt = JWT(None, None, Fernet.generate_key(), renew_interval)
+        jwt.cache = FakeCache()
+
+        return jwt
+
+    def get_token(self, jwt, username='user1', ttl=100):
+        token = jwt._create_token(username=username, ttl=ttl)
+        jwt.cache.put(token, token, ttl, False)
+        jwt.cache.puts = 0
+
+        return token
+
+    def test_validate_renew_interval(self):
+        jwt = self.get_jwt(10)
+        token = self.get_token(jwt)
+
+        for now in (1000, 1001, 1009):
+            result = jwt.validate('user1', token, lambda: now)
+            self.assertTrue(result.valid)
+            self.assertEquals(result.token.username, 'user1')
+
+        # The shared cache was consulted and the token was renewed once only ..
+        self.assertEquals(jwt.cache.gets, 1)
+        self.assertEquals(jwt.cache.puts, 1)
+
+        # .. until the renewal interval elapsed.
+        self.assertTrue(jwt.validate('user1', token, lambda: 1010).valid)
+        self.assertEquals(jwt.cache.gets, 2)
+        self.assertEquals(jwt.cache.puts, 2)
+
+    def test_validate_renew_ttl(self):
+
+        # Tokens are renewed at least every half of their TTL, no matter the renewal interval
+        jwt = self.get_jwt(30)
+        token = self.get_token(jwt, ttl=10)
+
+        for now in (1000, 1004, 1005, 1009, 1010):
+            self.assertTrue(jwt.validate('user1', token, lambda: now).valid)
+
+        self.assertEquals(jwt.cache.puts, 3)
+
+    def test_validate_expired(self):
+        jwt = self.get_jwt(10)
+        token = self.get_token(jwt, ttl=10)
+
+        self.assertTrue(jwt.validate('user1', token, lambda: 1000).valid)
+
+        # Not used for longer than its TTL, the token is gone from the shared cache too
+        jwt.cache.data.clear()
+
+        result = jwt.validate('user1', token, lambda: 1011)
+        self.assertFalse(result.valid)
+        self.assertEquals(result.message, 'Invalid token')
+        self.assertNotIn(token, jwt.verified)
+
+    def test_validate_unexpected_user(self):
+        jwt = self.get_jwt(10)
+        token = self.get_token(jwt)
+
+        self.assertTrue(jwt.validate('user1', token, lambda: 1000).valid)
+
+        for now in (1001, 1020):
+            result = jwt.validate('user2', token, lambda: now)
+            self.assertFalse(result.valid)
+            self.assertEquals(result.message, 'Unexpected user for token found')
+
+    def test_delete(self):
+        jwt = self.get_jwt(10)
+        token = self.get_token(jwt)
+
+        self.assertTrue(jwt.validate('user1', token, lambda: 1000).valid)
+
+        jwt.delete(token)
+        self.assertFalse(jwt.validate('user1', token, lambda: 1001).valid)
+
+# ################################################################################################################################
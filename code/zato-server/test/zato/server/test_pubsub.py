@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from gc import get_referents
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+from gevent.lock import RLock
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import PUBSUB
+from zato.common.exception import BadRequest
+from zato.common.odb.model import Base, PubSubEndpointEnqueuedMessage, PubSubMessage
+from zato.common.odb.query.pubsub.delivery import confirm_pubsub_msg_delivered
+from zato.common.odb.query.pubsub.publish import sql_publish_with_retry
+from zato.common.util.time_ import utcnow_as_ms
+from zato.server.pubsub import DeliveryConfirmationBuffer, GDPubBatcher, InRAMSyncBacklog, PubSubHousekeeper
+from zato.server.pubsub.task import DeliveryTask, NonGDMessage, SortedList
+
+# ################################################################################################################################
+
+class InRAMSyncBacklogTestCase(TestCase):
+
+    def get_backlog(self):
+        backlog = InRAMSyncBacklog(Bunch(server=Bunch(name='test', pid=1)))
+        expiration_time = utcnow_as_ms() + 3600
+
+        backlog.add_messages('cid1', 1, 'topic1', 100, ['sk1', 'sk2'], [
+            {'pub_msg_id': 'msg1', 'expiration_time': expiration_time},
+            {'pub_msg_id': 'msg2', 'expiration_time': expiration_time},
+        ])
+
+        backlog.add_messages('cid2', 2, 'topic2', 100, ['sk3'], [
+            {'pub_msg_id': 'msg3', 'expiration_time': expiration_time},
+        ])
+
+        return backlog
+
+    def assert_empty(self, backlog):
+        self.assertDictEqual(backlog.msg_id_to_msg, {})
+        self.assertDictEqual(backlog.msg_id_to_sub_key, {})
+        self.assertDictEqual(backlog.msg_id_to_topic_id, {})
+
+        for value in backlog.topic_msg_id.values() + backlog.sub_key_to_msg_id.values():
+            self.assertSetEqual(value, set())
+
+    def test_add_messages(self):
+        backlog = self.get_backlog()
+
+        self.assertDictEqual(backlog.msg_id_to_topic_id, {'msg1': 1, 'msg2': 1, 'msg3': 2})
+        self.assertSetEqual(backlog.msg_id_to_sub_key['msg1'], {'sk1', 'sk2'})
+        self.assertSetEqual(backlog.sub_key_to_msg_id['sk3'], {'msg3'})
+        self.assertEquals(backlog.get_topic_depth(1), 2)
+
+    def test_delete_messages(self):
+        backlog = self.get_backlog()
+
+        backlog.delete_messages(['msg1', 'msg3'])
+
+        self.assertSetEqual(set(backlog.msg_id_to_msg), {'msg2'})
+        self.assertSetEqual(backlog.topic_msg_id[1], {'msg2'})
+        self.assertSetEqual(backlog.topic_msg_id[2], set())
+        self.assertSetEqual(backlog.sub_key_to_msg_id['sk1'], {'msg2'})
+        self.assertSetEqual(backlog.sub_key_to_msg_id['sk2'], {'msg2'})
+        self.assertSetEqual(backlog.sub_key_to_msg_id['sk3'], set())
+
+        backlog.delete_msg_by_id('msg2')
+        self.assert_empty(backlog)
+
+    def test_retrieve_messages_by_sub_keys(self):
+        backlog = self.get_backlog()
+
+        out = backlog.retrieve_messages_by_sub_keys(1, ['sk1'])
+
+        self.assertSetEqual({msg['pub_msg_id'] for msg in out}, {'msg1', 'msg2'})
+        self.assertSetEqual(set(backlog.msg_id_to_msg), {'msg3'})
+        self.assertSetEqual(backlog.sub_key_to_msg_id['sk2'], set())
+
+    def test_unsubscribe(self):
+        backlog = self.get_backlog()
+
+        # sk2 still waits for both messages so they are kept ..
+        backlog.unsubscribe(1, 'topic1', ['sk1'])
+        self.assertSetEqual(set(backlog.msg_id_to_msg), {'msg1', 'msg2', 'msg3'})
+        self.assertNotIn('sk1', backlog.sub_key_to_msg_id)
+        self.assertSetEqual(backlog.msg_id_to_sub_key['msg1'], {'sk2'})
+
+        # .. until it unsubscribes too.
+        backlog.unsubscribe(1, 'topic1', ['sk2'])
+        backlog.unsubscribe(2, 'topic2', ['sk3'])
+
+        self.assert_empty(backlog)
+
+# ################################################################################################################################
+
+class GDPubBatcherTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+
+        self.session = sessionmaker(bind=engine)
+        self.sessions_created = 0
+
+    def get_batcher(self, max_size=100):
+
+        def get_session():
+            self.sessions_created += 1
+            return self.session()
+
+        return GDPubBatcher(Bunch(server=Bunch(odb=Bunch(session=get_session))), 10, max_size)
+
+    def get_topic(self):
+        return Bunch(id=1, name='/test')
+
+    def get_ctx(self, topic, *msg_ids):
+        subscriptions_by_topic = [Bunch(sub_key='sk1', endpoint_id=1)]
+        now = utcnow_as_ms()
+
+        gd_msg_list = [{'pub_msg_id': msg_id, 'pub_pattern_matched': 'pub=/*', 'pub_time': now, 'data': 'abc',
+            'data_prefix': 'abc', 'data_prefix_short': 'abc', 'size': 3, 'published_by_id': 1, 'topic_id': topic.id,
+            'cluster_id': 1, 'is_in_sub_queue': False, 'sub_pattern_matched': {'sk1': 'sub=/*'}} for msg_id in msg_ids]
+
+        return Bunch(cluster_id=1, topic=topic, subscriptions_by_topic=subscriptions_by_topic, gd_msg_list=gd_msg_list,
+            now=now, current_depth=None)
+
+    def publish(self, batcher, ctx_list):
+        greenlets = [spawn(batcher.publish, 'cid{}'.format(idx), ctx) for idx, ctx in enumerate(ctx_list)]
+        for greenlet in greenlets:
+            greenlet.join()
+
+        return greenlets
+
+    def get_msg_ids(self, table):
+        session = self.session()
+        return sorted(elem.pub_msg_id for elem in session.query(table).all())
+
+    def test_publish_batch(self):
+        batcher = self.get_batcher()
+        topic = self.get_topic()
+
+        greenlets = self.publish(batcher, [self.get_ctx(topic, 'msg1', 'msg2'), self.get_ctx(topic, 'msg3')])
+
+        # All the publications were committed in one transaction
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+        self.assertEquals(self.sessions_created, 1)
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg1', 'msg2', 'msg3'])
+        self.assertListEqual(self.get_msg_ids(PubSubEndpointEnqueuedMessage), ['msg1', 'msg2', 'msg3'])
+        self.assertDictEqual(batcher.batches, {})
+
+    def test_publish_max_size(self):
+        batcher = self.get_batcher(max_size=2)
+        topic = self.get_topic()
+
+        greenlets = self.publish(batcher, [self.get_ctx(topic, 'msg{}'.format(idx)) for idx in range(5)])
+
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+        self.assertEquals(self.sessions_created, 3)
+        self.assertEquals(len(self.get_msg_ids(PubSubMessage)), 5)
+
+    def test_publish_duplicate_msg_id(self):
+        batcher = self.get_batcher()
+        topic = self.get_topic()
+
+        greenlets = self.publish(batcher, [self.get_ctx(topic, 'msg1'), self.get_ctx(topic, 'msg2', 'msg1')])
+
+        # Only the publisher of the duplicate message receives an exception
+        self.assertTrue(greenlets[0].successful())
+        self.assertIsInstance(greenlets[1].exception, (BadRequest, IntegrityError))
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg1'])
+
+    def test_publish_base_exception(self):
+
+        class _Interrupted(BaseException):
+            pass
+
+        def get_session():
+            raise _Interrupted()
+
+        batcher = self.get_batcher()
+        batcher.pubsub.server.odb.session = get_session
+        topic = self.get_topic()
+
+        greenlets = [spawn(batcher.publish, 'cid{}'.format(idx), self.get_ctx(topic, 'msg{}'.format(idx)))
+            for idx in range(3)]
+
+        for greenlet in greenlets:
+            greenlet.join(5)
+
+        # Publishers do not wait forever even if exceptions other than Exception subclasses are raised
+        for greenlet in greenlets:
+            self.assertTrue(greenlet.ready())
+            self.assertIsInstance(greenlet.exception, _Interrupted)
+
+# ################################################################################################################################
+
+class PubSubHousekeeperTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+
+        self.session = sessionmaker(bind=engine)
+        self.now = utcnow_as_ms()
+
+    def get_housekeeper(self, is_first_worker=True):
+        self.topic = Bunch(id=1, name='/test', gd_depth=0)
+        self.topic2 = Bunch(id=2, name='/test2', gd_depth=5)
+
+        pubsub = Bunch(cluster_id=1, lock=RLock(), keep_running=True, topics={1: self.topic, 2: self.topic2},
+            server=Bunch(is_first_worker=is_first_worker, odb=Bunch(session=self.session)))
+
+        return PubSubHousekeeper(pubsub, 1, 2)
+
+    def publish(self, msg_ids, expiration_time, sub_keys=()):
+        subscriptions_by_topic = [Bunch(sub_key=sub_key, endpoint_id=1) for sub_key in sub_keys]
+
+        gd_msg_list = [{'pub_msg_id': msg_id, 'pub_pattern_matched': 'pub=/*', 'pub_time': self.now, 'data': 'abc',
+            'data_prefix': 'abc', 'data_prefix_short': 'abc', 'size': 3, 'published_by_id': 1, 'topic_id': 1,
+            'cluster_id': 1, 'expiration_time': expiration_time, 'is_in_sub_queue': bool(sub_keys),
+            'sub_pattern_matched': dict.fromkeys(sub_keys, 'sub=/*')} for msg_id in msg_ids]
+
+        session = self.session()
+        sql_publish_with_retry(session, 'cid1', 1, 1, subscriptions_by_topic, gd_msg_list, self.now)
+        session.commit()
+
+    def get_msg_ids(self, table):
+        session = self.session()
+        return sorted(elem.pub_msg_id for elem in session.query(table).all())
+
+    def test_run_once(self):
+        housekeeper = self.get_housekeeper()
+
+        # There are more expired messages than a single batch can delete
+        self.publish(['msg1', 'msg2', 'msg3', 'msg4', 'msg5'], self.now - 10)
+        self.publish(['msg6'], self.now + 3600)
+        self.publish(['msg7', 'msg8'], self.now + 3600, ['sk1'])
+
+        housekeeper.run_once()
+
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg6', 'msg7', 'msg8'])
+        self.assertEquals(self.topic.gd_depth, 1)
+        self.assertEquals(self.topic2.gd_depth, 0)
+
+        # Messages delivered are deleted too
+        session = self.session()
+        confirm_pubsub_msg_delivered(session, 1, 'sk1', ['msg7'], self.now)
+        session.commit()
+
+        housekeeper.run_once()
+
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg6', 'msg8'])
+        self.assertListEqual(self.get_msg_ids(PubSubEndpointEnqueuedMessage), ['msg8'])
+
+    def test_run_once_not_first_worker(self):
+        housekeeper = self.get_housekeeper(False)
+
+        self.publish(['msg1', 'msg2'], self.now - 10)
+        self.publish(['msg3'], self.now + 3600, ['sk1'])
+
+        # Depths are refreshed but only the first worker deletes messages
+        housekeeper.run_once()
+
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg1', 'msg2', 'msg3'])
+        self.assertEquals(self.topic.gd_depth, 2)
+
+    def test_run_once_topic_error(self):
+        housekeeper = self.get_housekeeper()
+
+        self.publish(['msg1', 'msg2'], self.now - 10)
+        self.publish(['msg3'], self.now + 3600)
+
+        cleanup_topic = housekeeper.cleanup_topic
+        cleaned_up = []
+
+        def _cleanup_topic(session, cluster_id, topic_id, now):
+            if topic_id == 2:
+                raise Exception('Test exception')
+            cleanup_topic(session, cluster_id, topic_id, now)
+            cleaned_up.append(topic_id)
+
+        housekeeper.cleanup_topic = _cleanup_topic
+
+        # A topic that cannot be cleaned up does not stop the other ones, whichever order they are in
+        housekeeper.run_once()
+
+        self.assertListEqual(cleaned_up, [1])
+        self.assertListEqual(self.get_msg_ids(PubSubMessage), ['msg3'])
+        self.assertEquals(self.topic.gd_depth, 1)
+
+# ################################################################################################################################
+
+class DeliveryConfirmationBufferTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+
+        self.session = sessionmaker(bind=engine)
+        self.sessions_created = 0
+
+        now = utcnow_as_ms()
+        subscriptions_by_topic = [Bunch(sub_key='sk1', endpoint_id=1), Bunch(sub_key='sk2', endpoint_id=2)]
+
+        gd_msg_list = [{'pub_msg_id': msg_id, 'pub_pattern_matched': 'pub=/*', 'pub_time': now, 'data': 'abc',
+            'data_prefix': 'abc', 'data_prefix_short': 'abc', 'size': 3, 'published_by_id': 1, 'topic_id': 1,
+            'cluster_id': 1, 'expiration_time': now + 3600, 'is_in_sub_queue': True,
+            'sub_pattern_matched': {'sk1': 'sub=/*', 'sk2': 'sub=/*'}} for msg_id in ('msg1', 'msg2', 'msg3')]
+
+        session = self.session()
+        sql_publish_with_retry(session, 'cid1', 1, 1, subscriptions_by_topic, gd_msg_list, now)
+        session.commit()
+
+    def get_buffer(self, max_size=100):
+
+        def get_session():
+            self.sessions_created += 1
+            return self.session()
+
+        pubsub = Bunch(cluster_id=1, keep_running=True, server=Bunch(odb=Bunch(session=get_session)))
+
+        return DeliveryConfirmationBuffer(pubsub, 10, max_size)
+
+    def get_queue_ids(self, sub_key, *msg_ids):
+        session = self.session()
+        return [elem.id for elem in session.query(PubSubEndpointEnqueuedMessage).\
+            filter(PubSubEndpointEnqueuedMessage.sub_key==sub_key).\
+            filter(PubSubEndpointEnqueuedMessage.pub_msg_id.in_(msg_ids)).\
+            all()]
+
+    def get_delivered(self):
+        session = self.session()
+        return sorted((elem.sub_key, elem.pub_msg_id) for elem in session.query(PubSubEndpointEnqueuedMessage).\
+            filter(PubSubEndpointEnqueuedMessage.delivery_status==PUBSUB.DELIVERY_STATUS.DELIVERED).\
+            all())
+
+    def test_flush(self):
+        buffer = self.get_buffer()
+
+        sk1_ids = self.get_queue_ids('sk1', 'msg1', 'msg2')
+        sk2_ids = self.get_queue_ids('sk2', 'msg3')
+
+        buffer.add('sk1', sk1_ids[:1])
+        buffer.add('sk1', sk1_ids[1:])
+        buffer.add('sk2', sk2_ids)
+
+        # Nothing is in SQL yet but delivery tasks know which messages not to fetch again
+        self.assertListEqual(self.get_delivered(), [])
+        self.assertSetEqual(buffer.get_pending('sk1'), set(sk1_ids))
+
+        buffer.flush()
+
+        # Confirmations for all sub_keys were stored in one transaction
+        self.assertEquals(self.sessions_created, 1)
+        self.assertListEqual(self.get_delivered(), [('sk1', 'msg1'), ('sk1', 'msg2'), ('sk2', 'msg3')])
+        self.assertSetEqual(buffer.get_pending('sk1'), set())
+
+        # There is nothing to flush now
+        buffer.flush()
+        self.assertEquals(self.sessions_created, 1)
+
+    def test_flush_error(self):
+        buffer = self.get_buffer()
+        sk1_ids = self.get_queue_ids('sk1', 'msg1')
+
+        buffer.add('sk1', sk1_ids)
+        buffer.pubsub.server.odb.session = lambda: 1/0
+
+        # Confirmations are kept until they can be flushed
+        self.assertRaises(ZeroDivisionError, buffer.flush)
+        self.assertSetEqual(buffer.get_pending('sk1'), set(sk1_ids))
+
+        buffer.pubsub.server.odb.session = self.session
+        buffer.flush()
+
+        self.assertListEqual(self.get_delivered(), [('sk1', 'msg1')])
+
+    def test_run_max_size(self):
+        buffer = self.get_buffer(max_size=2)
+        buffer.interval = 10
+        greenlet = spawn(buffer.run)
+
+        try:
+            buffer.add('sk1', self.get_queue_ids('sk1', 'msg1'))
+            sleep(0.01)
+            self.assertListEqual(self.get_delivered(), [])
+
+            # The buffer is full so it is flushed without waiting for the interval to elapse
+            buffer.add('sk2', self.get_queue_ids('sk2', 'msg1'))
+            sleep(0.01)
+            self.assertListEqual(self.get_delivered(), [('sk1', 'msg1'), ('sk2', 'msg1')])
+
+        finally:
+            buffer.pubsub.keep_running = False
+            buffer.flush_event.set()
+            greenlet.join()
+
+# ################################################################################################################################
+
+class SortedListTestCase(TestCase):
+
+    def get_msg(self, pub_msg_id, pub_time, priority=None, ext_pub_time=None, sub_key='sk1'):
+        return NonGDMessage(sub_key, 'test', 1, {
+            'pub_msg_id': pub_msg_id, 'pub_time': pub_time, 'ext_pub_time': ext_pub_time, 'data': '', 'priority': priority,
+            'expiration': 3600, 'expiration_time': pub_time + 3600, 'topic_name': '/test', 'size': 0, 'published_by_id': 1,
+            'pub_pattern_matched': None, 'reply_to_sk': [], 'deliver_to_sk': [], 'sub_pattern_matched': {sub_key: None},
+        })
+
+    def test_message_slots(self):
+        msg = self.get_msg('msg1', 1.0)
+
+        # Regular attributes do not need an instance dict ..
+        self.assertFalse([elem for elem in get_referents(msg) if type(elem) is dict])
+        self.assertTupleEqual(msg.sort_key, (4, None, 1.0))
+
+        # .. but opaque ones can still be set.
+        msg.my_attr = 123
+        self.assertEquals(msg.my_attr, 123)
+        self.assertEquals(msg.to_dict()['pub_msg_id'], 'msg1')
+
+    def test_sort_order(self):
+        msg1 = self.get_msg('msg1', 3.0)
+        msg2 = self.get_msg('msg2', 2.0)
+        msg3 = self.get_msg('msg3', 1.0, priority=9)
+        msg4 = self.get_msg('msg4', 0.5, ext_pub_time=0.1)
+
+        delivery_list = SortedList([msg1, msg2, msg3, msg4])
+        self.assertListEqual([msg.pub_msg_id for msg in delivery_list], ['msg3', 'msg2', 'msg1', 'msg4'])
+
+    def test_remove_pubsub_msg(self):
+
+        # All messages share the same sort key and span several sublists
+        msg_list = [self.get_msg('msg{}'.format(idx), 1.0) for idx in range(10)]
+        delivery_list = SortedList(msg_list, load=2)
+
+        for msg in reversed(msg_list):
+            delivery_list.remove_pubsub_msg(msg)
+
+        self.assertEquals(len(delivery_list), 0)
+        self.assertRaises(ValueError, delivery_list.remove_pubsub_msg, msg_list[0])
+
+# ################################################################################################################################
+
+class DeliveryTaskTestCase(TestCase):
+
+    def get_task(self, delivered):
+        pubsub_tool = Bunch(enqueue_initial_messages=lambda *args: None)
+        pubsub = Bunch(get_before_delivery_hook=lambda sub_key: None)
+
+        sub_config = Bunch(topic_name='topic1', wait_sock_err=1, wait_non_sock_err=1, task_delivery_interval=0,
+            delivery_max_retry=10, delivery_method=PUBSUB.DELIVERY_METHOD.NOTIFY.id, delivery_batch_size=10,
+            wrap_one_msg_in_list=True, endpoint_name='endpoint1')
+
+        def deliver_pubsub_msg(sub_key, msg_list):
+            delivered.extend(msg_list)
+
+        return DeliveryTask(pubsub_tool, pubsub, 'sk1', RLock(), SortedList(), deliver_pubsub_msg,
+            lambda *args: None, sub_config)
+
+    def test_wake_up(self):
+        delivered = []
+        task = self.get_task(delivered)
+
+        # The task is idle and would not check its delivery list again for a few seconds ..
+        sleep(0.01)
+
+        try:
+            msg = Bunch(pub_msg_id='msg1', delivery_count=0, priority=5, ext_pub_time=None, pub_time=1.0,
+                sort_key=(4, None, 1.0))
+            task.delivery_list.add(msg)
+
+            # .. but it is woken up as soon as it has a new message.
+            task.wake_up()
+            sleep(0.05)
+
+            self.assertListEqual(delivered, [msg])
+            self.assertEquals(len(task.delivery_list), 0)
+
+        finally:
+            task.stop()
@@ -792,3 +792,80 @@ class IsAllowedTestCase(TestCase):
         self.assertFalse(rbac.is_role_allowed(role_id1, perm_id1, res_name2))
 
 # ################################################################################################################################
+
+class ClientDefIndexTestCase(TestCase):
+
+    def get_rbac(self):
+
+        rbac = RBAC()
+
+        rbac.create_permission(11, 'Read')
+        rbac.create_permission(22, 'Create')
+        rbac.set_http_permissions()
+
+        rbac.create_role(1, 'role1', None)
+        rbac.create_role(2, 'role2', None)
+
+        rbac.create_resource('service1')
+        rbac.create_resource('service2')
+
+        rbac.create_client_role('sec_def:::jwt:::jwt1', 1)
+        rbac.create_client_role('sec_def:::basic_auth:::basic2', 1)
+        rbac.create_client_role('sec_def:::basic_auth:::basic1', 2)
+
+        rbac.create_role_permission_allow(1, 11, 'service1')
+        rbac.create_role_permission_allow(2, 11, 'service1')
+        rbac.create_role_permission_allow(2, 22, 'service2')
+
+        return rbac
+
+# ################################################################################################################################
+
+    def test_get_client_defs(self):
+
+        rbac = self.get_rbac()
+
+        self.assertListEqual(rbac.get_client_defs(11, 'service1'), [
+            ('basic_auth', [('basic1', 'sec_def:::basic_auth:::basic1'), ('basic2', 'sec_def:::basic_auth:::basic2')]),
+            ('jwt', [('jwt1', 'sec_def:::jwt:::jwt1')]),
+        ])
+
+        self.assertListEqual(rbac.get_client_defs(22, 'service2'), [
+            ('basic_auth', [('basic1', 'sec_def:::basic_auth:::basic1')])])
+
+        self.assertListEqual(rbac.get_client_defs(22, 'service1'), [])
+
+# ################################################################################################################################
+
+    def test_get_client_defs_invalidated(self):
+
+        rbac = self.get_rbac()
+        rbac.get_client_defs(11, 'service1')
+
+        rbac.delete_client_role('sec_def:::jwt:::jwt1', 1)
+        self.assertListEqual([elem[0] for elem in rbac.get_client_defs(11, 'service1')], ['basic_auth'])
+
+        rbac.delete_role_permission_allow(2, 22, 'service2')
+        self.assertListEqual(rbac.get_client_defs(22, 'service2'), [])
+
+        rbac.delete_resource('service1')
+        self.assertListEqual(rbac.get_client_defs(11, 'service1'), [])
+
+# ################################################################################################################################
+
+    def test_is_http_client_allowed_invalidated(self):
+
+        rbac = self.get_rbac()
+        client_def = 'sec_def:::basic_auth:::basic1'
+
+        self.assertTrue(rbac.is_http_client_allowed(client_def, 'GET', 'service1'))
+        self.assertFalse(rbac.is_http_client_allowed(client_def, 'POST', 'service1'))
+        self.assertEquals(len(rbac.http_decisions), 2)
+
+        rbac.create_role_permission_allow(2, 22, 'service1')
+        self.assertTrue(rbac.is_http_client_allowed(client_def, 'POST', 'service1'))
+
+        rbac.delete_client_role(client_def, 2)
+        self.assertFalse(rbac.is_http_client_allowed(client_def, 'GET', 'service1'))
+
+# ################################################################################################################################
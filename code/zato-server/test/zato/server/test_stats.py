@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from random import randint, seed
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# SciPy
+from scipy import stats as sp_stats
+
+# Zato
+from zato.common import KVDB
+from zato.server.stats import get_raw_time_elems, get_time_bucket, parse_raw_time_elem, score_at_percentile, \
+     ServiceStatsAggregator, trimmed_mean
+
+# ################################################################################################################################
+
+class FakePipeline(object):
+    def __init__(self, commands):
+        self.commands = commands
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def __getattr__(self, name):
+        def _command(*args):
+            self.commands.append((name,) + args)
+        return _command
+
+    def execute(self):
+        self.commands.append(('execute',))
+
+# ################################################################################################################################
+
+class FakeConn(object):
+    def __init__(self):
+        self.commands = []
+
+    def pipeline(self):
+        return FakePipeline(self.commands)
+
+# ################################################################################################################################
+
+class TimeBucketTestCase(TestCase):
+
+    def test_get_time_bucket(self):
+        self.assertEquals(get_time_bucket(0), 0)
+        self.assertEquals(get_time_bucket(999), 999)
+        self.assertEquals(get_time_bucket(1234), 1230)
+        self.assertEquals(get_time_bucket(98765), 98700)
+
+    def test_raw_time_elems(self):
+        elems = get_raw_time_elems({5:1, 3:2, 1230:10})
+        self.assertListEqual(elems, ['3:2', '5', '1230:10'])
+        self.assertListEqual([parse_raw_time_elem(elem) for elem in elems], [(3, 2), (5, 1), (1230, 10)])
+
+    def test_same_as_scipy(self):
+        seed(1)
+
+        for _ in range(100):
+            times = [randint(0, 50) for _ in range(randint(1, 200))]
+            histogram = {}
+            for value in times:
+                histogram[value] = histogram.get(value, 0) + 1
+            pairs = sorted(parse_raw_time_elem(elem) for elem in get_raw_time_elems(histogram))
+
+            for percentile in (0, 25, 50, 90, 99, 100):
+                expected_score = sp_stats.scoreatpercentile(times, percentile)
+                self.assertAlmostEquals(score_at_percentile(pairs, percentile), expected_score)
+                self.assertAlmostEquals(trimmed_mean(pairs, expected_score), sp_stats.tmean(times, (None, expected_score)))
+
+# ################################################################################################################################
+
+class ServiceStatsAggregatorTestCase(TestCase):
+
+    def test_flush(self):
+        conn = FakeConn()
+        aggr = ServiceStatsAggregator(Bunch(conn=conn))
+
+        now = datetime(2018, 1, 2, 3, 4, 5)
+        later = datetime(2018, 1, 2, 3, 5, 1)
+
+        self.assertEquals(aggr.incr_usage('a'), 1)
+        self.assertEquals(aggr.incr_usage('a'), 2)
+        self.assertEquals(aggr.incr_usage('b'), 1)
+
+        aggr.add_time('a', 10, now)
+        aggr.add_time('a', 10, now)
+        aggr.add_time('a', 12, later)
+        aggr.add_time('b', 1234, now)
+
+        aggr.flush()
+        commands = conn.commands
+
+        self.assertEquals(commands[-1], ('execute',))
+        self.assertItemsEqual(commands[:-1], [
+            ('incr', KVDB.SERVICE_USAGE + 'a', 2),
+            ('incr', KVDB.SERVICE_USAGE + 'b', 1),
+            ('hset', KVDB.SERVICE_TIME_BASIC + 'a', 'last', 12),
+            ('hset', KVDB.SERVICE_TIME_BASIC + 'b', 'last', 1234),
+            ('rpush', KVDB.SERVICE_TIME_RAW + 'a', '10:2', '12'),
+            ('rpush', KVDB.SERVICE_TIME_RAW + 'b', '1230'),
+            ('rpush', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'a:2018:01:02:03:04', '10:2'),
+            ('expire', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'a:2018:01:02:03:04', 300),
+            ('rpush', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'a:2018:01:02:03:05', '12'),
+            ('expire', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'a:2018:01:02:03:05', 300),
+            ('rpush', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'b:2018:01:02:03:04', '1230'),
+            ('expire', KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'b:2018:01:02:03:04', 300),
+        ])
+
+        # Nothing to flush, nothing is sent to KVDB
+        del commands[:]
+        aggr.flush()
+        self.assertListEqual(commands, [])
+
+        # Usage returned to services is cumulative but only new invocations are flushed
+        self.assertEquals(aggr.incr_usage('a'), 3)
+        aggr.flush()
+        self.assertListEqual(commands, [('incr', KVDB.SERVICE_USAGE + 'a', 1), ('execute',)])
+
+# ################################################################################################################################